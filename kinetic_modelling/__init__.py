@@ -0,0 +1,75 @@
+"""Analysis code of the figures as one importable package.
+
+The modules stay in the folders of their figures and import each other
+by name, so the scripts still run from their folders as before. The
+package only adds the folder of a module to sys.path and imports it
+the first time it is used; nothing is imported with the package itself,
+and matplotlib, scipy.interpolate and xlrd are only imported by the
+functions that plot or read Excel files::
+
+    import kinetic_modelling as km
+    tables = km.catmap_tables.energy_tables(charging_curves, potentials)
+    km.surrogate.SurrogateLibrary.from_file('aiida_output/kinetic_model_data.json')
+
+The stages of the analysis are also subcommands of one command line,
+see ``python -m kinetic_modelling --help`` (cli.py).
+"""
+
+import sys
+import importlib
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+## folders of the stages of the analysis
+STAGES = {
+    'free_energy': ROOT / 'figure_2_free_energy_diagram',
+    'kinetics': ROOT / 'figure_3_kinetics' / 'analysis',
+}
+
+## modules of every stage; modules shared by several figures are kept in one folder
+MODULES = {
+    'computational_panel': 'free_energy',
+    'molecule': 'free_energy',
+    'catmap_tables': 'free_energy',
+    'double_layer': 'free_energy',
+    'uncertainty': 'free_energy',
+    'db_query': 'free_energy',
+    'experimental_data': 'free_energy',
+    'tafel': 'free_energy',
+    'charging_predictor': 'free_energy',
+    'energy_table': 'kinetics',
+    'scaling': 'kinetics',
+    'microkinetics': 'kinetics',
+    'adaptive_mesh': 'kinetics',
+    'surrogate': 'kinetics',
+    'screening': 'kinetics',
+    'server': 'kinetics',
+    'plot_kinetics_figure': 'kinetics',
+}
+
+
+def add_stage(stage):
+    """Put the folder of a stage on sys.path and return it."""
+    folder = str(STAGES[stage])
+    if folder not in sys.path:
+        sys.path.append(folder)
+    return STAGES[stage]
+
+
+def load(name):
+    """Import a module of the analysis by name."""
+    add_stage(MODULES[name])
+    return importlib.import_module(name)
+
+
+def __getattr__(name):
+    if name in MODULES:
+        module = load(name)
+        globals()[name] = module
+        return module
+    raise AttributeError('module %r has no attribute %r'%(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(MODULES))
@@ -0,0 +1,3 @@
+from kinetic_modelling.cli import main
+
+main(prog_name='python -m kinetic_modelling')
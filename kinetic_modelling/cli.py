@@ -0,0 +1,73 @@
+"""One command line for the stages of the analysis.
+
+    python -m kinetic_modelling --help
+    python -m kinetic_modelling tables --potential -0.8 --potential -1.0
+    python -m kinetic_modelling microkinetics --energy_file ../energy_files/catmap_potential_-0.80.txt
+
+Every subcommand is the main function of a module (or the script main.py
+of Figure 2) and runs in the folder of its stage, like the scripts, so
+relative paths are relative to that folder. A module is only imported
+when its subcommand runs.
+"""
+
+import os
+import sys
+import runpy
+import click
+from kinetic_modelling import STAGES, add_stage, load
+
+## subcommand -> stage, module and help
+COMMANDS = {
+    'tables': ('free_energy', 'catmap_tables', 'CatMAP energy files of all potentials, without plots'),
+    'figure2': ('free_energy', 'main', 'Figure 2 with the free energy diagrams (options of main.py)'),
+    'db-index': ('free_energy', 'db_query', 'Create the column indices of the databases'),
+    'charging-plan': ('free_energy', 'charging_predictor', 'Predicted charging curve slopes and the calculations still needed'),
+    'microkinetics': ('kinetics', 'microkinetics', 'Rate, coverage and degree of rate control maps'),
+    'adaptive-mesh': ('kinetics', 'adaptive_mesh', 'Rate and coverage maps on an adaptive mesh'),
+    'surrogate': ('kinetics', 'surrogate', 'Held-out error and query time of the map surrogates'),
+    'screen': ('kinetics', 'screening', 'Rank candidate catalysts on a stored map'),
+    'serve': ('kinetics', 'server', 'Serve queries on the kinetic maps on localhost'),
+    'figure3': ('kinetics', 'plot_kinetics_figure', 'Figure 3 with the rate and coverage maps'),
+}
+
+## subcommands running a script as __main__, with its own options
+SCRIPTS = ('figure2', 'figure3')
+
+
+def _run_script(stage, script):
+    """Subcommand running a script of a stage with the remaining arguments."""
+    @click.command(context_settings={'ignore_unknown_options': True, 'help_option_names': []})
+    @click.argument('args', nargs=-1, type=click.UNPROCESSED)
+    def command(args):
+        sys.argv = [script + '.py'] + list(args)
+        runpy.run_path(str(STAGES[stage] / (script + '.py')), run_name='__main__')
+    return command
+
+
+class LazyGroup(click.Group):
+    """Group that imports the module of a subcommand only when it runs."""
+
+    def list_commands(self, ctx):
+        return list(COMMANDS)
+
+    def get_command(self, ctx, name):
+        if name not in COMMANDS:
+            return None
+        stage, module, _ = COMMANDS[name]
+        os.chdir(add_stage(stage))
+        if name in SCRIPTS:
+            return _run_script(stage, module)
+        return load(module).main
+
+    def format_commands(self, ctx, formatter):
+        with formatter.section('Commands'):
+            formatter.write_dl([(name, help) for name, (_, _, help) in COMMANDS.items()])
+
+
+@click.group(cls=LazyGroup)
+def main():
+    """Stages of the analysis, from the free energies (Figure 2) to the kinetic maps (Figure 3)."""
+
+
+if __name__ == '__main__':
+    main()
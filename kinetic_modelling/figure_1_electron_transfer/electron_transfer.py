@@ -0,0 +1,155 @@
+"""Newns-Anderson model of the adsorbate level and the electron transfer rate.
+
+All functions broadcast over their arguments, so a grid of widths,
+levels and energies is evaluated in one call, e.g.
+``lorentz_dos(width[:, None, None], level[None, :, None], energy)``.
+The energy axis must always be the last one.
+"""
+
+import sys
+from pathlib import Path
+import numpy as np
+from scipy.signal import hilbert
+from scipy.optimize import least_squares
+from scipy.sparse import block_diag
+
+HBAR = 6.582 * 1e-16 # eV.s
+
+
+def lorentz_dos(a, b1, energy):
+    """Lorentzian adsorbate level of width a centred at b1."""
+    return 1 / np.pi * ( a / ( (energy - b1)**2 + a**2 ) )
+
+
+def transfer_rate(width):
+    """Electron transfer rate 2 pi Delta / hbar in 1/s for a width Delta in eV."""
+    return 2 * np.pi / HBAR * np.asarray(width)
+
+
+def semi_elliptic_delta(energy, centre, half_width, coupling):
+    """Chemisorption function of a level coupled to a semi-elliptic band
+
+    :param energy: energies (last axis)
+    :type energy: np.ndarray
+    :param centre: centre of the band, e.g. the d-band centre
+    :type centre: float or np.ndarray
+    :param half_width: half width of the band
+    :type half_width: float or np.ndarray
+    :param coupling: coupling matrix element V
+    :type coupling: float or np.ndarray
+    :return: Delta(energy) normalised so that int Delta = pi V^2
+    :rtype: np.ndarray
+    """
+    x = (energy - centre) / half_width
+    band = 2 / (np.pi * half_width) * np.sqrt(np.clip(1 - x**2, 0, None))
+    return np.pi * coupling**2 * band
+
+
+def hilbert_partner(delta):
+    """Lambda(energy), the Hilbert transform of Delta along the last axis.
+
+    The energy grid has to be uniform and Delta should go to zero at
+    both ends of the grid.
+    """
+    return np.imag(hilbert(delta, axis=-1))
+
+
+def newns_anderson_dos(energy, level, delta, lambda_=None):
+    """Adsorbate projected DOS in the Newns-Anderson model
+
+    :param energy: energies (last axis)
+    :type energy: np.ndarray
+    :param level: adsorbate level
+    :type level: float or np.ndarray
+    :param delta: chemisorption function on the energy grid
+    :type delta: np.ndarray
+    :param lambda_: Hilbert transform of delta, computed if not given
+    :type lambda_: np.ndarray, optional
+    :return: projected DOS
+    :rtype: np.ndarray
+    """
+    if lambda_ is None:
+        lambda_ = hilbert_partner(delta)
+    return 1 / np.pi * delta / ((energy - level - lambda_)**2 + delta**2)
+
+
+def fit_lorentzian_widths(energy, pdos, window=(-3, 3), initial_width=0.5):
+    """Fit A lorentz_dos(Delta, level, energy) to many PDOS in one least squares call
+
+    The residuals of all PDOS are concatenated; the Jacobian is block
+    diagonal so the solver treats every PDOS independently while
+    everything is done in one call.
+
+    :param energy: common energy grid, e.g. from dos_analysis.stack_on_grid
+    :type energy: np.ndarray
+    :param pdos: (record, energy) array
+    :type pdos: np.ndarray
+    :param window: energy range that is fitted, defaults to (-3, 3)
+    :type window: tuple, optional
+    :param initial_width: starting value of Delta, defaults to 0.5
+    :type initial_width: float, optional
+    :return: width Delta, level and amplitude of every record and the rate from Delta
+    :rtype: dict
+    """
+    inside = (energy >= window[0]) & (energy <= window[1])
+    e = energy[inside]
+    y = np.atleast_2d(pdos)[:, inside]
+    nrecords = y.shape[0]
+
+    level0 = e[y.argmax(axis=1)]
+    width0 = np.full(nrecords, initial_width)
+    amplitude0 = np.pi * width0 * y.max(axis=1)
+    x0 = np.concatenate([width0, level0, amplitude0])
+
+    def unpack(x):
+        width, level, amplitude = x.reshape(3, nrecords)
+        return width[:, None], level[:, None], amplitude[:, None]
+
+    def residual(x):
+        width, level, amplitude = unpack(x)
+        return (amplitude * lorentz_dos(width, level, e[None, :]) - y).ravel()
+
+    ## every record only depends on its own three parameters
+    block = np.ones((len(e), 3))
+    sparsity = block_diag([block] * nrecords).tolil()
+    columns = np.arange(3 * nrecords).reshape(3, nrecords).T.ravel()
+    sparsity = sparsity[:, np.argsort(columns)]
+
+    lower = np.concatenate([np.full(nrecords, 1e-3), np.full(nrecords, window[0]), np.zeros(nrecords)])
+    upper = np.concatenate([np.full(nrecords, 10.), np.full(nrecords, window[1]), np.full(nrecords, np.inf)])
+    result = least_squares(residual, np.clip(x0, lower, upper), bounds=(lower, upper),
+                           jac_sparsity=sparsity, method='trf')
+
+    width, level, amplitude = result.x.reshape(3, nrecords)
+    return {'width': width, 'level': level, 'amplitude': amplitude,
+            'rate': transfer_rate(width), 'success': result.success}
+
+
+def fit_database_widths(json_files=(), databases=(), projections=('CO2(sp)', 'co2'), **kwargs):
+    """Fit Delta to every CO2 PDOS in the DOS databases
+
+    :param json_files: json DOS databases
+    :type json_files: list
+    :param databases: ase databases with pdos in the data
+    :type databases: list
+    :param projections: names of the CO2 projections, defaults to ('CO2(sp)', 'co2')
+    :type projections: tuple, optional
+    :return: labels and the dict from fit_lorentzian_widths
+    :rtype: tuple
+    """
+    ## dos_analysis.py is shared with Figure 4 and kept in its folder
+    sys.path.append(str(Path(__file__).resolve().parents[1] / 'figure_4_dipoles'))
+    from dos_analysis import records_from_json, records_from_database, stack_on_grid
+    labels = [] ; energies = [] ; pdos = []
+    for f in json_files:
+        l, e, d = records_from_json(f)
+        labels += l ; energies += e ; pdos += d
+    if databases:
+        from ase.db import connect
+        for f in databases:
+            l, e, d = records_from_database(connect(f))
+            labels += l ; energies += e ; pdos += d
+    keep = [i for i, label in enumerate(labels) if label[3] in projections]
+    labels = np.array(labels, dtype=str)[keep]
+    grid, stacked = stack_on_grid([energies[i] for i in keep], [pdos[i] for i in keep])
+    return labels, fit_lorentzian_widths(grid, stacked, **kwargs)
@@ -19,6 +19,7 @@ from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 from matplotlib.patches import Circle
 from mpl_toolkits.axes_grid1.inset_locator import mark_inset
 import plot_params
+from electron_transfer import lorentz_dos, transfer_rate
 plot_params.get_plot_params()
 
 Path('output').mkdir(exist_ok=True)
@@ -33,10 +34,6 @@ def parsedb(database, results):
         results.setdefault(row.states.replace('state_',''),{})['atoms'] = row.toatoms()
         results.setdefault(row.states.replace('state_',''),{})['magmom'] = row.magmom
 
-def lorentz_dos(a, b1,energy):
-    delta = 1 / np.pi * ( a / ( (energy - b1)**2 + a**2  ) )
-    return delta
-
 @click.command()
 @click.option('--mncdb', default='databases/single_atom_rls.db')
 def main(mncdb):
@@ -45,8 +42,6 @@ def main(mncdb):
     results['mnc'] = {} ; results['np']  = {}
     parsedb(connect(mncdb), results['mnc']) 
 
-    hbar = 6.582 * 1e-16 # eV.s
-
     fig = plt.figure(constrained_layout=True, figsize=(12, 8))
     gs = fig.add_gridspec(2,10, wspace=0.05)
     ax = []
@@ -61,14 +56,16 @@ def main(mncdb):
 
     ## plot lorentzian data
     energy_range = np.linspace(-3,3,500)
-    spec_lorentz = [[0.01,0], [0.1,0],[0.5,0], [1,0], [2,0]]
+    widths = np.array([0.01, 0.1, 0.5, 1, 2])
+    levels = np.zeros_like(widths)
     color = ['tab:blue','tab:red', 'tab:green', 'tab:orange', 'tab:purple']
-    for m, spec in enumerate(spec_lorentz):
-        peak = lorentz_dos(*spec, energy_range)
-        rate = 2 * np.pi / hbar * spec[0]
+    ## all widths evaluated at once, (width, energy)
+    peaks = lorentz_dos(widths[:,None], levels[:,None], energy_range[None,:])
+    rates = transfer_rate(widths)
+    for m, peak in enumerate(peaks):
         axl.plot(peak, energy_range, '-', color=color[m])
         axl.fill_between(peak, energy_range, color=color[m], alpha=0.25)
-        axr.plot(spec[0], rate, 'o', color=color[m], )
+        axr.plot(widths[m], rates[m], 'o', color=color[m], )
     axl.set_ylabel(r'Energy / eV')
     axl.set_xlim([0,1])
     axr.axhline(1e12, color='k', ls='--')
@@ -89,11 +86,9 @@ def main(mncdb):
     for i, species in enumerate(results):
         j=0
         n=0
-        all_f = []
         all_E = []
         for state in results[species]:
             energy = np.array(results[species][state]['energy'])
-            filled_indices = [a for a in range(len(energy)) if energy[a] <= 0.0]
             pdos_Fe = np.array(results[species][state]['pdos']['Fe']['+']) \
                     +np.array(results[species][state]['pdos']['Fe']['-'])
             pdos_co2 = np.array(results[species][state]['pdos']['co2']['+']) \
@@ -104,8 +99,6 @@ def main(mncdb):
                 pdos_N = np.array(results[species][state]['pdos']['N']['+']) \
                         +np.array(results[species][state]['pdos']['N']['-']) 
             co2 = pdos_co2[0].sum(axis=0)
-            f = np.trapz(co2[filled_indices], energy[filled_indices]) / np.trapz(co2, energy)
-            all_f.append(f)
             if state in plot_states[species]:
                 ax[i,j].plot(co2, energy, color='tab:blue', alpha=0.5)
                 ax[i,j].fill_between(co2, energy, color='tab:blue', alpha=0.1)
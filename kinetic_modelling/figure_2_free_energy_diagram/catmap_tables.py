@@ -0,0 +1,152 @@
+"""CatMAP energy tables and free energy diagrams for many potentials and pH values.
+
+The charging curves of FreeEnergyDiagram are fitted once and evaluated
+for all potentials together, as (potential, curve) arrays of formation
+energies; the free energies of the diagrams add the computational
+hydrogen electrode on a (potential, pH, curve) grid. FreeEnergyDiagram
+only has to be run once instead of once per potential.
+
+The tables are written as the usual catmap_potential_*.txt files or as
+one npz file with all potentials (read with EnergyTable.from_npz in
+Figure 3); table_columns gives the same columns in memory. Without the
+plots of main.py::
+
+    python catmap_tables.py --potential -0.6 -0.8 -1.0 --ph 2
+"""
+
+import csv
+from glob import glob
+from pathlib import Path
+import click
+import numpy as np
+from double_layer import fit_charging_curves
+from computational_panel import FreeEnergyDiagram
+
+
+def energy_tables(charging_curves, potentials, pHs=(), fits=None):
+    """Formation and free energies of all adsorbates for every potential (and pH)
+
+    :param charging_curves: FreeEnergyDiagram.charging_curves after main()
+    :type charging_curves: dict
+    :param potentials: SHE potentials
+    :type potentials: list
+    :param pHs: pH values of the free energies, defaults to none
+    :type pHs: list, optional
+    :param fits: output of fit_charging_curves, to reuse the fits
+    :type fits: tuple, optional
+    :return: 'labels' (facet, metal, state), 'potentials', 'pHs', (potential, label)
+        'formation_energy' as in the CatMAP input and (potential, pH, label) 'free_energy'
+        as in FreeEnergyDiagram.diagram
+    :rtype: dict
+    """
+    labels, fits = fits if fits is not None else fit_charging_curves(charging_curves)
+    potentials = np.atleast_1d(np.asarray(potentials, dtype=float))
+    pHs = np.atleast_1d(np.asarray(pHs, dtype=float))
+
+    sigma_for_pot = fits['C_gap'] * (potentials[:, None] - fits['pzc'])
+    formation_energy = fits['intercept'] - fits['slope'] * sigma_for_pot
+    U_RHE = potentials[:, None, None] + 0.059 * pHs[None, :, None]
+    free_energy = formation_energy[:, None, :] + fits['thermal_correction'] + fits['electrons'] * U_RHE
+    return {
+        'labels': labels,
+        'potentials': potentials,
+        'pHs': pHs,
+        'formation_energy': formation_energy,
+        'free_energy': free_energy,
+    }
+
+
+def table_rows(tables, index, gas_rows, frequencies, decimals=2):
+    """Rows of the CatMAP energy file of one potential, as written by FreeEnergyDiagram
+
+    :param tables: output of energy_tables
+    :type tables: dict
+    :param index: index of the potential
+    :type index: int
+    :param gas_rows: FreeEnergyDiagram.writeout_gas
+    :type gas_rows: list
+    :param frequencies: FreeEnergyDiagram.frequencies
+    :type frequencies: dict
+    :rtype: list
+    """
+    rows = [['surface_name', 'site_name', 'species_name', 'formation_energy', 'frequencies', 'reference']]
+    rows += gas_rows
+    for (facet, metal, state), energy in zip(tables['labels'], tables['formation_energy'][index].tolist()):
+        rows.append([metal, facet, state, round(energy, decimals), list(frequencies[state]), 'sv_calc'])
+    return rows
+
+
+def write_energy_files(tables, gas_rows, frequencies, filename='output/catmap_potential_%1.2f.txt'):
+    """Write one CatMAP energy file per potential
+
+    :return: names of the files
+    :rtype: list
+    """
+    filenames = []
+    for i, potential in enumerate(tables['potentials']):
+        filenames.append(filename % potential)
+        with open(filenames[-1], 'w') as handle:
+            csv.writer(handle, delimiter='\t').writerows(table_rows(tables, i, gas_rows, frequencies))
+    return filenames
+
+
+def table_columns(tables, gas_rows, frequencies):
+    """Columns of all potentials in one table, the arguments of EnergyTable in Figure 3
+
+    The energies are not rounded.
+
+    :rtype: dict
+    """
+    columns = {key: [] for key in ['surface', 'site', 'species', 'energy', 'frequencies', 'reference', 'potential']}
+    for i, potential in enumerate(tables['potentials']):
+        rows = [row[:3] + [row[3]] for row in gas_rows]
+        rows += [[metal, facet, state, energy] for (facet, metal, state), energy
+                 in zip(tables['labels'], tables['formation_energy'][i].tolist())]
+        for surface, site, species, energy in rows:
+            columns['surface'].append(surface)
+            columns['site'].append(site)
+            columns['species'].append(species)
+            columns['energy'].append(energy)
+            columns['frequencies'].append(np.array(frequencies[species + 'g' if site == 'gas' else species], dtype=float))
+            columns['reference'].append('sv_calc')
+            columns['potential'].append(potential)
+    return columns
+
+
+def save_energy_tables(filename, tables, gas_rows, frequencies):
+    """Write the energies of all potentials to one npz file
+
+    The frequencies are padded with nan into a (row, frequency) array.
+    """
+    columns = table_columns(tables, gas_rows, frequencies)
+    nmax = max(len(f) for f in columns['frequencies'])
+    padded = np.full((len(columns['frequencies']), nmax), np.nan)
+    for i, f in enumerate(columns['frequencies']):
+        padded[i, :len(f)] = f
+    np.savez(filename, surface=np.array(columns['surface'], dtype=str), site=np.array(columns['site'], dtype=str),
+             species=np.array(columns['species'], dtype=str), energy=np.array(columns['energy']),
+             frequencies=padded, reference=np.array(columns['reference'], dtype=str),
+             potential=np.array(columns['potential']))
+
+
+@click.command()
+@click.option('--database_folder', default='../databases/', help='Database folder')
+@click.option('--referencedb_name', default='input_databases/gas_phase.db')
+@click.option('--potential', default=[-0.6, -0.8, -1.], multiple=True, type=float, help='SHE potential, can be repeated')
+@click.option('--ph', default=2., type=float)
+@click.option('--C_gap', 'C_gap', default=25., type=float, help='Capacitance in mu F cm-2')
+def main(database_folder, referencedb_name, potential, ph, C_gap):
+    """CatMAP energy files of all potentials and output/catmap_energies.npz."""
+    Path('output').mkdir(parents=True, exist_ok=True)
+    Path('output_si').mkdir(parents=True, exist_ok=True)
+    method = FreeEnergyDiagram(dbnames=glob(database_folder + '/*.db'), refdbname=referencedb_name,
+                               potential=potential[0], pH=ph, C_gap=C_gap)
+    method.main(plot=False)
+    tables = energy_tables(method.charging_curves, potential, [ph])
+    for filename in write_energy_files(tables, method.writeout_gas, method.frequencies):
+        print(filename)
+    save_energy_tables('output/catmap_energies.npz', tables, method.writeout_gas, method.frequencies)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""Slopes of the charging curves predicted from the vacuum calculations.
+
+The slope of the energy against the surface charge of an adsorbate
+comes from its dipole in the field of the double layer, and for CO2*
+also from the explicit charge of the finite difference calculations.
+Both are known without any implicit solvent calculation: the vacuum
+rows carry the dipole (dipole_field, as in Figure 4) and
+FreeEnergyDiagram.explicit_charge has q_eff. The slopes are modelled as
+
+    slope = a (dipole - dipole of the slab) + b q_eff + c_group
+
+with one intercept per group (metal surface or SAC, and state). The
+model is calibrated in one least squares fit against the slopes of all
+charging curves with enough points, and its error in every group is the
+leave-one-out residual, which follows from the hat matrix of the same
+fit.
+
+Multiplied with the surface charge at the potential, the errors of the
+predicted and of the fitted slopes are errors of the free energy in eV.
+plan_calculations flags the (facet, metal, state) whose free energy is
+not known to within the tolerance, either from the charged calculations
+or from the prediction; only those need more implicit calculations.
+"""
+
+from glob import glob
+from pprint import pprint
+import click
+import numpy as np
+from ase import units
+from uncertainty import stack_charging_curves, batched_linear_fit
+
+STATES = ('CO', 'COOH', 'CO2')
+## eV, largest error of a free energy at the potential that needs no more calculations
+TOLERANCE = 0.05
+## fewest charged calculations of a charging curve that is calibrated on and used as is
+MIN_POINTS = 3
+
+
+def catalyst_kind(facet):
+    """'SAC' for the vacancy_dopant facets of the single atom catalysts, else 'metal'."""
+    return 'SAC' if '_' in facet else 'metal'
+
+
+def collect_features(results, explicit_charge, states=STATES):
+    """Dipoles and effective charges of all adsorbates with a vacuum calculation
+
+    The dipole of CO2* is only stored on its DOS calculation (CO2_dos),
+    which is used when the state itself has none, as in Figure 4.
+
+    :param results: FreeEnergyDiagram.results after main()
+    :type results: dict
+    :param explicit_charge: FreeEnergyDiagram.explicit_charge, facet -> metal -> q_eff of CO2*
+    :type explicit_charge: dict
+    :param states: adsorbates, defaults to STATES
+    :type states: tuple, optional
+    :return: labels (facet, metal, state) and (label,) arrays 'dipole' (e A, relative to the
+        slab), 'q_eff' (e, nan for CO2* without finite differences) and 'wf' (eV, relative to the slab)
+    :rtype: tuple
+    """
+    labels, dipole, q_eff, wf = [], [], [], []
+    for facet in results:
+        for metal in results[facet]:
+            slab = results[facet][metal].get('slab', {}).get('vacuum', {}).get(0.0, {})
+            if slab.get('dipole') is None:
+                continue
+            for state in states:
+                vacuum = {}
+                for name in [state, state + '_dos']:
+                    vacuum = results[facet][metal].get(name, {}).get('vacuum', {}).get(0.0, {})
+                    if vacuum.get('dipole') is not None:
+                        break
+                if vacuum.get('dipole') is None:
+                    continue
+                labels.append((facet, metal, state))
+                dipole.append(vacuum['dipole'] - slab['dipole'])
+                wf.append(vacuum['wf'] - slab['wf'])
+                if state == 'CO2':
+                    q_eff.append(explicit_charge.get(facet, {}).get(metal, np.nan))
+                else:
+                    q_eff.append(0.)
+    features = {'dipole': np.array(dipole, dtype=float), 'q_eff': np.array(q_eff, dtype=float),
+                'wf': np.array(wf, dtype=float)}
+    return labels, features
+
+
+def fit_slopes(charging_curves):
+    """Slopes of all charging curves with their standard errors
+
+    :param charging_curves: facet -> metal -> state -> curve
+    :type charging_curves: dict
+    :return: labels (facet, metal, state) and (curve,) arrays 'slope', 'error' (standard error
+        of the slope, nan for two points) and 'npoints', slopes in eV / (mu C cm-2)
+    :rtype: tuple
+    """
+    labels, curves = stack_charging_curves(charging_curves)
+    weights = curves['weights']
+    sigma = (curves['charge'] - curves['q_eff'][:, None] / 2) / curves['area'][:, None] * units._e * 1e6
+    slope, intercept = batched_linear_fit(sigma, curves['energy'], weights)
+    residuals = curves['energy'] - intercept[:, None] - slope[:, None] * sigma
+    npoints = weights.sum(axis=-1)
+    x_mean = (weights * sigma).sum(axis=-1, keepdims=True) / npoints[:, None]
+    sxx = (weights * (sigma - x_mean)**2).sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = np.where(npoints > 2, (weights * residuals**2).sum(axis=-1) / (npoints - 2), np.nan)
+        error = np.sqrt(variance / sxx)
+    return labels, {'slope': slope, 'error': error, 'npoints': npoints.astype(int)}
+
+
+def _design(labels, features, groups):
+    columns = [features['dipole'], np.nan_to_num(features['q_eff'])]
+    group = [(catalyst_kind(facet), state) for facet, _, state in labels]
+    columns += [np.array([g == key for g in group], dtype=float) for key in groups]
+    return np.stack(columns, axis=-1)
+
+
+def calibrate(labels, features, slopes, min_points=MIN_POINTS):
+    """Least squares fit of the slope model to the fitted charging curves
+
+    :param labels: labels of collect_features
+    :type labels: list
+    :param features: features of collect_features
+    :type features: dict
+    :param slopes: output of fit_slopes
+    :type slopes: tuple
+    :param min_points: fewest points of a charging curve used, defaults to MIN_POINTS
+    :type min_points: int, optional
+    :return: 'groups', 'coefficients' (a, b and the intercepts of the groups), 'rmse' group -> leave-one-out
+        error of the slope, 'labels' and 'residuals' (leave-one-out) of the calibration curves
+    :rtype: dict
+    """
+    index = {label: i for i, label in enumerate(labels)}
+    fitted_labels, fitted = slopes
+    used = [k for k, label in enumerate(fitted_labels)
+            if label in index and fitted['npoints'][k] >= min_points and not np.isnan(features['q_eff'][index[label]])]
+    rows = [index[fitted_labels[k]] for k in used]
+    calibration_labels = [labels[i] for i in rows]
+    groups = sorted({(catalyst_kind(facet), state) for facet, _, state in calibration_labels})
+
+    design = _design(calibration_labels, {key: value[rows] for key, value in features.items()}, groups)
+    target = fitted['slope'][used]
+    coefficients, *_ = np.linalg.lstsq(design, target, rcond=None)
+    ## leave-one-out residuals e / (1 - h) from the diagonal of the hat matrix
+    hat = np.einsum('ij,ji->i', design, np.linalg.pinv(design))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        residuals = (target - design @ coefficients) / (1 - hat)
+    residuals[~np.isfinite(residuals)] = np.nan
+
+    group_of = np.array([groups.index((catalyst_kind(facet), state)) for facet, _, state in calibration_labels])
+    overall = np.sqrt(np.nanmean(residuals**2))
+    rmse = {}
+    for g, key in enumerate(groups):
+        values = residuals[(group_of == g) & ~np.isnan(residuals)]
+        ## groups with a single curve have no error of their own
+        rmse[key] = np.sqrt(np.mean(values**2)) if len(values) > 1 else overall
+    return {'groups': groups, 'coefficients': coefficients, 'rmse': rmse,
+            'labels': calibration_labels, 'residuals': residuals}
+
+
+def predict(model, labels, features):
+    """Predicted slopes and their errors
+
+    :param model: output of calibrate
+    :type model: dict
+    :return: (label,) arrays 'slope' and 'error', nan for groups or q_eff the model does not know
+    :rtype: dict
+    """
+    groups = model['groups']
+    design = _design(labels, features, groups)
+    slope = design @ model['coefficients']
+    error = np.array([model['rmse'].get((catalyst_kind(facet), state), np.nan) for facet, _, state in labels])
+    unknown = np.isnan(error) | np.isnan(features['q_eff'])
+    slope[unknown] = np.nan
+    error[unknown] = np.nan
+    return {'slope': slope, 'error': error}
+
+
+def plan_calculations(method, potential, tolerance=TOLERANCE, min_points=MIN_POINTS):
+    """Which (facet, metal, state) need more charged implicit calculations
+
+    An adsorbate needs more calculations when the error of its free energy
+    at the potential, the error of the slope times the surface charge, is
+    above the tolerance: from the fit if the charging curve has at least
+    min_points points, else from the prediction.
+
+    :param method: FreeEnergyDiagram after main()
+    :type method: FreeEnergyDiagram
+    :param potential: SHE potential
+    :type potential: float
+    :param tolerance: error of the free energy in eV, defaults to TOLERANCE
+    :type tolerance: float, optional
+    :param min_points: fewest points of a charging curve that is used as is, defaults to MIN_POINTS
+    :type min_points: int, optional
+    :return: the calibrated model and facet -> metal -> state -> dict of 'predicted', 'predicted_error',
+        'fitted', 'fitted_error', 'npoints', 'sigma' (mu C cm-2 at the potential), 'energy_error' (eV),
+        'outlier' (fit and prediction differ by more than twice their errors) and 'more_calculations'
+    :rtype: tuple
+    """
+    labels, features = collect_features(method.results, method.explicit_charge)
+    slopes = fit_slopes(method.charging_curves)
+    model = calibrate(labels, features, slopes, min_points)
+    prediction = predict(model, labels, features)
+    fitted = {label: k for k, label in enumerate(slopes[0])}
+
+    table = {}
+    for i, (facet, metal, state) in enumerate(labels):
+        curve = method.charging_curves.get(facet, {}).get(metal, {}).get(state)
+        if curve is not None:
+            pzc, C_gap = curve['pzc'], curve['C_gap']
+        else:
+            ## same pzc as FreeEnergyDiagram.main
+            pzc = method.pzc_doped if metal in ['Fe', 'Ni'] else \
+                method.results[facet][metal]['slab']['vacuum'][0.0]['wf'] - method.wf_SHE
+            C_gap = method.C_gap
+        sigma = C_gap * (potential - pzc)
+
+        entry = {'predicted': prediction['slope'][i], 'predicted_error': prediction['error'][i],
+                 'fitted': np.nan, 'fitted_error': np.nan, 'npoints': 0, 'sigma': sigma}
+        if (facet, metal, state) in fitted:
+            k = fitted[facet, metal, state]
+            entry.update(fitted=slopes[1]['slope'][k], fitted_error=slopes[1]['error'][k],
+                         npoints=int(slopes[1]['npoints'][k]))
+        if entry['npoints'] >= min_points:
+            slope_error = entry['fitted_error']
+        else:
+            slope_error = entry['predicted_error']
+        entry['energy_error'] = abs(sigma) * slope_error
+        entry['outlier'] = bool(abs(entry['fitted'] - entry['predicted'])
+                                > 2 * np.hypot(entry['fitted_error'], entry['predicted_error']))
+        entry['more_calculations'] = not entry['energy_error'] <= tolerance
+        table.setdefault(facet, {}).setdefault(metal, {})[state] = entry
+    return model, table
+
+
+@click.command()
+@click.option('--database_folder', default='../databases/', help='Database folder')
+@click.option('--referencedb_name', default='input_databases/gas_phase.db')
+@click.option('--potential', default=-0.8, type=float, help='SHE potential')
+@click.option('--ph', default=2., type=float)
+@click.option('--C_gap', 'C_gap', default=25., type=float, help='Capacitance in mu F cm-2')
+@click.option('--tolerance', default=TOLERANCE, type=float, help='Error of the free energies in eV')
+def main(database_folder, referencedb_name, potential, ph, C_gap, tolerance):
+    """Predicted charging curve slopes and the adsorbates that need more charged calculations."""
+    from computational_panel import FreeEnergyDiagram
+    method = FreeEnergyDiagram(dbnames=glob(database_folder + '/*.db'), refdbname=referencedb_name,
+                               potential=potential, pH=ph, C_gap=C_gap)
+    method.main(plot=False)
+    model, table = plan_calculations(method, potential, tolerance)
+
+    print('slope = %1.4f dipole + %1.4f q_eff + c (eV per mu C cm-2, e A, e)'%tuple(model['coefficients'][:2]))
+    print('Leave-one-out error of the slopes of %d charging curves:'%len(model['labels']))
+    pprint({'%s %s'%group: '%1.4f'%rmse for group, rmse in model['rmse'].items()})
+    print('-------')
+    print('facet metal state: points, fitted slope, predicted slope, error at %1.2f V in eV'%potential)
+    for facet, metals in table.items():
+        for metal, states in metals.items():
+            for state, entry in states.items():
+                print('%s %s %s: %d, %1.4f, %1.4f +- %1.4f, %1.3f%s%s'%(
+                    facet, metal, state, entry['npoints'], entry['fitted'], entry['predicted'],
+                    entry['predicted_error'], entry['energy_error'],
+                    ' more calculations' if entry['more_calculations'] else '',
+                    ' outlier' if entry['outlier'] else ''))
+
+
+if __name__ == '__main__':
+    main()
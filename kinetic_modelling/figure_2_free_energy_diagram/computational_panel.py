@@ -2,19 +2,19 @@ import sys
 import json
 from pprint import pprint
 import numpy as np
-from ase.db import connect 
 from ase import units
-from ase.thermochemistry import HarmonicThermo, IdealGasThermo
+from ase import Atoms
+from ase.thermochemistry import HarmonicThermo
 from ase.data import atomic_numbers
 from ase.data.colors import jmol_colors
-from scipy.interpolate import griddata
-from matplotlib import ticker
-import matplotlib.pyplot as plt
 import traceback
 from dataclasses import dataclass
 from findiff import ForceExtrapolation
 from useful_functions import get_vasp_nelect0
 from useful_functions import get_fit_from_points
+from db_query import query_columns, get_database
+from gas_references import gas_references, reference_energies
+from energy_join import join_by_charge, group_by_state
 
 @dataclass
 class FreeEnergyDiagram:
@@ -22,6 +22,9 @@ class FreeEnergyDiagram:
     refdbname: str
     potential: float
     pH: float
+    C_gap: float = 25 # mu F cm-2
+    wf_SHE: float = 4.4 # work function of the SHE, pzc = wf - wf_SHE
+    pzc_doped: float = -0.05 # V vs SHE
 
     def __post_init__(self):
         self.results = {}
@@ -41,16 +44,7 @@ class FreeEnergyDiagram:
         self.frequencies['H2g'] = [4357.74, 101.87, 101.851]
         self.frequencies['H2Og'] = [3823.99, 3715.40, 1599.34, 84.90, 76.593, 10 ]
 
-    def gas_phase_energies(self, references, referencedb):
-        ## Energies for the gas phase
-        for row in referencedb.select():
-            functional = row.functional
-            pw = row.pw
-            state = row.states.replace('state_','')
-            references.setdefault(functional,{}).setdefault(pw,{}).setdefault(state,{})['energy'] = row.energy
-            references.setdefault(functional,{}).setdefault(pw,{}).setdefault(state,{})['atoms'] = row.toatoms()
-
-    def create_reference_dict(self, referencedb, frequencies):
+    def create_reference_dict(self, refdbname, frequencies):
         """
         Create reference dictionary with the input
         The references are made similar to how CatMAP requires them to be made
@@ -58,67 +52,21 @@ class FreeEnergyDiagram:
         H2 = 0, CO2 = 0, H2O = 0
         and CO is referenced accoring to the water gas shift reaction
 
-        :param referencedb: Reference database with all gas references
-        :type referencedb: ASE database
-        """
+        The gas phase energies are read from the cache of gas_references.py,
+        which is only rebuilt when the reference database changes.
 
-        references = {}
-        self.gas_phase_energies(references, referencedb=referencedb)
+        :param refdbname: Reference database file with all gas references
+        :type refdbname: str
+        """
 
         # frequencies = self._get_frequencies()
         frequencies = self.frequencies
 
         # CatMAP references
-        functional = 'RP'
-        CO2g_correction = 0.45
-
-        # store internal energies as fixed variables
-        COg_E = references[functional][500.]['CO']['energy']
-        CO2g_E = references[functional][500.]['CO2']['energy'] + CO2g_correction
-        H2g_E = references[functional][500.]['H2']['energy']
-        H2Og_E = references[functional][500.]['H2O']['energy']
-
-        
-        ## Corrections to the free energy 
-        cmtoeV = 0.00012 
-        COg_G = IdealGasThermo(
-            cmtoeV * np.array(frequencies['COg']),
-            geometry='linear', 
-            atoms=references[functional][500.]['CO']['atoms'],
-            symmetrynumber=1,
-            spin=0,
-        ).get_gibbs_energy(298.15, 101325, verbose=False)
-
-        CO2g_G = IdealGasThermo(
-            cmtoeV * np.array(frequencies['CO2g']),
-            geometry='linear', 
-            atoms=references[functional][500.]['CO2']['atoms'],
-            symmetrynumber=2,
-            spin=0,
-        ).get_gibbs_energy(298.15, 101325, verbose=False) 
-
-        H2g_G = IdealGasThermo(
-            cmtoeV * np.array(frequencies['H2g']),
-            geometry='linear', 
-            atoms=references[functional][500.]['H2']['atoms'],
-            symmetrynumber=2,
-            spin=0,
-        ).get_gibbs_energy(298.15, 101325, verbose=False)
-
-        H2Og_G = IdealGasThermo(
-            cmtoeV * np.array(frequencies['H2Og']),
-            geometry='nonlinear', 
-            atoms=references[functional][500.]['H2O']['atoms'],
-            symmetrynumber=3,
-            spin=0,
-        ).get_gibbs_energy(298.15, 101325, verbose=False)
+        energies = gas_references(refdbname, frequencies, functional='RP', pw=500., CO2g_correction=0.45)
 
         # Internal energy references
-        reference_energies_E = {}
-        reference_energies_E['CO'] = CO2g_E + H2g_E - H2Og_E 
-        reference_energies_E['COOH'] = CO2g_E + 0.5 * H2g_E 
-        reference_energies_E['CO2'] =  CO2g_E
-        reference_energies_E['CO(g)'] = CO2g_E + H2g_E - COg_E - H2Og_E#COg_E + H2Og_E - H2g_E - CO2g_E 
+        reference_energies_E = reference_energies(energies['E'])
 
         gas_dict = {'CO2':0.0,
                     'CO':-1*reference_energies_E['CO(g)'],
@@ -131,14 +79,9 @@ class FreeEnergyDiagram:
             writeout_gas.append(writ)
         
         # Free energy references
-        reference_energies = {}
-        reference_energies['CO'] = CO2g_G - H2Og_G + H2g_G
-        reference_energies['COOH'] = CO2g_G + 0.5 * H2g_G 
-        reference_energies['CO2'] = CO2g_G
-        reference_energies['CO(g)'] = CO2g_G + H2g_G - H2Og_G - COg_G #COg_G + H2Og_G - CO2g_G - H2g_G 
-        
+        reference_energies_G = reference_energies(energies['G'])
 
-        return reference_energies, reference_energies_E, writeout_gas
+        return reference_energies_G, reference_energies_E, writeout_gas
 
 
     def get_explicit_charge(self,vibresults, atomsIS, atomsFS, 
@@ -160,23 +103,36 @@ class FreeEnergyDiagram:
 
         return method.q[0]
 
-    def main(self):
+    def main(self, plot=True):
+        """Fit the charging curves and compute the diagram and the CatMAP rows
+
+        The numerical part only needs numpy; the SI plots of the charging
+        curves are drawn afterwards by plot_charging_curves (or into one
+        file by write_charging_report), from self.charging_curves and
+        self.charging_panels.
+
+        :param plot: draw the SI plots of the charging curves, defaults to True
+        :type plot: bool, optional
+        """
         for dbname in self.dbnames:
             ## parse result from databases
-            self._parse(connect(dbname))
+            self._parse(get_database(dbname))
+            ## dipole, work function and area of the vacuum calculations
+            self._parse_vacuum(dbname)
 
         ## all results
         results = self.results
         diagram = {}
         explicit_charge = {}
         E0 = {}
+        charging_curves = {}
 
         ## All frequencies 
         self._get_frequencies()
         
         ## Create reference dictionary
         references, references_E, writeout_gas = self.create_reference_dict(\
-                                    connect(self.refdbname), \
+                                    self.refdbname, \
                                     self.frequencies,\
                                     )
         ## Electronic energy references that can be directly subtracted
@@ -184,12 +140,14 @@ class FreeEnergyDiagram:
 
         ## Each species must move down by the CHE dictated energy with potential and pH
         U_RHE = self.potential + 0.059 * self.pH
-        CHE_correction = {'CO':2 * U_RHE, 'COOH':U_RHE}
+        electrons = {'CO':2, 'COOH':1} ## proton-electron pairs needed to make the species
+        CHE_correction = {state: n * U_RHE for state, n in electrons.items()}
         
         ## Dict stores the relevant quantities
         self.diagram = {} ## all energy data
         self.explicit_charge = {} ## data from finite difference approach
         self.E0 = {} ## Energy with no charge corrections
+        self.charging_curves = {} ## points and parameters of the charging curve fits
 
         ## prepare the writeout for the CatMAP input file
         writeout = []
@@ -200,14 +158,25 @@ class FreeEnergyDiagram:
         writeout_zero = []
         writeout_zero.append(writeout_header)
         writeout_zero += writeout_gas
+        ## (facet, metal) of the SI plots
+        panels = []
+
+        ## energies of every adsorbate relative to the slab at the same charge
+        records = [(facet + '/' + metal, state, charge, entry.get('energy', np.nan))
+                   for facet in results for metal in results[facet] for state in results[facet][metal]
+                   for charge, entry in results[facet][metal][state].get('implicit', {}).items()]
+        ## a database set without implicit rows gives no curves
+        system, states, charges, energies = zip(*records) if records else ([], [], [], [])
+        joined = join_by_charge(system, ['implicit'] * len(records), states, charges, energies)
+        energy_differences = group_by_state(joined)
+        self.unmatched_charges = joined['unmatched']
 
 
         for facet in results:
             for metal in results[facet]:
                 if metal in ['Ni', 'Al'] and facet == '111': continue
                 if metal == 'Fe' and facet == '1_2': continue
-                ## Plotting energies as a function of the total surface charge
-                fig, ax = plt.subplots(1, 1, figsize=(6,4), constrained_layout=True)
+                panels.append((facet, metal))
                 ## iterate over different states looking at which surface charge component
                 ## is to be added
                 for state in results[facet][metal]:
@@ -232,44 +201,34 @@ class FreeEnergyDiagram:
                         ## charge component
                         q_eff = 0
                 
-                    Eq = []
-                    q = []
-                    sigma = []
-
                     ## Main block that manages energy vs. surface charge
+                    if (facet + '/' + metal, 'implicit', state) not in energy_differences:
+                        continue
+                    charge, dE = energy_differences[facet + '/' + metal, 'implicit', state]
                     try:
-                        for charge in results[facet][metal][state]['implicit']:
-                            try:
-                                dE = results[facet][metal][state]['implicit'][charge]['energy'] \
-                                    -results[facet][metal]['slab']['implicit'][charge]['energy'] \
-                                    -references_E[state]
-                            except KeyError:
-                                continue
-                            Eq.append(dE)
-                            ## correct the charge with the effective charge 
-                            ## determined by the finite difference method
-                            q.append(charge - q_eff/2)
-                            area = results[facet][metal]['slab']['vacuum'][0.0]['area'] 
-                            sigma = q / area * units._e * 1e6 # mu C / cm-2 
+                        area = results[facet][metal]['slab']['vacuum'][0.0]['area'] 
                     except KeyError:
                         continue
+                    Eq = dE - references_E[state]
+                    ## correct the charge with the effective charge 
+                    ## determined by the finite difference method
+                    q = charge - q_eff/2
+                    sigma = q / area * units._e * 1e6 # mu C / cm-2 
                     ## get the fit of the energy vs surface charge
                     ## There might be some non-linear dependence that comes in sometimes
                     ## because of geometry change - we ignore that here because
                     ## it is pretty small
                     fit = get_fit_from_points(sigma, Eq, 1) # linear fit of energy to surface charge
-                    ax.plot(sigma, Eq, 'o', color=self.colors[state])
-                    ax.plot(sigma, fit['p'](sigma), color=self.colors[state])
 
                     ## surface charge corresponding to the requested potential
                     ## Assume pzc is the same as wf for now
                     if metal not in ['Fe', 'Ni']:
-                        pzc = results[facet][metal]['slab']['vacuum'][0.0]['wf'] - 4.4
+                        pzc = results[facet][metal]['slab']['vacuum'][0.0]['wf'] - self.wf_SHE
                     else:
                         ## doped metal changes the wf a lot 
-                        pzc = -0.05 # V vs SHE
+                        pzc = self.pzc_doped
 
-                    C_gap = 25 # mu F cm-2
+                    C_gap = self.C_gap
                     sigma_for_pot = C_gap * ( self.potential - pzc )
 
                     # Save the results needed for the diagram
@@ -282,6 +241,13 @@ class FreeEnergyDiagram:
                     ## correct for the entropy of the adsorbed molecule using the Harmonic thermodynamic
                     ## assumption
                     dG_correct = HarmonicThermo(0.00012 * np.array(vibrations)).get_helmholtz_energy(298.15, verbose=False)
+                    ## everything needed to redo the fit, e.g. for the uncertainty propagation
+                    charging_curves.setdefault(facet,{}).setdefault(metal,{})[state] = {
+                        'charge': np.array(q) + q_eff/2, 'energy': np.array(Eq), 'area': area,
+                        'q_eff': q_eff, 'pzc': pzc, 'C_gap': C_gap,
+                        'correction': dG_correct - references[state] + CHE_correction.get(state, 0),
+                        'thermal_correction': dG_correct - references[state], 'electrons': electrons.get(state, 0),
+                    }
                     if 'CO2' in state:
                         # Then we have a relationship with surface charge ready
                         diagram.setdefault(facet,{}).setdefault(metal,{})[state] = fit['p'](-1*sigma_for_pot) + dG_correct - references[state] 
@@ -301,16 +267,6 @@ class FreeEnergyDiagram:
                 ## gas phase references taken into account now
                 diagram.setdefault(facet,{}).setdefault(metal,{})['CO2(g)'] = 0
                 diagram.setdefault(facet,{}).setdefault(metal,{})['CO(g)'] = -1*references_E['CO(g)'] - references['CO(g)'] + CHE_correction['CO'] 
-
-                ## setup the SI plots 
-                for i, j in self.colors.items():
-                    ax.plot([],[], color=j, label=r''+i.replace('2','$_{2}$'))
-                ax.set_ylabel(r'$\Delta E$ / eV')
-                ax.set_xlabel(r'$\sigma$ / $\mu C cm^{-2}$')
-                ax.legend(loc='best', frameon=False, fontsize=12)
-
-                fig.savefig('output_si/SI_charging_curve_metal_%s_facet_%s.pdf'%(metal, facet))
-                plt.close(fig)
         
         ## save all the data
         self.diagram = diagram
@@ -318,8 +274,94 @@ class FreeEnergyDiagram:
         self.writeout_zero = writeout_zero
         self.explicit_charge = explicit_charge
         self.E0 = E0
+        self.charging_curves = charging_curves
         self.references = references
         self.references_E = references_E
+        self.writeout_gas = writeout_gas
+        self.charging_panels = panels
+
+        if plot:
+            plot_charging_curves(self.charging_curves, self.charging_panels, self.colors)
+
+    def charging_curves_at(self, potential, pH=None):
+        """charging_curves with the free energy corrections at another potential and pH
+
+        :param potential: SHE potential
+        :type potential: float
+        :param pH: pH, defaults to that of the diagram
+        :type pH: float, optional
+        :rtype: dict
+        """
+        pH = self.pH if pH is None else pH
+        U_RHE = potential + 0.059 * pH
+        return {facet: {metal: {state: {**curve, 'correction': curve['thermal_correction'] + curve['electrons'] * U_RHE}
+                                for state, curve in states.items()} for metal, states in metals.items()}
+                for facet, metals in self.charging_curves.items()}
+
+    def diagram_from_tables(self, tables, potential, pH=None):
+        """Free energy diagram like self.diagram at another potential and pH
+
+        :param tables: output of catmap_tables.energy_tables for the charging curves of this diagram
+        :type tables: dict
+        :param potential: SHE potential, one of the potentials of the tables
+        :type potential: float
+        :param pH: pH, one of the pH values of the tables, defaults to that of the diagram
+        :type pH: float, optional
+        :rtype: dict
+        """
+        pH = self.pH if pH is None else pH
+        i = np.flatnonzero(np.isclose(tables['potentials'], potential))[0]
+        j = np.flatnonzero(np.isclose(tables['pHs'], pH))[0]
+        U_RHE = potential + 0.059 * pH
+        diagram = {facet: {metal: {} for metal in metals} for facet, metals in self.diagram.items()}
+        for (facet, metal, state), G in zip(tables['labels'], tables['free_energy'][i, j].tolist()):
+            diagram[facet][metal][state] = G
+        for facet in diagram:
+            for metal in diagram[facet]:
+                diagram[facet][metal]['CO2(g)'] = 0
+                diagram[facet][metal]['CO(g)'] = -1*self.references_E['CO(g)'] - self.references['CO(g)'] + 2 * U_RHE
+        return diagram
+
+    def _parse_vacuum(self, dbname):
+        """Add the dipole, work function and area of the vacuum calculations
+
+        Only the needed columns are read (see db_query.query_columns),
+        the same rows as in _parse are kept.
+
+        :param dbname: database file
+        :type dbname: str
+        """
+        results = self.results
+        columns = query_columns(dbname, ['sampling', 'facets', 'metal_dopant', 'vacancy_number',
+                                         'dopant_number', 'states', 'tot_charge', 'ldau', 'energy',
+                                         'dipole_field', 'wf', 'cell', 'numbers'],
+                                implicit=False, displacement=None)
+
+        for i in range(len(columns['states'])):
+            if np.isnan(columns['energy'][i]):
+                continue
+            if columns['sampling'][i] is not None:
+                metal = columns['sampling'][i].replace('sampling_','')
+                facet = columns['facets'][i].replace('facet_','')
+            else:
+                # In the case of Fe take only calculations with a U
+                if 'Fe' in columns['metal_dopant'][i] and not columns['ldau'][i]:
+                    continue
+                metal = columns['metal_dopant'][i].replace('metal_dopant_','').replace('_nonorth','')
+                facet = columns['vacancy_number'][i].replace('vacancy_','') + '_' \
+                    + columns['dopant_number'][i].replace('dopant_','')
+            state = columns['states'][i].replace('state_','').replace('implicit_','')
+            charge = columns['tot_charge'][i] - get_vasp_nelect0(Atoms(numbers=columns['numbers'][i]))
+
+            # get the area by multiplying lattice vectors
+            cell = columns['cell'][i]
+            area = abs(np.linalg.det(cell)) / cell[-1, -1] * 1e-16
+
+            vacuum = results.setdefault(facet,{}).setdefault(metal,{}).setdefault(state,{})\
+                .setdefault('vacuum',{}).setdefault(charge,{})
+            vacuum['dipole'] = columns['dipole_field'][i]
+            vacuum['wf'] = columns['wf'][i]
+            vacuum['area'] = area
 
     def _parse(self, database):
         """Parse keys from the database
@@ -384,19 +426,6 @@ class FreeEnergyDiagram:
                 except AttributeError:
                     pass
 
-                if implicit == 'vacuum':
-                    results.setdefault(facet,{}).setdefault(metal,{}).setdefault(state,{})\
-                        .setdefault(implicit,{}).setdefault(charge,{})['dipole'] = row.dipole_field
-                    results.setdefault(facet,{}).setdefault(metal,{}).setdefault(state,{})\
-                        .setdefault(implicit,{}).setdefault(charge,{})['wf'] = row.wf
-
-                    # get the area by multiplying lattice vectors
-                    atoms = row.toatoms()
-                    cell = atoms.get_cell()
-                    area = atoms.get_volume() / cell[-1, -1] * 1e-16
-                    results.setdefault(facet,{}).setdefault(metal,{}).setdefault(state,{})\
-                        .setdefault(implicit,{}).setdefault(charge,{})['area'] = area
-
             if findiff_calc:
 
                 ## now add in details for the finite difference
@@ -415,6 +444,96 @@ class FreeEnergyDiagram:
                         .setdefault(displacement,{}).setdefault(field,{})['forces'] = row.toatoms().get_forces()[indices]
 
     
+def _draw_charging_curve(ax, curves, colors):
+    """Energy against the surface charge of the states of one (facet, metal) on ax."""
+    for state, curve in curves.items():
+        sigma = (curve['charge'] - curve['q_eff']/2) / curve['area'] * units._e * 1e6 # mu C / cm-2
+        fit = get_fit_from_points(sigma, curve['energy'], 1)
+        ax.plot(sigma, curve['energy'], 'o', color=colors[state])
+        ax.plot(sigma, fit['p'](sigma), color=colors[state])
+
+    ## setup the SI plots 
+    for i, j in colors.items():
+        ax.plot([],[], color=j, label=r''+i.replace('2','$_{2}$'))
+    ax.set_ylabel(r'$\Delta E$ / eV')
+    ax.set_xlabel(r'$\sigma$ / $\mu C cm^{-2}$')
+    ax.legend(loc='best', frameon=False, fontsize=12)
+
+
+def plot_charging_curves(charging_curves, panels, colors, filename='output_si/SI_charging_curve_metal_%s_facet_%s.pdf'):
+    """SI plots of the energy against the surface charge, one file per (facet, metal)
+
+    Only needs the output of FreeEnergyDiagram.main(plot=False), so it
+    can run later or in another process (see save_charging_curves). One
+    figure is drawn again for every panel.
+
+    :param charging_curves: FreeEnergyDiagram.charging_curves
+    :type charging_curves: dict
+    :param panels: FreeEnergyDiagram.charging_panels, (facet, metal) of the plots
+    :type panels: list
+    :param colors: color of every state
+    :type colors: dict
+    :param filename: file name with the metal and facet, defaults to output_si/SI_charging_curve_metal_%s_facet_%s.pdf
+    :type filename: str, optional
+    """
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(1, 1, figsize=(6,4), constrained_layout=True)
+    for facet, metal in panels:
+        ax.clear()
+        _draw_charging_curve(ax, charging_curves.get(facet, {}).get(metal, {}), colors)
+        fig.savefig(filename%(metal, facet))
+    plt.close(fig)
+
+
+def write_charging_report(charging_curves, panels, colors, filename='output_si/SI_charging_curves.pdf'):
+    """All SI plots of the charging curves as the pages of one pdf file
+
+    The charging curves do not depend on the potential, so the report is
+    written once per set of databases. One figure is drawn again for
+    every page, titled with the metal and facet.
+
+    :param charging_curves: FreeEnergyDiagram.charging_curves
+    :type charging_curves: dict
+    :param panels: FreeEnergyDiagram.charging_panels, (facet, metal) of the pages
+    :type panels: list
+    :param colors: color of every state
+    :type colors: dict
+    :param filename: pdf file, defaults to output_si/SI_charging_curves.pdf
+    :type filename: str, optional
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+    fig, ax = plt.subplots(1, 1, figsize=(6,4), constrained_layout=True)
+    with PdfPages(filename) as pdf:
+        for facet, metal in panels:
+            ax.clear()
+            _draw_charging_curve(ax, charging_curves.get(facet, {}).get(metal, {}), colors)
+            ax.set_title('%s, %s'%(metal, facet), fontsize=12)
+            pdf.savefig(fig)
+    plt.close(fig)
+
+
+def save_charging_curves(filename, charging_curves, panels):
+    """Write the charging curves and the panels of the SI plots to a json file."""
+    curves = {facet: {metal: {state: {key: value.tolist() if isinstance(value, np.ndarray) else float(value)
+                                      for key, value in curve.items()}
+                              for state, curve in states.items()} for metal, states in metals.items()}
+              for facet, metals in charging_curves.items()}
+    with open(filename, 'w') as handle:
+        json.dump({'charging_curves': curves, 'panels': panels}, handle)
+
+
+def load_charging_curves(filename):
+    """Charging curves and panels written by save_charging_curves."""
+    with open(filename, 'r') as handle:
+        data = json.load(handle)
+    curves = {facet: {metal: {state: {key: np.array(value) if isinstance(value, list) else value
+                                      for key, value in curve.items()}
+                              for state, curve in states.items()} for metal, states in metals.items()}
+              for facet, metals in data['charging_curves'].items()}
+    return curves, [tuple(panel) for panel in data['panels']]
+
+
 def plot_computational_diagram(data, ax, SAC_potential):
     ## Plot the CO2 to CO free energy diagram
     all_potentials = []
@@ -502,6 +621,7 @@ def plot_computational_diagram(data, ax, SAC_potential):
                 xy=(0.72, -1),fontsize=14)
         
 def plot_variation_with_potential(explicit_charge):
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots(1, 4, figsize=(20,5), sharex=True, sharey=True)
     potential_range = np.linspace(-0.5, 0.5)
     alpha_range = [1, 0.75, 0.5, 0.25]
@@ -0,0 +1,365 @@
+"""Column projected queries on ASE databases.
+
+ASE's select() decodes every column of every row (positions, forces,
+the data blob, ...) into an AtomsRow. Most scripts only need a few
+key-value pairs and the cell, so here the SQLite tables are queried
+directly: only the requested columns are read, the filters are done
+in SQL and the result comes back as one NumPy array per column::
+
+    columns = query_columns('../databases/transition_metal_vacuum.db',
+                            ['facets', 'sampling', 'states', 'dipole_field', 'cell'],
+                            implicit=False)
+
+Filters are key=value (equality), key=[values] (any of) or key=None
+(key not set). Databases that are not SQLite files (e.g. .json) are
+read through ase.db.connect with the same interface.
+
+All reads go through one read-only (mode=ro, immutable) connection per
+file and thread that is kept open for the whole process; get_database
+returns an ase database that uses it. Since the connections never
+write, the covering indexes for the filters are a setup step that is
+required once per database file (a note is printed for files without
+them, which are then scanned row by row)::
+
+    python db_query.py --index ../databases/*.db input_databases/*.db
+
+which also prints the query plans of the usual filters.
+"""
+
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+import numpy as np
+import click
+
+## columns of the systems table that can be requested and how to decode them
+SYSTEM_COLUMNS = {
+    'id': None, 'unique_id': None, 'ctime': None, 'mtime': None, 'energy': None,
+    'fmax': None, 'smax': None, 'free_energy': None, 'charge': None, 'magmom': None,
+    'natoms': None, 'volume': None, 'mass': None,
+    'numbers': ('<i4', (-1,)),
+    'positions': ('<f8', (-1, 3)),
+    'cell': ('<f8', (3, 3)),
+    'initial_magmoms': ('<f8', (-1,)),
+}
+## columns that are text (or bytes) in the systems table
+TEXT_COLUMNS = {'unique_id'}
+## keys that the scripts filter on
+FILTER_KEYS = ('states', 'facets', 'sampling', 'metal_dopant', 'implicit', 'displacement')
+## (key, value, id) serves the filters, (id, key, value) the per row lookups of the joins
+INDEX_STATEMENTS = [
+    'CREATE INDEX IF NOT EXISTS text_key_value_index ON text_key_values(key, value, id)',
+    'CREATE INDEX IF NOT EXISTS number_key_value_index ON number_key_values(key, value, id)',
+    'CREATE INDEX IF NOT EXISTS text_id_index ON text_key_values(id, key, value)',
+    'CREATE INDEX IF NOT EXISTS number_id_index ON number_key_values(id, key, value)',
+]
+
+_key_types = {}
+_checked_indexes = set()
+_pool = threading.local()
+
+
+def is_sqlite(dbname):
+    """True if dbname is an SQLite file (ASE .db), False for .json and others."""
+    with open(dbname, 'rb') as handle:
+        return handle.read(16) == b'SQLite format 3\x00'
+
+
+def get_connection(dbname):
+    """Pooled read-only connection to an ase database
+
+    The connection is opened with mode=ro and immutable=1, so SQLite
+    takes no locks, and is reused until the file changes on disk.
+
+    :param dbname: ase database file
+    :type dbname: str
+    :return: connection
+    :rtype: sqlite3.Connection
+    """
+    path = os.path.abspath(dbname)
+    mtime = os.path.getmtime(path)
+    connections = _pool.__dict__.setdefault('connections', {})
+    if path in connections:
+        stamp, connection, database = connections[path]
+        if stamp == mtime:
+            return connection
+        connection.close()
+    connection = sqlite3.connect('file:%s?mode=ro&immutable=1' % pathname2url(path), uri=True)
+    connections[path] = (mtime, connection, None)
+    if path not in _checked_indexes:
+        _checked_indexes.add(path)
+        if missing_indexes(connection):
+            print('%s has no key-value indexes, add them with: python db_query.py --index %s' % (dbname, dbname))
+    return connection
+
+
+def get_database(dbname):
+    """ase database that reads through the pooled connection
+
+    Use it instead of ase.db.connect for reading; json databases
+    are opened with ase.db.connect.
+
+    :param dbname: ase database file
+    :type dbname: str
+    :return: database
+    :rtype: ase.db.core.Database
+    """
+    from ase.db import connect
+    if not is_sqlite(dbname):
+        return connect(dbname)
+    connection = get_connection(dbname)
+    path = os.path.abspath(dbname)
+    mtime, _, database = _pool.connections[path]
+    if database is None:
+        database = connect(path, type='db')
+        ## ase uses (and does not close) an existing connection, as in Database.__enter__
+        database.connection = connection
+        database.change_count = 0
+        _pool.connections[path] = (mtime, connection, database)
+    return database
+
+
+def close_connections():
+    """Close the pooled connections of this thread."""
+    for _, connection, _ in _pool.__dict__.pop('connections', {}).values():
+        connection.close()
+
+
+def missing_indexes(connection):
+    """Names of the indexes of INDEX_STATEMENTS that are not in the database."""
+    names = [statement.split()[5] for statement in INDEX_STATEMENTS]
+    present = {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return [name for name in names if name not in present]
+
+
+def create_indexes(dbname):
+    """Add the covering indexes of INDEX_STATEMENTS to an ase database (writes to the file)."""
+    connection = sqlite3.connect(dbname)
+    try:
+        for statement in INDEX_STATEMENTS:
+            connection.execute(statement)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def get_key_types(connection, dbname):
+    """Map every key-value key of the database to 'text' or 'number'."""
+    stamp = (os.path.abspath(dbname), os.path.getmtime(dbname))
+    if stamp not in _key_types:
+        types = {}
+        for table, kind in [('number_key_values', 'number'), ('text_key_values', 'text')]:
+            for key, in connection.execute('SELECT DISTINCT key FROM %s' % table):
+                types[key] = kind
+        _key_types[stamp] = types
+    return _key_types[stamp]
+
+
+def _decode(name, values, kind=None):
+    """List of column values from SQLite -> NumPy array, kind is 'text', 'number' or None if unknown."""
+    if name in SYSTEM_COLUMNS and SYSTEM_COLUMNS[name] is not None:
+        dtype, shape = SYSTEM_COLUMNS[name]
+        arrays = [None if v is None else np.frombuffer(v, dtype).reshape(shape) for v in values]
+        if shape[0] != -1 and all(a is not None for a in arrays):
+            return np.array(arrays).reshape((len(arrays),) + shape)
+        result = np.empty(len(arrays), dtype=object)
+        result[:] = arrays
+        return result
+    if any(isinstance(v, str) for v in values) or name in TEXT_COLUMNS or kind == 'text':
+        return np.array(values, dtype=object)
+    if kind is None and name not in SYSTEM_COLUMNS and all(v is None for v in values):
+        ## key that is not in the database
+        return np.array(values, dtype=object)
+    if values and all(isinstance(v, (int, np.integer)) for v in values):
+        ## id, natoms and integer key-value pairs; None needs the nan of a float column
+        return np.array(values, dtype=np.int64)
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def _build_query(columns, filters, key_types):
+    """SELECT statement and its parameters for the requested columns and filters
+
+    Requested key-value pairs are joined on the row id; filters on
+    key-value pairs are id subqueries (as in ase) so that they are
+    answered from the (key, value, id) index.
+    """
+    joins = [] ; join_parameters = []
+
+    def table(name):
+        return 'text_key_values' if key_types.get(name) == 'text' else 'number_key_values'
+
+    selected = []
+    for name in columns:
+        if name in SYSTEM_COLUMNS:
+            selected.append('systems.%s' % name)
+            continue
+        alias = 'k%d' % len(joins)
+        joins.append('LEFT JOIN %s AS %s ON %s.id = systems.id AND %s.key = ?' \
+            % (table(name), alias, alias, alias))
+        join_parameters.append(name)
+        selected.append('%s.value' % alias)
+
+    conditions = [] ; parameters = []
+    for name, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            test = 'IN (%s)' % ', '.join('?' * len(value))
+            values = [_sql_value(v) for v in value]
+        else:
+            test = '= ?'
+            values = [_sql_value(value)]
+        if name in SYSTEM_COLUMNS:
+            if value is None:
+                conditions.append('systems.%s IS NULL' % name)
+            else:
+                conditions.append('systems.%s %s' % (name, test))
+                parameters += values
+        elif value is None:
+            conditions.append('systems.id NOT IN (SELECT id FROM %s WHERE key = ?)' % table(name))
+            parameters.append(name)
+        else:
+            conditions.append('systems.id IN (SELECT id FROM %s WHERE key = ? AND value %s)' % (table(name), test))
+            parameters += [name] + values
+
+    sql = 'SELECT %s FROM systems' % ', '.join(selected)
+    if joins:
+        sql += ' ' + ' '.join(joins)
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY systems.id'
+    return sql, join_parameters + parameters
+
+
+def _sql_value(value):
+    ## ASE stores booleans as numbers
+    if isinstance(value, (bool, np.bool_)):
+        return int(value)
+    return value
+
+
+def iter_columns(dbname, columns, chunk_size=1000, **filters):
+    """Stream the requested columns of the matching rows in chunks
+
+    :param dbname: ase database file
+    :type dbname: str
+    :param columns: names of key-value pairs or columns of the systems table (SYSTEM_COLUMNS)
+    :type columns: list
+    :param chunk_size: number of rows per chunk, defaults to 1000
+    :type chunk_size: int, optional
+    :return: generator of dicts of column name -> array
+    :rtype: generator
+    """
+    if not is_sqlite(dbname):
+        yield _query_ase(dbname, columns, **filters)
+        return
+
+    connection = get_connection(dbname)
+    key_types = get_key_types(connection, dbname)
+    sql, parameters = _build_query(columns, filters, key_types)
+    cursor = connection.execute(sql, parameters)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield {name: _decode(name, list(values), key_types.get(name)) for name, values in zip(columns, zip(*rows))}
+
+
+def query_columns(dbname, columns, **filters):
+    """Requested columns of all rows matching the filters
+
+    :param dbname: ase database file
+    :type dbname: str
+    :param columns: names of key-value pairs or columns of the systems table (SYSTEM_COLUMNS)
+    :type columns: list
+    :return: column name -> array with one entry per row; integer columns are
+        int, missing values are nan for number keys (which are then float) and
+        None for text keys and keys not in the database
+    :rtype: dict
+    """
+    chunks = list(iter_columns(dbname, columns, **filters))
+    if not chunks:
+        return {name: np.zeros(0) for name in columns}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in columns}
+
+
+def _query_ase(dbname, columns, **filters):
+    """Same as query_columns through ase.db.connect, for databases that are not SQLite."""
+    from ase.db import connect
+
+    def matches(row, name, value):
+        present = row.get(name)
+        if value is None:
+            return present is None
+        if isinstance(value, (list, tuple, set)):
+            return present in value
+        return present == value
+
+    values = {name: [] for name in columns}
+    for row in connect(dbname).select():
+        if not all(matches(row, name, value) for name, value in filters.items()):
+            continue
+        for name in columns:
+            value = row.get(name)
+            if name in SYSTEM_COLUMNS and SYSTEM_COLUMNS[name] is not None and value is not None:
+                value = np.asarray(value, dtype=SYSTEM_COLUMNS[name][0]).tobytes()
+            elif isinstance(value, (bool, np.bool_)):
+                value = int(value)
+            values[name].append(value)
+    return {name: _decode(name, values[name]) for name in columns}
+
+
+def explain_select(dbname, columns=('states',), **filters):
+    """Query plans of query_columns and of ase select() for the same filters
+
+    :param dbname: ase database file
+    :type dbname: str
+    :param columns: columns passed to query_columns, defaults to ('states',)
+    :type columns: tuple, optional
+    :return: 'query_columns' and 'select' lists of plan steps and 'full_scan',
+        True if any step scans a whole table
+    :rtype: dict
+    """
+    connection = get_connection(dbname)
+    sql, parameters = _build_query(list(columns), filters, get_key_types(connection, dbname))
+    plan = [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+    ase_filters = {k: _sql_value(v) for k, v in filters.items() if v is not None and not isinstance(v, (list, tuple, set))}
+    ase_plan = [row['explain'][-1] for row in get_database(dbname).select(explain=True, **ase_filters)]
+    return {
+        'query_columns': plan,
+        'select': ase_plan,
+        'full_scan': any(step.startswith('SCAN') for step in plan + ase_plan),
+    }
+
+
+def _example_value(connection, key):
+    """A value of key in the database, None if the key is not used."""
+    for table in ['text_key_values', 'number_key_values']:
+        row = connection.execute('SELECT value FROM %s WHERE key = ? LIMIT 1' % table, (key,)).fetchone()
+        if row is not None:
+            return row[0]
+
+
+@click.command()
+@click.argument('databases', nargs=-1)
+@click.option('--index', is_flag=True, help='add the covering indexes before explaining')
+def main(databases, index):
+    """Print the query plans of the usual filters (and add the indexes)."""
+    for dbname in databases:
+        if index:
+            create_indexes(dbname)
+        print(dbname)
+        connection = get_connection(dbname)
+        for key in FILTER_KEYS:
+            value = _example_value(connection, key)
+            if value is None:
+                continue
+            plans = explain_select(dbname, **{key: value})
+            print('  %s=%s%s' % (key, value, ' FULL SCAN' if plans['full_scan'] else ''))
+            for step in plans['query_columns']:
+                print('    query_columns: %s' % step)
+            for step in plans['select']:
+                print('    select:        %s' % step)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Sweep of the double layer parameters C_gap and pzc.
+
+The free energies of FreeEnergyDiagram depend on the capacitance C_gap
+and the potential of zero charge through the surface charge at the
+potential, sigma = C_gap (U - pzc). The charging curves are fitted once
+(FreeEnergyDiagram.charging_curves and the output of plot_molecule) and
+evaluated for every combination of capacitances and pzc offsets by
+broadcasting (C_gap, pzc offset, curve) arrays. Because the fits are
+linear in sigma, the derivatives of the free energies with respect to
+C_gap and the pzc are exact:
+
+    dG/dC_gap = -slope (U - pzc)
+    dG/dpzc   =  slope C_gap
+"""
+
+import numpy as np
+from ase import units
+from uncertainty import stack_charging_curves, batched_linear_fit
+
+
+def fit_charging_curves(charging_curves):
+    """Linear fits of the energy against the surface charge of all charging curves
+
+    :param charging_curves: facet -> metal -> state -> curve
+    :type charging_curves: dict
+    :return: labels (facet, metal, state) and (curve,) arrays of 'slope', 'intercept',
+        'pzc', 'C_gap', 'correction', 'thermal_correction' and 'electrons'
+    :rtype: tuple
+    """
+    labels, curves = stack_charging_curves(charging_curves)
+    ## surface charge of the points in mu C / cm-2
+    sigma = (curves['charge'] - curves['q_eff'][:, None] / 2) / curves['area'][:, None] * units._e * 1e6
+    slope, intercept = batched_linear_fit(sigma, curves['energy'], curves['weights'])
+    fits = {'slope': slope, 'intercept': intercept}
+    for key in ['pzc', 'C_gap', 'correction', 'thermal_correction', 'electrons']:
+        fits[key] = curves[key]
+    return labels, fits
+
+
+def sweep_double_layer(charging_curves, potential, C_gaps, pzc_offsets=(0.,), fits=None):
+    """Free energies for every combination of capacitance and pzc offset
+
+    :param charging_curves: facet -> metal -> state -> curve
+    :type charging_curves: dict
+    :param potential: SHE potential
+    :type potential: float
+    :param C_gaps: capacitances in mu F cm-2
+    :type C_gaps: list
+    :param pzc_offsets: shifts of the pzc of every catalyst in V, defaults to no shift
+    :type pzc_offsets: list, optional
+    :param fits: output of fit_charging_curves, to reuse the fits for several sweeps
+    :type fits: tuple, optional
+    :return: 'labels', the swept values and (C_gap, pzc offset, label) arrays of the
+        'formation_energy', 'free_energy' and their derivatives 'dG_dC_gap' and 'dG_dpzc'
+    :rtype: dict
+    """
+    labels, fits = fits if fits is not None else fit_charging_curves(charging_curves)
+    C_gaps = np.atleast_1d(np.asarray(C_gaps, dtype=float))
+    pzc_offsets = np.atleast_1d(np.asarray(pzc_offsets, dtype=float))
+
+    C_gap = C_gaps[:, None, None]
+    overpotential = potential - fits['pzc'] - pzc_offsets[None, :, None]
+    formation_energy = fits['intercept'] - fits['slope'] * C_gap * overpotential
+    shape = formation_energy.shape
+    return {
+        'labels': labels,
+        'potential': potential,
+        'C_gap': C_gaps,
+        'pzc_offset': pzc_offsets,
+        'formation_energy': formation_energy,
+        'free_energy': formation_energy + fits['correction'],
+        'dG_dC_gap': np.broadcast_to(-1 * fits['slope'] * overpotential, shape),
+        'dG_dpzc': np.broadcast_to(fits['slope'] * C_gap, shape),
+    }
+
+
+def sensitivity_table(sweep, key='free_energy'):
+    """Range of the free energy over the sweep and the derivatives at its centre
+
+    :return: facet -> metal -> state -> dict of 'min', 'max', 'dG_dC_gap', 'dG_dpzc'
+    :rtype: dict
+    """
+    values = sweep[key]
+    low = values.min(axis=(0, 1))
+    high = values.max(axis=(0, 1))
+    i, j = values.shape[0] // 2, values.shape[1] // 2
+    table = {}
+    for k, (facet, metal, state) in enumerate(sweep['labels']):
+        table.setdefault(facet, {}).setdefault(metal, {})[state] = {
+            'min': low[k], 'max': high[k],
+            'dG_dC_gap': sweep['dG_dC_gap'][i, j, k], 'dG_dpzc': sweep['dG_dpzc'][i, j, k]}
+    return table
+
+
+def save_sweep(filename, sweep):
+    """Write the sweep to an npz file."""
+    arrays = {key: value for key, value in sweep.items() if key != 'labels'}
+    np.savez(filename, labels=np.array(sweep['labels'], dtype=str), **arrays)
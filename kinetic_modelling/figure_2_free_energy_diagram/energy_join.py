@@ -0,0 +1,120 @@
+"""Join of adsorbate and slab energies on (system, solvation, charge).
+
+The energy of an adsorbate at a charge is only meaningful relative to
+the slab of the same system with the same solvation and charge. All
+records are passed as arrays, the slab records are sorted once on the
+key and every adsorbate record is matched by a binary search, so the
+energy differences of all states come out of one call::
+
+    joined = join_by_charge(system, solvation, state, charge, energy)
+    curves = group_by_state(joined)
+    charge, dE = curves['Au/211', 'implicit', 'COOH']
+
+Charges are matched after rounding to ``decimals`` decimals. Records
+without a partner are returned in 'unmatched' instead of being dropped
+silently.
+
+The result does not depend on the order of the records. Sorting the
+energies of every state, as plot_molecule did before, pairs them with
+the wrong charges as soon as the energy does not grow with the charge.
+``python -m doctest energy_join.py`` checks this on shuffled rows:
+
+    >>> state = ['slab', 'COOH', 'slab', 'COOH', 'slab', 'COOH']
+    >>> charge = [1., 0., 0., 2., 2., 1.]
+    >>> energy = [-11., -20.5, -10., -23.5, -12., -22.]
+    >>> joined = join_by_charge(['CoPc'] * 6, ['implicit'] * 6, state, charge, energy)
+    >>> charge, dE = group_by_state(joined)['CoPc', 'implicit', 'COOH']
+    >>> charge.tolist(), dE.tolist()
+    ([0.0, 2.0, 1.0], [-10.5, -11.5, -11.0])
+    >>> (np.sort([-20.5, -23.5, -22.]) - np.sort([-11., -10., -12.])).tolist()
+    [-11.5, -11.0, -10.5]
+
+The last line is the old alignment, which gives charges 0, 1 and 2 the
+energies of charges 2, 1 and 0.
+"""
+
+import numpy as np
+
+
+def _keys(system, solvation, charge, decimals):
+    keys = np.empty(len(charge), dtype=[('system', system.dtype), ('solvation', solvation.dtype), ('charge', np.int64)])
+    keys['system'] = system
+    keys['solvation'] = solvation
+    keys['charge'] = np.round(charge * 10**decimals).astype(np.int64)
+    return keys
+
+
+def join_by_charge(system, solvation, state, charge, energy, reference='slab', decimals=6):
+    """Energies of the adsorbate records relative to the reference record with the same key
+
+    :param system: (record,) name of the system, e.g. facet/metal
+    :type system: list
+    :param solvation: (record,) 'implicit', 'vacuum', ...
+    :type solvation: list
+    :param state: (record,) adsorbate, reference or gas state
+    :type state: list
+    :param charge: (record,) charge of the calculation
+    :type charge: list
+    :param energy: (record,) energy; records with nan energies are ignored
+    :type energy: list
+    :param reference: state of the reference records, defaults to 'slab'
+    :type reference: str, optional
+    :param decimals: decimals of the charges that are compared, defaults to 6
+    :type decimals: int, optional
+    :return: (match,) arrays 'system', 'solvation', 'state', 'charge' and 'dE' of the matched
+        records in their input order, and 'unmatched', the same columns (without dE) of the
+        adsorbate records without a reference and of the reference records without an adsorbate
+    :rtype: dict
+    """
+    system = np.asarray(system, dtype=str)
+    solvation = np.asarray(solvation, dtype=str)
+    state = np.asarray(state, dtype=str)
+    charge = np.asarray(charge, dtype=float)
+    energy = np.asarray(energy, dtype=float)
+
+    valid = ~np.isnan(energy)
+    keys = _keys(system, solvation, charge, decimals)
+    is_reference = valid & (state == reference)
+    is_adsorbate = valid & (state != reference)
+
+    references = np.flatnonzero(is_reference)
+    order = np.argsort(keys[references], order=('system', 'solvation', 'charge'), kind='stable')
+    references = references[order]
+    sorted_keys = keys[references]
+    if len(sorted_keys) > 1 and np.any(sorted_keys[1:] == sorted_keys[:-1]):
+        raise ValueError('More than one %s record with the same system, solvation and charge'%reference)
+
+    adsorbates = np.flatnonzero(is_adsorbate)
+    position = np.searchsorted(sorted_keys, keys[adsorbates])
+    position = np.minimum(position, max(len(references) - 1, 0))
+    found = len(references) > 0
+    matched = (sorted_keys[position] == keys[adsorbates]) if found else np.zeros(len(adsorbates), dtype=bool)
+
+    rows = adsorbates[matched]
+    partners = references[position[matched]]
+    used = np.zeros(len(state), dtype=bool)
+    used[partners] = True
+    unmatched = np.concatenate([adsorbates[~matched], references[~used[references]]])
+    return {
+        'system': system[rows],
+        'solvation': solvation[rows],
+        'state': state[rows],
+        'charge': charge[rows],
+        'dE': energy[rows] - energy[partners],
+        'unmatched': {'system': system[unmatched], 'solvation': solvation[unmatched],
+                      'state': state[unmatched], 'charge': charge[unmatched]},
+    }
+
+
+def group_by_state(joined):
+    """Charges and energy differences of the joined records per (system, solvation, state)
+
+    :param joined: output of join_by_charge
+    :type joined: dict
+    :return: (system, solvation, state) -> (charge, dE) arrays in the input order
+    :rtype: dict
+    """
+    groups = {}
+    for i, key in enumerate(zip(joined['system'].tolist(), joined['solvation'].tolist(), joined['state'].tolist())):
+        groups.setdefault(key, []).append(i)
+    return {key: (joined['charge'][index], joined['dE'][index]) for key, index in groups.items()}
@@ -1,15 +1,19 @@
 
-import xlrd
 import matplotlib
 import numpy as np
 from useful_functions import get_fit_from_points
+from experimental_data import load_polarisation_data, fit_window_mask
 
 def plot_experimental_data(f, ax, annotation, title, color, fit_min=-0.75, fit_lim=-1., fit_all=True, \
-        plot_line=True, marker='o', pH_material=None):
+        plot_line=True, marker='o', pH_material=None, auto_fit=False):
 
-    wb = xlrd.open_workbook(f)
+    curves = load_polarisation_data(f)
+    if auto_fit and not fit_all:
+        ## linear regions picked automatically instead of fit_min/fit_lim
+        from tafel import get_tafel_slopes
+        auto_tafel = get_tafel_slopes([(c['potential'], c['current']) for c in curves.values()])
 
-    sheet_names = wb.sheet_names()
+    sheet_names = list(curves)
     cmap = matplotlib.cm.get_cmap('coolwarm', len(sheet_names))
 
     fit_potential_all = []
@@ -18,29 +22,15 @@ def plot_experimental_data(f, ax, annotation, title, color, fit_min=-0.75, fit_l
 
     tafel_all = []
     for i, label in enumerate(sheet_names):
-        sheet = wb.sheet_by_index(i)
-        pot_sheet = sheet.col_slice(0, start_rowx=2, end_rowx=None)
-        current_sheet = sheet.col_slice(-1, start_rowx=2, end_rowx=None)
+        potential = curves[label]['potential']
+        current = curves[label]['current']
 
-        potential = []
-        current = []
-
-        for j in range(len(pot_sheet)):
-            try:
-                potential.append(float(pot_sheet[j].value))
-            except ValueError:
-                continue
-            current.append(float(current_sheet[j].value))
-        
-         
         ax.plot(potential, current, marker, \
             markersize=5,
              label=label.replace('KHCO3','').replace('Phosphate',''), color=cmap(i))
-        potential = np.array(potential)
-        current = np.array(current)
 
         # Fit the Tafel slope
-        fit_index = [i for i in range(len(potential)) if fit_min > potential[i] > fit_lim ]
+        fit_index = fit_window_mask(potential, fit_min, fit_lim)
         fit_potential = potential[fit_index]
         fit_log_current = np.log10(current[fit_index])
         fit_current = current[fit_index]
@@ -50,21 +40,31 @@ def plot_experimental_data(f, ax, annotation, title, color, fit_min=-0.75, fit_l
             fit_log_current_all += fit_log_current.tolist()
             fit_current_all += fit_current.tolist()
 
-        if not fit_all:
+        if not fit_all and auto_fit:
+            ## curves too short for a Tafel region are not fitted
+            if auto_tafel['npoints'][i] == 0:
+                continue
+            low, high = auto_tafel['potential_range'][i]
+            fit_index = (potential >= low) & (potential <= high)
+            fit_plot = get_fit_from_points(potential[fit_index], np.log10(current[fit_index]), 1)
+            ax.plot(potential, 10**fit_plot['p'](potential), color=cmap(i), alpha=0.5)
+            tafel_all.append(auto_tafel['tafel_slope'][i])
+
+        elif not fit_all:
             if 'pH 6.4' in label.replace('KHCO3','').replace('Phosphate',''):
                 if pH_material == 'Co':
-                    fit_index = [i for i in range(len(potential)) if -0.5 > potential[i] > -0.9 ]
+                    fit_index = fit_window_mask(potential, -0.5, -0.9)
                 elif pH_material == 'Ni':
-                    fit_index = [i for i in range(len(potential)) if -0.88> potential[i] > -1.1 ]
+                    fit_index = fit_window_mask(potential, -0.88, -1.1)
 
                 fit_potential = potential[fit_index]
                 fit_log_current = np.log10(current[fit_index])
                 fit_current = current[fit_index]                
             if 'pH 6.8' in label.replace('KHCO3','').replace('Phosphate',''):
                 if pH_material == 'Co':
-                    fit_index = [i for i in range(len(potential)) if -0.5 > potential[i] > -1. ]
+                    fit_index = fit_window_mask(potential, -0.5, -1.)
                 elif pH_material == 'Ni':
-                    fit_index = [i for i in range(len(potential)) if -0.85> potential[i] > -1.1 ]
+                    fit_index = fit_window_mask(potential, -0.85, -1.1)
                 fit_potential = potential[fit_index]
                 fit_log_current = np.log10(current[fit_index])
                 fit_current = current[fit_index]                
@@ -0,0 +1,116 @@
+"""Cached access to the experimental polarisation data.
+
+Each workbook (one sheet per pH) and each two column csv file
+is converted once into NumPy arrays and stored as a .npz file in
+``cache_dir``. The cache is rebuilt whenever the modification time
+of the source file changes.
+"""
+
+import os
+import hashlib
+from pathlib import Path
+import numpy as np
+
+CACHE_DIR = 'cache'
+
+## in-process copy so that repeated calls in one figure build
+## do not even touch the .npz files
+_loaded = {}
+
+
+def _cache_filename(filename, cache_dir):
+    """Name of the .npz file belonging to an input file."""
+    tag = hashlib.md5(os.path.abspath(filename).encode()).hexdigest()[:10]
+    return Path(cache_dir) / ('%s_%s.npz' % (Path(filename).stem, tag))
+
+
+def _column_to_float(values):
+    """Convert a column of spreadsheet cells to floats, NaN where not a number."""
+    column = np.full(len(values), np.nan)
+    for j, value in enumerate(values):
+        try:
+            column[j] = float(value)
+        except ValueError:
+            continue
+    return column
+
+
+def _parse_workbook(filename, potential_column=0, current_column=-1, start_row=2):
+    """Read every sheet of an xls workbook with xlrd."""
+    import xlrd
+    wb = xlrd.open_workbook(filename)
+    data = {}
+    for sheet in wb.sheets():
+        potential = _column_to_float(sheet.col_values(potential_column, start_rowx=start_row))
+        current = _column_to_float(sheet.col_values(current_column, start_rowx=start_row))
+        ## rows without a potential are headers or notes
+        valid = ~np.isnan(potential)
+        data[sheet.name] = {'potential': potential[valid], 'current': current[valid]}
+    return data
+
+
+def _parse_csv(filename):
+    """Read a two column (potential, current) csv file."""
+    potential, current = np.loadtxt(filename, delimiter=',', ndmin=2).T
+    return {Path(filename).stem: {'potential': potential, 'current': current}}
+
+
+def _write_cache(cachefile, mtime, data):
+    cachefile.parent.mkdir(parents=True, exist_ok=True)
+    arrays = {'mtime': np.array(mtime), 'labels': np.array(list(data), dtype=str)}
+    for i, label in enumerate(data):
+        arrays['potential_%d' % i] = data[label]['potential']
+        arrays['current_%d' % i] = data[label]['current']
+    np.savez(cachefile, **arrays)
+
+
+def _read_cache(cachefile, mtime):
+    """Return the cached data or None if it is stale or missing."""
+    if not cachefile.exists():
+        return None
+    with np.load(cachefile) as cached:
+        if float(cached['mtime']) != mtime:
+            return None
+        data = {}
+        for i, label in enumerate(cached['labels']):
+            data[str(label)] = {'potential': cached['potential_%d' % i],
+                                'current': cached['current_%d' % i]}
+    return data
+
+
+def load_polarisation_data(filename, cache_dir=CACHE_DIR):
+    """Get the polarisation curves stored in an experimental file
+
+    :param filename: xls workbook (one sheet per curve) or csv file
+    :type filename: str
+    :param cache_dir: folder in which the .npz cache is stored, defaults to CACHE_DIR
+    :type cache_dir: str, optional
+    :return: sheet label -> {'potential': array, 'current': array}
+    :rtype: dict
+    """
+    mtime = os.path.getmtime(filename)
+    key = os.path.abspath(filename)
+    if key in _loaded and _loaded[key][0] == mtime:
+        return _loaded[key][1]
+
+    cachefile = _cache_filename(filename, cache_dir)
+    data = _read_cache(cachefile, mtime)
+    if data is None:
+        if Path(filename).suffix == '.csv':
+            data = _parse_csv(filename)
+        else:
+            data = _parse_workbook(filename)
+        _write_cache(cachefile, mtime, data)
+
+    _loaded[key] = (mtime, data)
+    return data
+
+
+def fit_window_mask(potential, fit_min, fit_lim):
+    """Boolean mask of the points with fit_min > potential > fit_lim.
+
+    Works on a single curve or on a padded (curve, point) array
+    together with array valued windows of shape (curve, 1).
+    """
+    potential = np.asarray(potential)
+    return (potential < fit_min) & (potential > fit_lim)
@@ -1,8 +1,6 @@
 
 import numpy as np
 from ase import units
-from matplotlib import cm
-import matplotlib.pyplot as plt
 from ase.utils import pickleload
 import os
 from ase.geometry import geometry
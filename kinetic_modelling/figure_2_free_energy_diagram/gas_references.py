@@ -0,0 +1,121 @@
+"""Cached energies of the gas phase references.
+
+The internal energies of CO, CO2, H2 and H2O are read from the reference
+database and their free energies are computed with the ideal gas
+approximation once per (content of the database, functional, cutoff,
+temperature, pressure, frequencies). The result is stored as a small json
+file in ``cache_dir`` and kept in memory, so FreeEnergyDiagram and the
+other scripts do not decode the Atoms of the database or redo the
+thermochemistry on every call.
+"""
+
+import json
+import hashlib
+from pathlib import Path
+import numpy as np
+
+CACHE_DIR = 'cache'
+GASES = ('CO', 'CO2', 'H2', 'H2O')
+GEOMETRY = {'CO': ('linear', 1), 'CO2': ('linear', 2), 'H2': ('linear', 2), 'H2O': ('nonlinear', 3)}
+## eV per cm-1, as used for all frequencies of the figures
+CMTOEV = 0.00012
+
+## in-process copy, keyed like the cache files
+_loaded = {}
+
+
+def _file_hash(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _cache_key(refdbname, functional, pw, temperature, pressure, frequencies, CO2g_correction):
+    settings = json.dumps([functional, float(pw), float(temperature), float(pressure), float(CO2g_correction),
+                           {gas: list(map(float, frequencies[gas + 'g'])) for gas in GASES}], sort_keys=True)
+    return hashlib.md5((_file_hash(refdbname) + settings).encode()).hexdigest()[:16]
+
+
+def compute_gas_references(referencedb, frequencies, functional='RP', pw=500., temperature=298.15,
+                           pressure=101325, CO2g_correction=0.45):
+    """Internal and free energies of the gas phase references from the database
+
+    :param referencedb: reference database with all gas references
+    :type referencedb: ASE database
+    :param frequencies: vibrations in cm-1 of the gases, keys suffixed with g
+    :type frequencies: dict
+    :param CO2g_correction: correction of the internal energy of CO2 in eV, defaults to 0.45
+    :type CO2g_correction: float, optional
+    :return: 'E' and 'G', gas -> energy in eV
+    :rtype: dict
+    """
+    from ase.thermochemistry import IdealGasThermo
+    energies = {'E': {}, 'G': {}}
+    for row in referencedb.select(functional=functional, pw=pw):
+        gas = row.states.replace('state_', '')
+        if gas not in GASES:
+            continue
+        geometry, symmetrynumber = GEOMETRY[gas]
+        energies['E'][gas] = row.energy + (CO2g_correction if gas == 'CO2' else 0.)
+        energies['G'][gas] = IdealGasThermo(
+            CMTOEV * np.array(frequencies[gas + 'g']),
+            geometry=geometry,
+            atoms=row.toatoms(),
+            symmetrynumber=symmetrynumber,
+            spin=0,
+        ).get_gibbs_energy(temperature, pressure, verbose=False)
+    missing = set(GASES) - set(energies['E'])
+    if missing:
+        raise KeyError('No %s references for %s at %s eV'%(', '.join(sorted(missing)), functional, pw))
+    return energies
+
+
+def gas_references(refdbname, frequencies, functional='RP', pw=500., temperature=298.15,
+                   pressure=101325, CO2g_correction=0.45, cache_dir=CACHE_DIR):
+    """Internal and free energies of the gas phase references, cached
+
+    Same arguments as compute_gas_references, with the database file name.
+    The cache is rebuilt when the content of the database changes.
+
+    :return: 'E' and 'G', gas -> energy in eV
+    :rtype: dict
+    """
+    key = _cache_key(refdbname, functional, pw, temperature, pressure, frequencies, CO2g_correction)
+    if key in _loaded:
+        return _loaded[key]
+
+    cachefile = Path(cache_dir) / ('gas_references_%s.json'%key)
+    if cachefile.exists():
+        with open(cachefile, 'r') as handle:
+            energies = json.load(handle)
+    else:
+        from db_query import get_database
+        energies = compute_gas_references(get_database(refdbname), frequencies, functional, pw,
+                                          temperature, pressure, CO2g_correction)
+        cachefile.parent.mkdir(parents=True, exist_ok=True)
+        with open(cachefile, 'w') as handle:
+            json.dump(energies, handle)
+
+    _loaded[key] = energies
+    return energies
+
+
+def reference_energies(energies):
+    """CatMAP references of the adsorbates and of CO(g) from the gas energies
+
+    H2, CO2 and H2O are the references, CO(g) follows from the water gas
+    shift reaction.
+
+    :param energies: 'E' or 'G' of gas_references
+    :type energies: dict
+    :return: CO, COOH, CO2 and CO(g) -> reference energy
+    :rtype: dict
+    """
+    return {
+        'CO': energies['CO2'] + energies['H2'] - energies['H2O'],
+        'COOH': energies['CO2'] + 0.5 * energies['H2'],
+        'CO2': energies['CO2'],
+        'CO(g)': energies['CO2'] + energies['H2'] - energies['H2O'] - energies['CO'],
+    }
@@ -15,6 +15,10 @@ from ase.data.colors import jmol_colors
 from molecule import plot_molecule
 from experimental import plot_experimental_data
 from computational_panel import FreeEnergyDiagram, plot_computational_diagram
+from computational_panel import plot_charging_curves, write_charging_report
+from uncertainty import sample_free_energies, save_samples, summarise
+from double_layer import sweep_double_layer, sensitivity_table, save_sweep
+from catmap_tables import energy_tables, write_energy_files, save_energy_tables
 Path('output').mkdir(parents=True, exist_ok=True)
 Path('output_si').mkdir(parents=True, exist_ok=True)
 
@@ -36,6 +40,17 @@ def cli_parse():
     parser.add_argument('--gold_experiment', default='inputs/pH_effect_Gold.xls')
     parser.add_argument('--copc_experiment', default='inputs/pH_effect_CoPc.xls')
     parser.add_argument('--molecular_database', default='input_databases/molecule_CO2R.db' )
+    parser.add_argument('--si_files', action='store_true', \
+                            help='Also write one SI charging curve file per metal and facet')
+    parser.add_argument('--nsamples', default=0, type=int, \
+                            help='Monte-Carlo samples of the free energies, 0 to switch off')
+    parser.add_argument('--ph_grid', default=[], nargs='*', type=float, \
+                            help='pH values of the free energies in output/free_energies_grid.npz')
+    parser.add_argument('--C_gap', default=25., type=float, help='Capacitance in mu F cm-2')
+    parser.add_argument('--sweep_C_gap', default=[], nargs='*', type=float, \
+                            help='Capacitances in mu F cm-2 of the double layer sweep')
+    parser.add_argument('--sweep_pzc', default=[0.], nargs='*', type=float, \
+                            help='Shifts of the pzc in V of the double layer sweep')
     return parser.parse_args()
 
 
@@ -62,6 +77,7 @@ def main():
     parser = cli_parse()
     databases = glob(parser.database_folder + '/*.db')
     data = {}
+    charging_curves = {}
     plot_experimental_data(parser.gold_experiment,ax_Au, 
                 r'pH independent', r'Au(pc)', jmol_colors[atomic_numbers['Au']],
                 fit_min=-0.75, fit_lim=-1.05)
@@ -79,32 +95,59 @@ def main():
                 r'pH dependent', r'CoPc', jmol_colors[atomic_numbers['Co']],
                 fit_lim=-1., fit_min=-0.5, fit_all=False, pH_material='Co')
 
-    ## Get the Free energy diagram
+    ## Get the Free energy diagram, the charging curves are parsed and fitted
+    ## once and evaluated for all potentials together
+    method = FreeEnergyDiagram(dbnames=databases,\
+                                refdbname=parser.referencedb_name,\
+                                potential=parser.potential[0], 
+                                pH=parser.ph,
+                                C_gap=parser.C_gap)
+    method.main(plot=False)
+    ## SI plots of the charging curves, which do not depend on the potential
+    write_charging_report(method.charging_curves, method.charging_panels, method.colors)
+    if parser.si_files:
+        plot_charging_curves(method.charging_curves, method.charging_panels, method.colors)
+    writeout_zero = method.writeout_zero
+    explicit_charge = method.explicit_charge
+    E0 = method.E0
+
+    pHs = [parser.ph] + [pH for pH in parser.ph_grid if pH != parser.ph]
+    tables = energy_tables(method.charging_curves, parser.potential, pHs)
+    ## CatMAP input files, and all of them in one file for Figure 3
+    write_energy_files(tables, method.writeout_gas, method.frequencies)
+    save_energy_tables('output/catmap_energies.npz', tables, method.writeout_gas, method.frequencies)
+    if parser.ph_grid:
+        np.savez('output/free_energies_grid.npz', labels=np.array(tables['labels'], dtype=str),
+                 potentials=tables['potentials'], pHs=tables['pHs'], free_energy=tables['free_energy'])
+
     for potential in parser.potential:
-        method = FreeEnergyDiagram(dbnames=databases,\
-                                    refdbname=parser.referencedb_name,\
-                                    potential=potential, 
-                                    pH=parser.ph)
-        method.main()
-        # data[potential], writeout, writeout_zero, explicit_charge, E0  = diagram_data
-
-        data[potential] = method.diagram
-        writeout = method.writeout
-        writeout_zero = method.writeout_zero
-        explicit_charge = method.explicit_charge
-        E0 = method.E0
-
-        filename = 'output/catmap_potential_%1.2f.txt'%potential
-        with open(filename, 'w') as handle:
-            csvwriter = csv.writer(handle, delimiter='\t')
-            for row in writeout:
-                csvwriter.writerow(row)
+        data[potential] = method.diagram_from_tables(tables, potential)
+        charging_curves[potential] = method.charging_curves_at(potential)
+
+        if parser.nsamples:
+            ## distributions of the formation and free energies, read by Figure 3
+            samples = sample_free_energies(charging_curves[potential], potential, nsamples=parser.nsamples)
+            save_samples('output/uncertainty_potential_%1.2f.npz'%potential, samples)
+            print('Free energies at %1.2f V (mean +- std):'%potential)
+            pprint({facet: {metal: {state: '%1.2f +- %1.2f'%(v['mean'], v['std']) for state, v in states.items()}
+                    for metal, states in metals.items()} for facet, metals in summarise(samples).items()})
         
     ## do the plot ata for the molecular part
     ## this conforms with the new way of doing finite difference
     ## using the newer implementation, which is why it is a new
     ## class
-    plot_molecule([parser.potential[1]], parser.ph, parser.molecular_database, cax_Co, method.references, method.references_E)
+    charging_curves[parser.potential[1]].update(plot_molecule([parser.potential[1]], parser.ph, 
+                    parser.molecular_database, cax_Co, method.references, method.references_E, C_gap=parser.C_gap))
+
+    ## sensitivity of the free energies to the double layer parameters
+    if parser.sweep_C_gap:
+        for potential in parser.potential:
+            sweep = sweep_double_layer(charging_curves[potential], potential, parser.sweep_C_gap, parser.sweep_pzc)
+            save_sweep('output/double_layer_sweep_potential_%1.2f.npz'%potential, sweep)
+            print('Free energies at %1.2f V over the double layer sweep (min, max, dG/dC_gap, dG/dpzc):'%potential)
+            pprint({facet: {metal: {state: '%1.2f, %1.2f, %1.3f, %1.2f'%(v['min'], v['max'], v['dG_dC_gap'], v['dG_dpzc'])
+                    for state, v in states.items()} for metal, states in metals.items()}
+                    for facet, metals in sensitivity_table(sweep).items()})
 
     ## save the catmap input file
     filename = 'output/catmap_potential_pzc.txt'
@@ -2,20 +2,24 @@
 
 from ase.data import atomic_numbers
 from ase.data.colors import jmol_colors
-import collections
-from ase.db import connect
+from db_query import get_database
 import numpy as np
 from ase import units
-import matplotlib.pyplot as plt
 from useful_functions import get_vasp_nelect0
 from useful_functions import get_fit_from_points
+from energy_join import join_by_charge, group_by_state
 
-def plot_molecule(potentials, pH, database, ax, references, references_E):
+def plot_molecule(potentials, pH, database, ax, references, references_E, C_gap=25, pzc=-0.05):
     ## this class will plot the molecular data onto
     ## the requested axis
+    ## C_gap in mu F cm-2 and pzc in V vs SHE of CoPc on graphene
+    ## returns the charging curves at the last potential in the format
+    ## of FreeEnergyDiagram.charging_curves
+    import matplotlib.pyplot as plt
+    charging_curves = {}
     figt, axt = plt.subplots(1, 1, figsize=(8,6), constrained_layout=True)
-    energy_data = collections.defaultdict(list)
-    for row in connect(database).select(sampling='sampling_CoPc'):
+    records = []
+    for row in get_database(database).select(sampling='sampling_CoPc'):
         atoms = row.toatoms()
         charge0 = get_vasp_nelect0(atoms)
         q_implicit = row.tot_charge - charge0
@@ -29,43 +33,62 @@ def plot_molecule(potentials, pH, database, ax, references, references_E):
             continue
         cell = atoms.get_cell()
         area = np.linalg.norm(cell[0]) * np.linalg.norm(cell[1]) * 1e-16
-        energy_data[states].append([q_implicit, row.energy])
-    
+        records.append((states.replace('state_', ''), q_implicit, row.energy))
+
+    if not records:
+        print('No CoPc calculations in %s'%database)
+        plt.close(figt)
+        return charging_curves
+
+    ## energies of the adsorbates relative to the slab at the same charge
+    states, charges, energies = zip(*records)
+    joined = join_by_charge(['CoPc'] * len(records), ['implicit'] * len(records), states, charges, energies,
+                            reference='implicit_slab')
+    for state, charge in zip(joined['unmatched']['state'], joined['unmatched']['charge']):
+        print('CoPc %s at charge %1.2f has no partner'%(state, charge))
+    curves = {state: group_by_state(joined)['CoPc', 'implicit', 'implicit_' + state] for state in ['CO2', 'COOH', 'CO']}
+
     for potential in potentials:
 
-        C_gap = 25 # mu F cm-2
-        pzc = -0.05
         sigma_for_pot = C_gap * ( potential - pzc )
 
         U_RHE = potential + 0.059 * pH
         CHE_correction = {'CO':2 * U_RHE, 'COOH':U_RHE}
 
-        ## now arrange the energies and order them correctly
-        dE_CO2_points = np.sort(energy_data['state_implicit_CO2'])[:,0] - np.sort(energy_data['state_implicit_slab'])[:,0]\
-                - references['CO2'] - references_E['CO2'] 
-        dE_COOH_points = np.sort(energy_data['state_implicit_COOH'])[:,0] - np.sort(energy_data['state_implicit_slab'])[:,0]\
-                - references['COOH'] - references_E['COOH'] + CHE_correction['COOH'] 
-        dE_CO_points = np.sort(energy_data['state_implicit_CO'])[:,0] - np.sort(energy_data['state_implicit_slab'])[:,0]\
-                - references['CO'] - references_E['CO'] + CHE_correction['CO'] 
-        charges = np.sort(energy_data['state_implicit_CO2'])[:,1]
+        ## energies against the charges of each state, joined with the slab by charge
+        dE_CO2_points = curves['CO2'][1] - references['CO2'] - references_E['CO2'] 
+        dE_COOH_points = curves['COOH'][1] - references['COOH'] - references_E['COOH'] + CHE_correction['COOH'] 
+        dE_CO_points = curves['CO'][1] - references['CO'] - references_E['CO'] + CHE_correction['CO'] 
 
-        surface_charge = -1 * charges / area * units._e * 1e6
+        surface_charge = {state: -1 * curves[state][0] / area * units._e * 1e6 for state in curves}
         q_co2 = np.sum(dFdG)
         print('-------')
         print('Explicit charge for CO2 in CoPc -%1.2f'%q_co2)
-        surface_charge_CO2 = -1 * (charges + q_co2/2) / area * units._e * 1e6
+        surface_charge_CO2 = -1 * (curves['CO2'][0] + q_co2/2) / area * units._e * 1e6
         axt.axvline(sigma_for_pot)
 
         dE_CO2 = get_fit_from_points(surface_charge_CO2, dE_CO2_points, 1)['p']
-        dE_COOH = get_fit_from_points(surface_charge, dE_COOH_points, 1)['p']
-        dE_CO = get_fit_from_points(surface_charge, dE_CO_points, 1)['p']
+        dE_COOH = get_fit_from_points(surface_charge['COOH'], dE_COOH_points, 1)['p']
+        dE_CO = get_fit_from_points(surface_charge['CO'], dE_CO_points, 1)['p']
+
+        axt.plot(surface_charge['CO2'], dE_CO2_points, 'o', color='tab:red', label='CO2')
+        axt.plot(surface_charge['COOH'], dE_COOH_points, 'o', color='tab:green', label='COOH')
+        axt.plot(surface_charge['CO'], dE_CO_points, 'o', color='tab:blue', label='CO')
+        axt.plot(surface_charge['CO2'], dE_CO2(surface_charge['CO2']), color='tab:red')
+        axt.plot(surface_charge['COOH'], dE_COOH(surface_charge['COOH']), color='tab:green')
+        axt.plot(surface_charge['CO'], dE_CO(surface_charge['CO']), color='tab:blue')
 
-        axt.plot(surface_charge, dE_CO2_points, 'o', color='tab:red', label='CO2')
-        axt.plot(surface_charge, dE_COOH_points, 'o', color='tab:green', label='COOH')
-        axt.plot(surface_charge, dE_CO_points, 'o', color='tab:blue', label='CO')
-        axt.plot(surface_charge, dE_CO2(surface_charge), color='tab:red')
-        axt.plot(surface_charge, dE_COOH(surface_charge), color='tab:green')
-        axt.plot(surface_charge, dE_CO(surface_charge), color='tab:blue')
+        ## same convention as the surfaces: the fit is evaluated at minus the charge
+        ## and the explicit charge enters as charge - q_eff/2
+        points = {'CO2': dE_CO2_points, 'COOH': dE_COOH_points, 'CO': dE_CO_points}
+        for state, dE_points in points.items():
+            correction = -1 * references[state] + CHE_correction.get(state, 0)
+            charging_curves.setdefault('CoPc', {}).setdefault('Co', {})[state] = {
+                'charge': curves[state][0], 'energy': dE_points - correction, 'area': area,
+                'q_eff': -1 * q_co2 if state == 'CO2' else 0, 'pzc': pzc, 'C_gap': C_gap,
+                'correction': correction,
+                'thermal_correction': -1 * references[state], 'electrons': {'CO': 2, 'COOH': 1}.get(state, 0),
+            }
 
         dE_CO2_g = 0
         dE_CO_g = -1*references_E['CO(g)'] - references['CO(g)'] + CHE_correction['CO']
@@ -93,3 +116,4 @@ def plot_molecule(potentials, pH, database, ax, references, references_E):
     axt.set_xlabel(r'Surface Charge / $\mu C cm^{-2}$')
     figt.savefig('output_si/SI_charging_curve_CoPc.pdf')
 
+    return charging_curves
@@ -0,0 +1,139 @@
+"""Tafel analysis of many polarisation curves at once.
+
+Every contiguous window of every curve is fitted with a straight line
+potential = a + b log10(j) in a single pass. The sums needed for the
+least squares fit of the window [start, stop) are differences of
+cumulative sums, so no window is fitted in a Python loop.
+"""
+
+import numpy as np
+
+
+def pad_curves(curves):
+    """Stack curves of different lengths into padded arrays.
+
+    Points with non-positive current (no log) are dropped and each
+    curve is sorted by potential, so that windows are contiguous
+    in potential.
+
+    :param curves: list of (potential, current) pairs
+    :type curves: list
+    :return: potential, log10(current) padded with 0 and the number of points per curve
+    :rtype: tuple
+    """
+    lengths = []
+    cleaned = []
+    for potential, current in curves:
+        potential = np.asarray(potential, dtype=float)
+        current = np.asarray(current, dtype=float)
+        keep = np.isfinite(potential) & (current > 0)
+        order = np.argsort(potential[keep])
+        cleaned.append((potential[keep][order], np.log10(current[keep][order])))
+        lengths.append(keep.sum())
+    lengths = np.array(lengths)
+
+    potential = np.zeros((len(curves), lengths.max()))
+    log_current = np.zeros_like(potential)
+    for i, (u, logj) in enumerate(cleaned):
+        potential[i, :len(u)] = u
+        log_current[i, :len(u)] = logj
+    return potential, log_current, lengths
+
+
+def window_fits(potential, log_current, lengths, min_points=3):
+    """Least squares fit of potential against log10(j) for all windows.
+
+    :param potential: (curve, point) padded potentials
+    :type potential: np.ndarray
+    :param log_current: (curve, point) padded log10 currents
+    :type log_current: np.ndarray
+    :param lengths: number of valid points in each curve
+    :type lengths: np.ndarray
+    :param min_points: smallest window that is fitted, defaults to 3
+    :type min_points: int, optional
+    :return: arrays of shape (curve, start, stop) with the slope, its
+        standard error, r2 and number of points; windows that are too
+        short or run past the end of a curve are NaN
+    :rtype: dict
+    """
+    x = log_current
+    y = potential
+
+    def cumulative(a):
+        ## leading zero so that sum(start:stop) = c[stop] - c[start]
+        return np.concatenate([np.zeros((a.shape[0], 1)), np.cumsum(a, axis=1)], axis=1)
+
+    sums = {}
+    for name, values in (('x', x), ('y', y), ('xx', x * x), ('xy', x * y), ('yy', y * y)):
+        c = cumulative(values)
+        sums[name] = c[:, None, :] - c[:, :, None]
+
+    npoints = x.shape[1] + 1
+    start, stop = np.meshgrid(np.arange(npoints), np.arange(npoints), indexing='ij')
+    n = (stop - start).astype(float)
+    valid = (n >= max(min_points, 3))[None, :, :] & (stop[None, :, :] <= lengths[:, None, None])
+    n = np.where(valid, n, np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sxx = sums['xx'] - sums['x']**2 / n
+        sxy = sums['xy'] - sums['x'] * sums['y'] / n
+        syy = sums['yy'] - sums['y']**2 / n
+        slope = sxy / sxx
+        sse = np.clip(syy - slope * sxy, 0, None)
+        r2 = 1 - sse / syy
+        stderr = np.sqrt(sse / (n - 2) / sxx)
+
+    return {'slope': slope, 'stderr': stderr, 'r2': r2, 'n': n}
+
+
+def get_tafel_slopes(curves, min_points=4, confidence=0.95, rel_tol=1e-4):
+    """Find the best linear Tafel region of every curve
+
+    The chosen window is the one with the smallest relative standard
+    error of the slope; this favours long windows but penalises the
+    curvature from mass transport or a change in mechanism. Relative
+    errors below rel_tol (e.g. noise free computational curves) count
+    as equal and the longest of those windows is taken.
+
+    :param curves: list of (potential, current) pairs, computational or experimental
+    :type curves: list
+    :param min_points: smallest number of points in a Tafel region, defaults to 4
+    :type min_points: int, optional
+    :param confidence: level of the confidence interval, defaults to 0.95
+    :type confidence: float, optional
+    :param rel_tol: relative slope error below which windows are equally good, defaults to 1e-4
+    :type rel_tol: float, optional
+    :return: per curve arrays of the Tafel slope and its confidence
+        interval in mV/dec, r2 and the potential range of the window;
+        NaN (and 0 points) for curves with fewer than min_points valid points
+    :rtype: dict
+    """
+    from scipy import stats
+    potential, log_current, lengths = pad_curves(curves)
+    fits = window_fits(potential, log_current, lengths, min_points=min_points)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        relative_error = np.abs(fits['stderr'] / fits['slope'])
+    score = np.maximum(np.nan_to_num(relative_error, nan=np.inf), rel_tol)
+    ncurves = score.shape[0]
+    best_score = score.reshape(ncurves, -1).min(axis=1)
+    length = np.where(score <= best_score[:, None, None], fits['n'], -1)
+    best = length.reshape(ncurves, -1).argmax(axis=1)
+    start, stop = np.unravel_index(best, score.shape[1:])
+    index = (np.arange(ncurves), start, stop)
+    ## curves without any window of min_points points
+    found = np.isfinite(best_score)
+
+    npoints = np.where(found, fits['n'][index], 0)
+    with np.errstate(invalid='ignore'):
+        t = stats.t.ppf(0.5 + confidence / 2, npoints - 2)
+    rows = np.arange(ncurves)
+    potential_range = np.stack([potential[rows, start], potential[rows, stop - 1]], axis=1)
+
+    return {
+        'tafel_slope': np.where(found, -1 * fits['slope'][index] * 1e3, np.nan),
+        'confidence_interval': np.where(found, t * fits['stderr'][index] * 1e3, np.nan),
+        'r2': np.where(found, fits['r2'][index], np.nan),
+        'npoints': npoints.astype(int),
+        'potential_range': np.where(found[:, None], potential_range, np.nan),
+    }
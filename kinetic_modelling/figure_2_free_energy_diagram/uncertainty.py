@@ -0,0 +1,216 @@
+"""Monte-Carlo propagation of the uncertainties of the free energy diagram.
+
+The samples are drawn for
+    - the DFT energies: a systematic error of every adsorbate on every
+      catalyst and a smaller independent error of every point of the
+      charging curve
+    - the capacitance C_gap (the same for all catalysts, lognormal so
+      that it stays positive) and the potential of zero charge (one
+      per catalyst)
+    - the explicit charge of CO2* from the finite difference calculations
+and are pushed through the charging curve fits and the thermochemistry
+of FreeEnergyDiagram. All charging curves are padded into one
+(curve, point) array, so every step works on (sample, curve, point)
+arrays at once.
+
+The formation energies are the descriptors of the CatMAP runs, so
+their samples give the distribution of the TOF on a production rate
+map (log_tof_samples).
+"""
+
+import numpy as np
+from ase import units
+
+## standard deviations of the sampled quantities
+SIGMAS = {
+    'energy': 0.1, # eV, per adsorbate and catalyst
+    'energy_point': 0.02, # eV, per point of the charging curve
+    'C_gap': 5.0, # mu F cm-2
+    'pzc': 0.1, # V
+    'explicit_charge': 0.05, # e
+}
+
+
+def batched_linear_fit(x, y, weights=None):
+    """Slope and intercept of a least squares line through every row of (..., point) arrays
+
+    :param x: abscissae
+    :type x: np.ndarray
+    :param y: ordinates, same shape as x
+    :type y: np.ndarray
+    :param weights: 1 for points used in the fit, 0 for padding, defaults to all 1
+    :type weights: np.ndarray, optional
+    :return: slope and intercept, shape (...)
+    :rtype: tuple
+    """
+    if weights is None:
+        weights = np.ones_like(x)
+    total = weights.sum(axis=-1, keepdims=True)
+    x_mean = (weights * x).sum(axis=-1, keepdims=True) / total
+    y_mean = (weights * y).sum(axis=-1, keepdims=True) / total
+    dx = x - x_mean
+    slope = (weights * dx * (y - y_mean)).sum(axis=-1) / (weights * dx**2).sum(axis=-1)
+    intercept = y_mean[..., 0] - slope * x_mean[..., 0]
+    return slope, intercept
+
+
+def stack_charging_curves(charging_curves):
+    """Pad the charging curves of FreeEnergyDiagram.charging_curves into arrays
+
+    :param charging_curves: facet -> metal -> state -> curve
+    :type charging_curves: dict
+    :return: labels (facet, metal, state) and dict of (curve, point) and (curve,) arrays
+    :rtype: tuple
+    """
+    labels = [(facet, metal, state) for facet in charging_curves
+              for metal in charging_curves[facet] for state in charging_curves[facet][metal]]
+    curves = [charging_curves[facet][metal][state] for facet, metal, state in labels]
+    npoints = max(len(curve['charge']) for curve in curves)
+
+    stacked = {'charge': np.zeros((len(curves), npoints)), 'energy': np.zeros((len(curves), npoints)),
+               'weights': np.zeros((len(curves), npoints))}
+    for i, curve in enumerate(curves):
+        n = len(curve['charge'])
+        stacked['charge'][i, :n] = curve['charge']
+        stacked['energy'][i, :n] = curve['energy']
+        stacked['weights'][i, :n] = 1
+    for key in ['area', 'q_eff', 'pzc', 'C_gap', 'correction', 'thermal_correction', 'electrons']:
+        stacked[key] = np.array([curve[key] for curve in curves], dtype=float)
+    return labels, stacked
+
+
+def sample_free_energies(charging_curves, potential, nsamples=5000, sigmas=None, seed=None):
+    """Samples of the formation and free energies of all adsorbates
+
+    :param charging_curves: FreeEnergyDiagram.charging_curves after main()
+    :type charging_curves: dict
+    :param potential: SHE potential of the diagram
+    :type potential: float
+    :param nsamples: number of samples, defaults to 5000
+    :type nsamples: int, optional
+    :param sigmas: standard deviations that replace those in SIGMAS
+    :type sigmas: dict, optional
+    :param seed: seed of the random numbers
+    :type seed: int, optional
+    :return: 'labels' (facet, metal, state) and (sample, label) arrays of the
+        'formation_energy' (as in the CatMAP input) and the 'free_energy' (as in
+        FreeEnergyDiagram.diagram)
+    :rtype: dict
+    """
+    sigmas = {**SIGMAS, **(sigmas or {})}
+    rng = np.random.default_rng(seed)
+    labels, curves = stack_charging_curves(charging_curves)
+    ncurves = len(labels)
+
+    ## the pzc is shared by all adsorbates on a catalyst
+    catalysts = sorted(set(label[:2] for label in labels))
+    catalyst_index = np.array([catalysts.index(label[:2]) for label in labels])
+    is_CO2 = np.array([label[2] == 'CO2' for label in labels])
+
+    ## lognormal C_gap with the mean and standard deviation of the normal one
+    log_sigma = np.sqrt(np.log1p((sigmas['C_gap'] / curves['C_gap'])**2))
+    C_gap = curves['C_gap'] * np.exp(log_sigma * rng.standard_normal((nsamples, 1)) - log_sigma**2 / 2)
+    pzc = curves['pzc'] + sigmas['pzc'] * rng.standard_normal((nsamples, len(catalysts)))[:, catalyst_index]
+    q_eff = curves['q_eff'] + is_CO2 * sigmas['explicit_charge'] * rng.standard_normal((nsamples, ncurves))
+    energy = curves['energy'] \
+        + sigmas['energy'] * rng.standard_normal((nsamples, ncurves, 1)) \
+        + sigmas['energy_point'] * rng.standard_normal((nsamples,) + curves['energy'].shape)
+
+    ## surface charge of the points in mu C / cm-2, (sample, curve, point)
+    sigma = (curves['charge'] - q_eff[..., None] / 2) / curves['area'][:, None] * units._e * 1e6
+    slope, intercept = batched_linear_fit(sigma, energy, curves['weights'])
+
+    sigma_for_pot = C_gap * (potential - pzc)
+    formation_energy = intercept - slope * sigma_for_pot
+    return {
+        'labels': labels,
+        'formation_energy': formation_energy,
+        'free_energy': formation_energy + curves['correction'],
+    }
+
+
+def summarise(samples, key='free_energy', interval=0.95):
+    """Mean, standard deviation and interval of every label
+
+    :return: facet -> metal -> state -> dict of 'mean', 'std', 'low', 'high'
+    :rtype: dict
+    """
+    values = samples[key]
+    low, high = np.quantile(values, [(1 - interval) / 2, (1 + interval) / 2], axis=0)
+    mean = values.mean(axis=0)
+    std = values.std(axis=0)
+    summary = {}
+    for i, (facet, metal, state) in enumerate(samples['labels']):
+        summary.setdefault(facet, {}).setdefault(metal, {})[state] = {
+            'mean': mean[i], 'std': std[i], 'low': low[i], 'high': high[i]}
+    return summary
+
+
+def save_samples(filename, samples):
+    """Write the samples to an npz file (read with load_samples)."""
+    np.savez(filename, labels=np.array(samples['labels'], dtype=str),
+             formation_energy=samples['formation_energy'], free_energy=samples['free_energy'])
+
+
+def load_samples(filename):
+    """Read samples written by save_samples."""
+    with np.load(filename) as data:
+        return {'labels': [tuple(label) for label in data['labels']],
+                'formation_energy': data['formation_energy'], 'free_energy': data['free_energy']}
+
+
+def descriptor_samples(samples, descriptors, facet, doped_metals=('Fe', 'Ni')):
+    """Samples of the descriptors of every catalyst that has all of them
+
+    Catalysts are named as in get_electronic_energy_points of Figure 3:
+    the metal for the transition metals on the given facet and
+    metal_facet for the doped metals on every facet.
+
+    :param samples: output of sample_free_energies or load_samples
+    :type samples: dict
+    :param descriptors: descriptor names of the CatMAP run, e.g. ['COOH_s', 'CO2_s']
+    :type descriptors: list
+    :param facet: facet of the transition metals
+    :type facet: str
+    :return: names of the catalysts and (catalyst, sample, descriptor) array of formation energies
+    :rtype: tuple
+    """
+    columns = {}
+    for i, (site, metal, state) in enumerate(samples['labels']):
+        if metal in doped_metals:
+            name = metal + '_' + site
+        elif site == facet:
+            name = metal
+        else:
+            continue
+        columns.setdefault(name, {})[state + '_s'] = i
+    names = [name for name in columns if all(d in columns[name] for d in descriptors)]
+    index = np.array([[columns[name][d] for d in descriptors] for name in names], dtype=int).reshape(-1, len(descriptors))
+    ## (sample, catalyst, descriptor) -> (catalyst, sample, descriptor)
+    return names, samples['formation_energy'][:, index].transpose(1, 0, 2)
+
+
+def log_tof_samples(maps, points, min_val=1e-20):
+    """log10 of the TOF at many descriptor values from a CatMAP production rate map
+
+    :param maps: [[descriptors, production rates], ...] as passed to plot_map
+    :type maps: list
+    :param points: (..., 2) descriptor values, e.g. from descriptor_samples
+    :type points: np.ndarray
+    :param min_val: rates below are set to this value, defaults to 1e-20
+    :type min_val: float, optional
+    :return: log10 TOF, shape (...); outside of the map the nearest map point is used
+    :rtype: np.ndarray
+    """
+    from scipy.interpolate import LinearNDInterpolator, NearestNDInterpolator
+    grid = np.array([row[0] for row in maps], dtype=float)
+    rate = np.array([np.max(row[1]) for row in maps], dtype=float)
+    values = np.log10(np.clip(rate, min_val, None))
+
+    points = np.asarray(points, dtype=float)
+    flat = points.reshape(-1, points.shape[-1])
+    log_tof = LinearNDInterpolator(grid, values)(flat)
+    outside = np.isnan(log_tof)
+    if outside.any():
+        log_tof[outside] = NearestNDInterpolator(grid, values)(flat[outside])
+    return log_tof.reshape(points.shape[:-1])
@@ -6,9 +6,16 @@ def get_fit_from_points(x, y, order):
 
 
 def get_vasp_nelect0(atoms):
+    import os
     import pickle
     import numpy as np
-    with open('./utilities/nelect0.pickle', 'rb') as handle:
+    ## the pickle is kept in the utilities of Figure 2; it is found relative
+    ## to this file, so every copy of it reads the same pickle from any folder
+    kinetic_modelling = os.path.dirname(os.path.abspath(__file__))
+    while os.path.basename(kinetic_modelling) != 'kinetic_modelling' and os.path.dirname(kinetic_modelling) != kinetic_modelling:
+        kinetic_modelling = os.path.dirname(kinetic_modelling)
+    filename = os.path.join(kinetic_modelling, 'figure_2_free_energy_diagram', 'utilities', 'nelect0.pickle')
+    with open(filename, 'rb') as handle:
         nelect0 = pickle.load(handle)
     default_nelect = []
     for i in range(len(atoms)):
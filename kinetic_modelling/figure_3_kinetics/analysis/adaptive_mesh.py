@@ -0,0 +1,159 @@
+"""Adaptive quadtree meshes of the kinetic maps in descriptor space.
+
+Most of a rate map is flat (CO poisoned or adsorption limited) and the
+structure sits close to the ridges of the volcano. Instead of a uniform
+grid, the map starts from a coarse grid of square cells; a cell is split
+into four when log10(TOF) or a coverage at its centre or the middle of
+an edge differs by more than a tolerance from the bilinear
+interpolation of its corners. Where
+log10(TOF) changes linearly, as on the flanks of the volcano, cells are
+not split however steep the map is. All new points of a level are solved in one
+call of the model, and points shared by neighbouring cells are solved
+only once.
+
+The points lie on the lattice of the finest level, so the mesh is stored
+as integer lattice coordinates. The maps are written in the format of
+kinetic_model_data.json (plot_map interpolates scattered points, so it
+reads them directly) together with the leaf cells of the mesh::
+
+    python adaptive_mesh.py --energy_file ../energy_files/catmap_potential_-0.80.txt --compare
+"""
+
+import json
+import click
+import numpy as np
+from microkinetics import catmap_run_model, as_catmap_map, descriptor_grid
+
+
+def _log_rate(rate, min_val):
+    return np.log10(np.clip(rate, min_val, None))
+
+
+def adaptive_map(solve, ranges=((-2.5, 1.5), (-2.5, 1.5)), coarse=8, max_level=4,
+                 tol_log_tof=0.1, tol_coverage=0.02, min_val=1e-20):
+    """Rate and coverages on an adaptively refined mesh
+
+    :param solve: function of (point, 2) descriptor values returning a dict with
+        'rate' (point,) and 'coverage' (point, state), e.g. microkinetics.catmap_run_model
+    :type solve: callable
+    :param ranges: descriptor ranges, defaults to those of the CatMAP runs
+    :type ranges: tuple, optional
+    :param coarse: cells per axis of the starting grid, defaults to 8
+    :type coarse: int, optional
+    :param max_level: number of times a cell can be split, defaults to 4
+    :type max_level: int, optional
+    :param tol_log_tof: largest interpolation error of log10(TOF) in a cell, defaults to 0.1
+    :type tol_log_tof: float, optional
+    :param tol_coverage: largest interpolation error of a coverage in a cell, defaults to 0.02
+    :type tol_coverage: float, optional
+    :param min_val: rates below are treated as this value, defaults to 1e-20
+    :type min_val: float, optional
+    :return: 'points' (point, 2), 'rate', 'coverage', the leaf 'cells' (cell, 3) as lattice
+        coordinates and size, 'spacing' of the lattice and 'origin'
+    :rtype: dict
+    """
+    origin = np.array([ranges[0][0], ranges[1][0]], dtype=float)
+    nlattice = coarse * 2**max_level
+    spacing = np.array([ranges[0][1] - ranges[0][0], ranges[1][1] - ranges[1][0]], dtype=float) / nlattice
+
+    index = {}
+    points, rates, coverages = [], [], []
+
+    def evaluate(lattice):
+        """Solve the lattice points that are new and return the indices of all of them."""
+        new = [tuple(p) for p in np.unique(lattice, axis=0).tolist() if tuple(p) not in index]
+        if new:
+            results = solve(origin + np.array(new) * spacing)
+            for p in new:
+                index[p] = len(index)
+            points.extend(new)
+            rates.append(np.asarray(results['rate'], dtype=float))
+            coverages.append(np.atleast_2d(np.asarray(results['coverage'], dtype=float)))
+        return np.array([index[tuple(p)] for p in lattice.tolist()], dtype=int)
+
+    size = 2**max_level
+    i, j = np.meshgrid(np.arange(coarse) * size, np.arange(coarse) * size, indexing='ij')
+    cells = np.column_stack([i.ravel(), j.ravel(), np.full(i.size, size)])
+    leaves = []
+    while len(cells):
+        s = cells[:, 2:3]
+        ## four corners, the centre and the middle of the four edges of every cell
+        offsets = np.array([[0, 0], [1, 0], [0, 1], [1, 1], [0.5, 0.5], [0.5, 0], [0, 0.5], [1, 0.5], [0.5, 1]])
+        lattice = (cells[:, None, :2] + offsets[None] * s[:, None]).astype(int)
+        refinable = s[:, 0] > 1
+        ## cells of the finest level only need their corners
+        stencil = np.where(refinable[:, None], np.arange(9), [0, 1, 2, 3, 3, 3, 3, 3, 3])
+        lattice = np.take_along_axis(lattice, stencil[:, :, None], axis=1)
+        ids = evaluate(lattice.reshape(-1, 2)).reshape(-1, 9)
+
+        values = np.concatenate([_log_rate(np.concatenate(rates), min_val)[:, None] / tol_log_tof,
+                                 np.concatenate(coverages) / tol_coverage], axis=1)[ids]
+        ## errors of the bilinear interpolation of the corners, relative to the tolerances
+        interpolated = np.stack([values[:, :4].mean(axis=1),
+                                 (values[:, 0] + values[:, 1]) / 2, (values[:, 0] + values[:, 2]) / 2,
+                                 (values[:, 1] + values[:, 3]) / 2, (values[:, 2] + values[:, 3]) / 2], axis=1)
+        error = np.abs(values[:, 4:] - interpolated).max(axis=(1, 2))
+        refine = refinable & (error > 1)
+        leaves.append(cells[~refine])
+        half = cells[refine, 2:3] // 2
+        corners = cells[refine, :2]
+        cells = np.concatenate([np.column_stack([corners + offset * half, half])
+                                for offset in np.array([[0, 0], [1, 0], [0, 1], [1, 1]])]) if refine.any() \
+            else np.empty((0, 3), dtype=int)
+
+    return {
+        'points': origin + np.array(points) * spacing,
+        'rate': np.concatenate(rates),
+        'coverage': np.concatenate(coverages),
+        'cells': np.concatenate(leaves),
+        'spacing': spacing,
+        'origin': origin,
+    }
+
+
+def mesh_error(mesh, solve, resolution, min_val=1e-20):
+    """Largest error of log10(TOF) of the linearly interpolated mesh on a uniform grid."""
+    from scipy.interpolate import LinearNDInterpolator
+    grid = descriptor_grid(((mesh['origin'][0], mesh['origin'][0] + mesh['spacing'][0] * (resolution - 1)),
+                            (mesh['origin'][1], mesh['origin'][1] + mesh['spacing'][1] * (resolution - 1))),
+                           resolution)
+    exact = _log_rate(solve(grid)['rate'], min_val)
+    interpolated = LinearNDInterpolator(mesh['points'], _log_rate(mesh['rate'], min_val))(grid)
+    return np.nanmax(np.abs(interpolated - exact))
+
+
+@click.command()
+@click.option('--energy_file', default='../energy_files/catmap_potential_-0.80.txt')
+@click.option('--potential', default=-0.8, type=float)
+@click.option('--ph', default=2., type=float)
+@click.option('--facet', default='211')
+@click.option('--coarse', default=8, help='cells per axis of the starting grid')
+@click.option('--max_level', default=4, help='number of refinements')
+@click.option('--tol', default=0.1, help='largest interpolation error of log10(TOF) in a cell')
+@click.option('--tol_coverage', default=0.02, help='largest interpolation error of a coverage in a cell')
+@click.option('--output', default='output/adaptive_potential_-0.80.json')
+@click.option('--compare', is_flag=True, help='compare with the uniform grid of the finest level')
+def main(energy_file, potential, ph, facet, coarse, max_level, tol, tol_coverage, output, compare):
+    """Rate and coverage maps for the descriptors COOH_s and CO2_s on an adaptive mesh."""
+    with open(energy_file, 'r') as handle:
+        energies = handle.read()
+    solve = catmap_run_model(energies, potential, ph, facet)
+    mesh = adaptive_map(solve, coarse=coarse, max_level=max_level, tol_log_tof=tol, tol_coverage=tol_coverage)
+
+    resolution = coarse * 2**max_level + 1
+    print('%d solves instead of %d for the uniform %dx%d grid'%(len(mesh['points']), resolution**2, resolution, resolution))
+    if compare:
+        print('largest error of log10(TOF): %1.3f'%mesh_error(mesh, solve, resolution))
+
+    data = {'descriptors': ['COOH_s', 'CO2_s'], 'potential': potential, 'pH': ph,
+            'facet': [facet], 'energy_file': energies, 'surfaces': ['Pt', 'Pd', 'Cu', 'Ag', 'Au'],
+            'production_rate': as_catmap_map(mesh['points'], mesh['rate']),
+            'coverage_map': as_catmap_map(mesh['points'], mesh['coverage'][:, 1:]),
+            'mesh': {'origin': mesh['origin'].tolist(), 'spacing': mesh['spacing'].tolist(),
+                     'cells': mesh['cells'].tolist()}}
+    with open(output, 'w') as handle:
+        json.dump(data, handle)
+
+
+if __name__ == '__main__':
+    main()
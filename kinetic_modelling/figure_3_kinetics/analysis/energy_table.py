@@ -0,0 +1,171 @@
+"""Formation energies of CatMAP energy files as an indexed table.
+
+An energy file (catmap_potential_*.txt or the energy_file string stored
+with every kinetic model) is parsed once into typed columns; parsing is
+cached on the content of the file. The frequencies are arrays and rows
+are indexed by (surface, site, species, potential), so single energies
+are dictionary lookups and the energies of many species at many
+potentials are one fancy-indexing call::
+
+    table = EnergyTable.from_files(glob('../energy_files/catmap_potential_*.txt'))
+    table.get('Au', '211', 'COOH', -0.8)
+    table.energies([('Au', '211', 'COOH'), ('Au', '211', 'CO2')], table.potentials)
+"""
+
+import re
+import functools
+import numpy as np
+
+COLUMNS = ('surface', 'site', 'species', 'energy', 'frequencies', 'reference', 'potential')
+DOPED_METALS = ('Fe', 'Ni')
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_frequencies(text):
+    frequencies = np.fromstring(text.strip().strip('[]'), sep=',')
+    frequencies.setflags(write=False)
+    return frequencies
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_energy_file(energy_file, potential):
+    rows = [line.split('\t') for line in energy_file.splitlines()[1:] if line.strip()]
+    return EnergyTable(
+        surface=[row[0] for row in rows],
+        site=[row[1] for row in rows],
+        species=[row[2] for row in rows],
+        energy=[float(row[3]) for row in rows],
+        frequencies=[_parse_frequencies(row[4]) for row in rows],
+        reference=[row[5].strip() if len(row) > 5 else '' for row in rows],
+        potential=np.full(len(rows), potential),
+    )
+
+
+class EnergyTable:
+    """Rows of one or more CatMAP energy files
+
+    The columns are numpy arrays: 'surface', 'site', 'species', 'reference'
+    (str), 'energy', 'potential' (float, nan if unknown) and 'frequencies'
+    (object array of float arrays). Tables are not modified after creation.
+    """
+
+    def __init__(self, surface, site, species, energy, frequencies, reference, potential):
+        self.surface = np.asarray(surface, dtype=str)
+        self.site = np.asarray(site, dtype=str)
+        self.species = np.asarray(species, dtype=str)
+        self.energy = np.asarray(energy, dtype=float)
+        self.frequencies = np.empty(len(self.energy), dtype=object)
+        self.frequencies[:] = list(frequencies)
+        self.reference = np.asarray(reference, dtype=str)
+        self.potential = np.asarray(potential, dtype=float)
+        self._index = {key: i for i, key in enumerate(zip(
+            self.surface.tolist(), self.site.tolist(), self.species.tolist(), self._potential_keys()))}
+
+    def __len__(self):
+        return len(self.energy)
+
+    def _potential_keys(self):
+        ## nan is not equal to itself, so unknown potentials are indexed as None
+        return [None if np.isnan(p) else round(p, 6) for p in self.potential.tolist()]
+
+    @staticmethod
+    def _key(potential):
+        return None if potential is None or np.isnan(potential) else round(float(potential), 6)
+
+    @classmethod
+    def from_string(cls, energy_file, potential=None):
+        """Table of the content of an energy file
+
+        :param energy_file: content of the energy file
+        :type energy_file: str
+        :param potential: SHE potential of the file, defaults to unknown
+        :type potential: float, optional
+        :return: table, shared between calls with the same arguments
+        :rtype: EnergyTable
+        """
+        return _parse_energy_file(energy_file, np.nan if potential is None else float(potential))
+
+    @classmethod
+    def from_files(cls, filenames):
+        """Table of several catmap_potential_*.txt files, the potential is read from the name."""
+        tables = []
+        for filename in filenames:
+            match = re.search(r'potential_(-?\d+\.?\d*)\.txt$', filename)
+            with open(filename, 'r') as handle:
+                tables.append(cls.from_string(handle.read(), float(match.group(1)) if match else None))
+        return cls.concatenate(tables)
+
+    @classmethod
+    def from_npz(cls, filename):
+        """Table of the energies of all potentials written by Figure 2 (output/catmap_energies.npz)."""
+        with np.load(filename) as data:
+            columns = {column: data[column] for column in COLUMNS}
+        columns['frequencies'] = [f[~np.isnan(f)] for f in columns['frequencies']]
+        return cls(**columns)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """One table with the rows of all tables."""
+        return cls(**{column: np.concatenate([getattr(table, column) for table in tables])
+                      for column in COLUMNS})
+
+    @property
+    def potentials(self):
+        """Sorted known potentials of the table."""
+        return np.unique(self.potential[~np.isnan(self.potential)])
+
+    def get(self, surface, site, species, potential=None):
+        """Formation energy of one row, KeyError if it is not in the table."""
+        return self.energy[self._index[surface, site, species, self._key(potential)]]
+
+    def row(self, surface, site, species, potential=None):
+        """All columns of one row as a dict."""
+        i = self._index[surface, site, species, self._key(potential)]
+        return {column: getattr(self, column)[i] for column in COLUMNS}
+
+    def select(self, **conditions):
+        """Rows where every column has the given value or one of the given values
+
+        :return: table of the selected rows
+        :rtype: EnergyTable
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, value in conditions.items():
+            values = np.atleast_1d(value)
+            if column == 'potential':
+                mask &= np.isclose(self.potential[:, None], values.astype(float)[None, :]).any(axis=1)
+            else:
+                mask &= np.isin(getattr(self, column), values.astype(str))
+        return EnergyTable(**{column: getattr(self, column)[mask] for column in COLUMNS})
+
+    def energies(self, keys, potentials=(None,)):
+        """(potential, key) array of formation energies, nan where a row is missing
+
+        :param keys: (surface, site, species) of the columns
+        :type keys: list
+        :param potentials: potentials of the rows, defaults to the unknown potential
+        :type potentials: list, optional
+        :rtype: np.ndarray
+        """
+        rows = np.array([[self._index.get((surface, site, species, self._key(potential)), -1)
+                          for surface, site, species in keys] for potential in potentials], dtype=int)
+        return np.where(rows >= 0, self.energy[rows], np.nan)
+
+    def electronic_energy_points(self, surfaces, facet, potential=None):
+        """Formation energies of the catalysts of the figures
+
+        The transition metals in surfaces are taken on the facet and
+        named by the metal; the Fe and Ni sites are named metal_site.
+        Pass the potential if the table holds more than one.
+
+        :return: catalyst -> species_s -> energy
+        :rtype: dict
+        """
+        selected = self if potential is None else self.select(potential=potential)
+        metal = np.isin(selected.surface, list(surfaces)) & (selected.site == facet)
+        doped = np.isin(selected.surface, DOPED_METALS)
+        results = {}
+        for i in np.flatnonzero(metal | doped):
+            name = selected.surface[i] if metal[i] else selected.surface[i] + '_' + selected.site[i]
+            results.setdefault(str(name), {})[selected.species[i] + '_s'] = float(selected.energy[i])
+        return results
@@ -0,0 +1,274 @@
+"""Mean-field microkinetic model of CO2 reduction to CO and its degree of rate control.
+
+The mechanism is the one of the CatMAP runs in ../run::
+
+    CO2_g + *_s <-> ^0.01eV_s <-> CO2_s
+    CO2_s + H_g + ele_g <-> COOH_s
+    COOH_s + H_g + ele_g <-> CO_s + H2O_g
+    CO_s <-> CO_g + *_s
+
+It is a single catalytic cycle, so the steady state follows in closed
+form from the spanning trees of the cycle (King-Altman). Everything is
+done with logarithms of the rate constants, so no precision is lost for
+rates far below 1/s, and every function broadcasts over leading axes.
+
+Campbell's degree of rate control X_i = d ln(TOF) / d ln(k_i) (at
+constant equilibrium constants) is obtained by multiplying the forward
+and reverse rate constant of every step by (1 + delta) and solving all
+perturbed models together with the unperturbed one in one call.
+"""
+
+import json
+import click
+import numpy as np
+from scipy.special import logsumexp
+
+KB = 8.617333262e-5 # eV/K
+PLANCK = 4.135667696e-15 # eV s
+
+STEPS = ['CO2_g -> CO2_s', 'CO2_s -> COOH_s', 'COOH_s -> CO_s', 'CO_s -> CO_g']
+STEP_LABELS = [
+    r'$ \mathregular{CO_2}_{(\mathregular{g})} \to \mathregular{CO_2}^*$',
+    r'$\mathregular{CO_2}^* \to \mathregular{COOH}^* $',
+    r'$\mathregular{COOH}^* \to \mathregular{CO}^* $',
+    r'$\mathregular{CO}^* \to \mathregular{CO}_{(\mathregular{g})}$',
+]
+STATES = ['*', 'CO2_s', 'COOH_s', 'CO_s']
+## transition state energies above the initial state, as in the rxn_expressions
+BARRIERS = np.array([0.01, 0.0, 0.0, 0.0])
+PRESSURES = {'CO2_g': 0.2, 'CO_g': 0.1, 'H2O_g': 0.1}
+
+
+def reaction_free_energies(G_CO2, G_COOH, G_CO, G_final, temperature=300, pressures=PRESSURES):
+    """Free energies of the four steps from the free energies of the intermediates
+
+    All free energies are relative to * + CO2(g) + 2(H+ + e-) at the
+    potential, i.e. the coordinates of plot_map; G_final is that of
+    * + CO(g) + H2O(g). The gas pressures are included here.
+
+    :return: (..., step) array
+    :rtype: np.ndarray
+    """
+    kT = KB * temperature
+    G_CO2, G_COOH, G_CO, G_final = np.broadcast_arrays(G_CO2, G_COOH, G_CO, G_final)
+    return np.stack([
+        G_CO2 - kT * np.log(pressures['CO2_g']),
+        G_COOH - G_CO2,
+        G_CO - G_COOH + kT * np.log(pressures['H2O_g']),
+        G_final - G_CO + kT * np.log(pressures['CO_g']),
+    ], axis=-1)
+
+
+def log_rate_constants(reaction_energies, barriers=BARRIERS, temperature=300):
+    """ln of the forward and reverse rate constants from transition state theory
+
+    The activation energy of every step is max(barrier, dG, 0).
+
+    :param reaction_energies: (..., step) free energies of the steps
+    :type reaction_energies: np.ndarray
+    :return: ln k_forward and ln k_reverse, (..., step)
+    :rtype: tuple
+    """
+    kT = KB * temperature
+    activation = np.maximum(np.maximum(barriers, reaction_energies), 0)
+    log_kf = np.log(kT / PLANCK) - activation / kT
+    log_kr = log_kf + reaction_energies / kT
+    return log_kf, log_kr
+
+
+def steady_state(log_kf, log_kr):
+    """Coverages and TOF of the catalytic cycle at steady state
+
+    Step i takes state i to state i+1 (state 0 is the free site and the
+    last step goes back to it). The weight of state j is the sum over
+    the spanning trees of the cycle rooted at j: removing step m, the
+    states from m+1 up to j move forward and those after j up to m
+    move back.
+
+    :param log_kf: (..., step) ln of the forward rate constants
+    :type log_kf: np.ndarray
+    :param log_kr: (..., step) ln of the reverse rate constants
+    :type log_kr: np.ndarray
+    :return: coverages (..., state), ln |TOF| and the sign of the TOF
+    :rtype: tuple
+    """
+    n = log_kf.shape[-1]
+    log_weights = []
+    for j in range(n):
+        trees = []
+        for m in range(n):
+            ## states m+1, ..., j-1 (forward) and j+1, ..., m (backward), cyclic
+            forward = [(m + 1 + p) % n for p in range((j - m - 1) % n)]
+            backward = [(j + 1 + p) % n for p in range((m - j) % n)]
+            tree = sum((log_kf[..., x] for x in forward), np.zeros(log_kf.shape[:-1]))
+            tree = tree + sum((log_kr[..., (x - 1) % n] for x in backward), np.zeros(log_kf.shape[:-1]))
+            trees.append(tree)
+        log_weights.append(logsumexp(np.stack(trees, axis=-1), axis=-1))
+    log_weights = np.stack(log_weights, axis=-1)
+    log_total = logsumexp(log_weights, axis=-1)
+    coverages = np.exp(log_weights - log_total[..., None])
+
+    ## TOF = (prod kf - prod kr) / sum of the weights
+    log_forward = log_kf.sum(axis=-1)
+    log_reverse = log_kr.sum(axis=-1)
+    sign = np.where(log_forward >= log_reverse, 1.0, -1.0)
+    log_big = np.maximum(log_forward, log_reverse)
+    log_small = np.minimum(log_forward, log_reverse)
+    with np.errstate(divide='ignore'):
+        log_tof = log_big + np.log1p(-np.exp(log_small - log_big)) - log_total
+    return coverages, log_tof, sign
+
+
+def degree_of_rate_control(log_kf, log_kr, delta=1e-6):
+    """Campbell's degree of rate control of every step
+
+    :param log_kf: (..., step) ln of the forward rate constants
+    :type log_kf: np.ndarray
+    :param log_kr: (..., step) ln of the reverse rate constants
+    :type log_kr: np.ndarray
+    :param delta: relative perturbation of the rate constants, defaults to 1e-6
+    :type delta: float, optional
+    :return: (..., step) degree of rate control, the coverages, ln |TOF| and the sign of the TOF of the model
+    :rtype: tuple
+    """
+    nsteps = log_kf.shape[-1]
+    ## row 0 is the unperturbed model, row i+1 has step i scaled by (1 + delta)
+    shift = np.log1p(delta) * np.vstack([np.zeros(nsteps), np.eye(nsteps)])
+    shift = shift.reshape((nsteps + 1,) + (1,) * (log_kf.ndim - 1) + (nsteps,))
+    coverages, log_tof, sign = steady_state(log_kf[None] + shift, log_kr[None] + shift)
+    drc = (log_tof[1:] - log_tof[0]) / np.log1p(delta)
+    return np.moveaxis(drc, 0, -1), coverages[0], log_tof[0], sign[0]
+
+
+def rate_limiting_step(drc):
+    """Index of the step with the largest degree of rate control."""
+    return np.argmax(drc, axis=-1)
+
+
+def descriptor_map(descriptor_values, potential, pH, corrections, co_scaling, G_final,
+                   temperature=300, delta=1e-6):
+    """Rate, coverages and degree of rate control on a (COOH_s, CO2_s) descriptor grid
+
+    :param descriptor_values: (point, 2) formation energies of COOH_s and CO2_s as in the CatMAP maps
+    :type descriptor_values: np.ndarray
+    :param potential: SHE potential
+    :type potential: float
+    :param pH: pH
+    :type pH: float
+    :param corrections: free energy corrections of 'CO2', 'COOH' and 'CO' (see FreeEnergiesForFigure4)
+    :type corrections: dict
+    :param co_scaling: (slope, intercept) of the CO_s formation energy against that of COOH_s
+    :type co_scaling: tuple
+    :param G_final: free energy of CO(g) + H2O(g) at 0 V_RHE
+    :type G_final: float
+    :return: dict of 'rate' (point,), 'coverage' (point, state), 'drc' (point, step)
+        and 'rate_limiting' (point,)
+    :rtype: dict
+    """
+    descriptor_values = np.asarray(descriptor_values, dtype=float)
+    U_RHE = potential + 0.059 * pH
+    E_COOH = descriptor_values[:, 0]
+    E_CO2 = descriptor_values[:, 1]
+    E_CO = co_scaling[0] * E_COOH + co_scaling[1]
+
+    G_CO2 = E_CO2 + corrections['CO2']
+    G_COOH = E_COOH + corrections['COOH'] + U_RHE
+    G_CO = E_CO + corrections['CO'] + 2 * U_RHE
+    dG = reaction_free_energies(G_CO2, G_COOH, G_CO, G_final + 2 * U_RHE, temperature=temperature)
+    log_kf, log_kr = log_rate_constants(dG, temperature=temperature)
+    drc, coverages, log_tof, sign = degree_of_rate_control(log_kf, log_kr, delta=delta)
+    return {
+        ## negative where the cycle runs backwards (CO oxidation)
+        'rate': sign * np.exp(log_tof),
+        'coverage': coverages,
+        'drc': drc,
+        'rate_limiting': rate_limiting_step(drc),
+    }
+
+
+def as_catmap_map(descriptor_values, values):
+    """[[descriptors, values], ...], the format of the CatMAP maps in kinetic_model_data.json"""
+    values = np.asarray(values)
+    return [[list(map(float, d)), np.atleast_1d(v).tolist()] for d, v in zip(descriptor_values, values)]
+
+
+def descriptor_grid(ranges=((-2.5, 1.5), (-2.5, 1.5)), resolution=50):
+    """(point, 2) grid of descriptor values like the CatMAP descriptor_ranges and resolution."""
+    x = np.linspace(*ranges[0], resolution)
+    y = np.linspace(*ranges[1], resolution)
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    return np.column_stack([X.ravel(), Y.ravel()])
+
+
+def catmap_run_model(energy_file, potential, pH, facet, surfaces=('Pt', 'Pd', 'Cu', 'Ag', 'Au')):
+    """descriptor_map with the conditions and scaling of a CatMAP run
+
+    The CO_s energy follows from its scaling with COOH_s over the
+    transition metals of the energy file.
+
+    :param energy_file: content of the CatMAP energy file
+    :type energy_file: str
+    :return: function of the (point, 2) COOH_s and CO2_s energies returning the output of descriptor_map
+    :rtype: callable
+    """
+    from plot_kinetics_figure import FreeEnergiesForFigure4
+    from scaling import scaling_relations, scaling_group
+    from energy_table import EnergyTable
+
+    relation = scaling_relations(energy_file, tuple(surfaces))[scaling_group(energy_file, facet)]['COOH_s', 'CO_s']
+    co_fit = (relation['slope'], relation['intercept'])
+    E_COg = EnergyTable.from_string(energy_file).get('None', 'gas', 'CO')
+    corrections = FreeEnergiesForFigure4().get_cycle_corrections()
+
+    def solve(descriptor_values):
+        return descriptor_map(descriptor_values, potential, pH, corrections, co_fit,
+                              G_final=E_COg + corrections['CO_g'])
+    return solve
+
+
+def catmap_run_maps(energy_file, potential, pH, facet, descriptor_values=None,
+                    surfaces=('Pt', 'Pd', 'Cu', 'Ag', 'Au')):
+    """Rate, coverage, degree of rate control and rate limiting step maps of a CatMAP run
+
+    :param energy_file: content of the CatMAP energy file
+    :type energy_file: str
+    :param descriptor_values: (point, 2) COOH_s and CO2_s energies, defaults to the grid of the runs
+    :type descriptor_values: np.ndarray, optional
+    :return: maps in the format of kinetic_model_data.json
+    :rtype: dict
+    """
+    if descriptor_values is None:
+        descriptor_values = descriptor_grid()
+    results = catmap_run_model(energy_file, potential, pH, facet, surfaces)(descriptor_values)
+    return {
+        'steps': STEPS,
+        'production_rate': as_catmap_map(descriptor_values, results['rate']),
+        'coverage_map': as_catmap_map(descriptor_values, results['coverage'][:, 1:]),
+        'drc_map': as_catmap_map(descriptor_values, results['drc']),
+        'rate_limiting_map': as_catmap_map(descriptor_values, results['rate_limiting']),
+    }
+
+
+@click.command()
+@click.option('--energy_file', default='../energy_files/catmap_potential_-0.80.txt')
+@click.option('--potential', default=-0.8, type=float)
+@click.option('--ph', default=2., type=float)
+@click.option('--facet', default='211')
+@click.option('--output', default='output/drc_potential_-0.80.json')
+def main(energy_file, potential, ph, facet, output):
+    """Degree of rate control maps for the descriptors COOH_s and CO2_s."""
+    with open(energy_file, 'r') as handle:
+        energies = handle.read()
+    data = {'descriptors': ['COOH_s', 'CO2_s'], 'potential': potential, 'pH': ph,
+            'facet': [facet], 'energy_file': energies, 'surfaces': ['Pt', 'Pd', 'Cu', 'Ag', 'Au']}
+    data.update(catmap_run_maps(energies, potential, ph, facet))
+    with open(output, 'w') as handle:
+        json.dump(data, handle)
+
+    rate_limiting = np.array([row[1][0] for row in data['rate_limiting_map']])
+    for i, step in enumerate(STEPS):
+        print('%16s limits %4.1f%% of the map'%(step, 100 * np.mean(rate_limiting == i)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,31 @@
 
 """Create Figure 4 of the manuscript."""
 
+import sys
 import click
 import json
 import string
 from pathlib import Path
-import xlrd
 import numpy as np
-from scipy.interpolate import Rbf
-from matplotlib import ticker
-import matplotlib.pyplot as plt
 from ase.data.colors import jmol_colors
 from ase.data import atomic_numbers
 from ase import build
 from ase.thermochemistry import IdealGasThermo, HarmonicThermo
 from useful_functions import get_fit_from_points
 from plot_params import get_plot_params
+## uncertainty.py is shared with Figure 2 and kept in its folder
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'figure_2_free_energy_diagram'))
+from uncertainty import load_samples, descriptor_samples, log_tof_samples
+from microkinetics import STEP_LABELS, catmap_run_maps
+from scaling import scaling_relations, scaling_group
+from energy_table import EnergyTable
 
 def get_electronic_energy_points(energy_file, surfaces, facet):
-    data = [a.split('\t') for a in energy_file.split('\n') ]
-    results = {}
-    for i, dat in enumerate(data):
-        if i == 0:
-            continue
-        if dat[0] in surfaces and dat[1] == facet:
-            dE = float(dat[3])
-            results.setdefault(dat[0],{})[dat[2]+'_s'] = dE
-        if dat[0] in ['Ni', 'Fe']:
-            dE = float(dat[3])
-            results.setdefault(dat[0]+'_'+dat[1],{})[dat[2]+'_s'] = dE
+    """Formation energies of the metals on the facet and of the Fe and Ni sites (see EnergyTable)."""
+    return EnergyTable.from_string(energy_file).electronic_energy_points(surfaces, facet)
 
-    return results
+## gas phase free energies per set of frequencies, computed once per process
+_gas_free_energies = {}
 
 class FreeEnergiesForFigure4:
     def __init__(self):
@@ -44,9 +39,12 @@ class FreeEnergiesForFigure4:
         self.frequencies['H2g'] = [4357.74, 101.87, 101.851]
         self.frequencies['H2Og'] = [3823.99, 3715.40, 1599.34, 84.90, 76.593, 10 ]
     
-    def get_free_energies(self):
-        """Get the free energies for the different species at standard conditions."""
+    def _gas_free_energies(self):
+        """Free energies of the gas phase molecules at standard conditions."""
         frequencies = self.frequencies
+        key = tuple(tuple(frequencies[gas]) for gas in ['COg', 'CO2g', 'H2g', 'H2Og'])
+        if key in _gas_free_energies:
+            return _gas_free_energies[key]
 
         cmtoeV = 0.00012 
         COg_G = IdealGasThermo(
@@ -81,6 +79,14 @@ class FreeEnergiesForFigure4:
             spin=0,
         ).get_gibbs_energy(298.15, 101325, verbose=False)
 
+        _gas_free_energies[key] = COg_G, CO2g_G, H2g_G, H2Og_G
+        return COg_G, CO2g_G, H2g_G, H2Og_G
+
+    def get_free_energies(self):
+        """Get the free energies for the different species at standard conditions."""
+        COg_G, CO2g_G, H2g_G, H2Og_G = self._gas_free_energies()
+
+        cmtoeV = 0.00012 
         COOH_ads_G = HarmonicThermo(cmtoeV * np.array(self.frequencies['COOH'])).get_helmholtz_energy(298.15, verbose=False)
         CO2_ads_G = HarmonicThermo(cmtoeV * np.array(self.frequencies['CO2'])).get_helmholtz_energy(298.15, verbose=False)
 
@@ -93,11 +99,30 @@ class FreeEnergiesForFigure4:
         print('\n')
         return dG_CO2, dG_COOH
 
+    def get_cycle_corrections(self):
+        """Free energy corrections of all intermediates of the CO2 to CO cycle
+
+        Relative to the CatMAP references (CO2, H2 and H2O), 'CO_g' is the
+        correction of CO(g) + H2O(g).
+        """
+        COg_G, CO2g_G, H2g_G, H2Og_G = self._gas_free_energies()
+        cmtoeV = 0.00012 
+        CO_ads_G = HarmonicThermo(cmtoeV * np.array(self.frequencies['CO'])).get_helmholtz_energy(298.15, verbose=False)
+        COOH_ads_G = HarmonicThermo(cmtoeV * np.array(self.frequencies['COOH'])).get_helmholtz_energy(298.15, verbose=False)
+        CO2_ads_G = HarmonicThermo(cmtoeV * np.array(self.frequencies['CO2'])).get_helmholtz_energy(298.15, verbose=False)
+        return {
+            'CO2': CO2_ads_G - CO2g_G,
+            'COOH': COOH_ads_G - (CO2g_G + 0.5 * H2g_G),
+            'CO': CO_ads_G - (CO2g_G + H2g_G - H2Og_G),
+            'CO_g': COg_G + H2Og_G - (CO2g_G + H2g_G),
+        }
+
 
 def plot_map(fig, ax, maps, descriptors, points, potential, pH, \
             plot_single_atom, plot_metal, coverage_index=-1, min_val=1e-20, log_scale=True,\
                 cmapname='Blues_r', annotate_rate_limiting=False,\
-                    coverage_plot=False, plot_cmap=True, inten=1, plot_legend=False):
+                    coverage_plot=False, plot_cmap=True, inten=1, plot_legend=False,\
+                        point_samples=None, rate_limiting_map=None, scaling=None):
                     
     """Generate the main kinetic plot; this function keeps getting called for each axis
 
@@ -129,8 +154,19 @@ def plot_map(fig, ax, maps, descriptors, points, potential, pH, \
     :type plot_cmap: bool, optional
     :param inten: Intensity of plot - alpha setting in matplotlib, defaults to 1
     :type inten: int, optional
+    :param point_samples: Monte-Carlo samples (sample, descriptor) of the points, drawn as error bars, defaults to None
+    :type point_samples: dict, optional
+    :param rate_limiting_map: rate limiting step on the descriptor grid (microkinetics.py); with
+        annotate_rate_limiting the regions are drawn and labelled from it, defaults to None
+    :type rate_limiting_map: list, optional
+    :param scaling: relation of descriptors[1] to descriptors[0] of the metals from scaling.py,
+        defaults to a fit of the points
+    :type scaling: dict, optional
     """
 
+    from scipy.interpolate import Rbf, griddata
+    from matplotlib import ticker
+
     ## CHE correction for COOH*
     species = [r'CO_{2}', 'COOH', 'CO']
     CHE_COOH = potential + 0.059 * pH
@@ -223,8 +259,14 @@ def plot_map(fig, ax, maps, descriptors, points, potential, pH, \
                 elif int(label_info[1])==2 and 'Ni' in metal: color_vac='tab:brown'
                 elif int(label_info[1])==1 and 'Fe' in metal: color_vac='r'
                 elif int(label_info[1])==2 and 'Fe' in metal: color_vac='g'
+                if point_samples is not None and metal in point_samples:
+                    xerr, yerr = np.std(point_samples[metal], axis=0)
+                    ax.errorbar(x, y, xerr=xerr, yerr=yerr, color=color_vac, ls='none', capsize=4)
                 ax.plot(x , y, marker='o', markersize=12, color=color_vac,)
             elif plot_metal:
+                if point_samples is not None and metal in point_samples:
+                    xerr, yerr = np.std(point_samples[metal], axis=0)
+                    ax.errorbar(x, y, xerr=xerr, yerr=yerr, color=color, ls='none', capsize=4)
                 ax.plot(x , y, 'o', markersize=12, color=color)
 
         except KeyError:
@@ -244,7 +286,12 @@ def plot_map(fig, ax, maps, descriptors, points, potential, pH, \
             all_Ga.append(x)
             all_Gb.append(y)
     
-    fit = get_fit_from_points(all_Ga, all_Gb, 1)
+    if scaling is None:
+        fit = get_fit_from_points(all_Ga, all_Gb, 1)
+    else:
+        ## shift the relation of the formation energies to the free energies plotted
+        x_shift = CHE_COOH + dG_COOH
+        fit = {'p': np.poly1d([scaling['slope'], scaling['intercept'] + dG_CO2 - scaling['slope'] * x_shift])}
     bounds = ax.get_xbound()
 
     if plot_metal:
@@ -255,7 +302,21 @@ def plot_map(fig, ax, maps, descriptors, points, potential, pH, \
     ax.fill_between(bounds, np.array(bounds)+0.1, np.array(bounds)-0.1, color='k', alpha=0.1)
 
     
-    if annotate_rate_limiting:
+    if annotate_rate_limiting and rate_limiting_map is not None:
+        ## regions of the rate limiting step from the degree of rate control
+        rl_x = np.array([row[0][0] for row in rate_limiting_map]) + CHE_COOH + dG_COOH
+        rl_y = np.array([row[0][1] for row in rate_limiting_map]) + dG_CO2
+        step = np.array([row[1][0] for row in rate_limiting_map], dtype=int)
+        x_dense, y_dense = np.meshgrid(np.linspace(*xbounds, 200), np.linspace(*ybounds, 200))
+        regions = griddata((rl_x, rl_y), step, (x_dense, y_dense), method='nearest')
+        ax.contour(x_dense, y_dense, regions, levels=np.arange(len(STEP_LABELS) - 1) + 0.5, colors='white', linewidths=2)
+        for i in np.unique(regions).astype(int):
+            inside = regions == i
+            ax.annotate(STEP_LABELS[i] + ' limited', xy=(np.median(x_dense[inside]), np.median(y_dense[inside])),
+                        color='white', ha='center')
+        ax.annotate('Parity Line', xy=(0.4, 0.2), xycoords='axes fraction', rotation=37, color='k')
+        ax.annotate('(211) Scaling', xy=(0.1, 0.4), xycoords='axes fraction', rotation=37, color='k')
+    elif annotate_rate_limiting:
         ax.arrow(-1.2, 0.5, 0, 1, width=0.05,color='white'  )
         ax.arrow(0, -1., 1, 0, width=0.05,color='white'  )
         ax.annotate(r'$\mathregular{CO_2}^* \to \mathregular{COOH}^* $ limited', xy=(0.4, 0.05), xycoords='axes fraction', color='white')
@@ -268,7 +329,10 @@ def plot_map(fig, ax, maps, descriptors, points, potential, pH, \
 @click.command()
 @click.option('--kfiles', type=str, default='aiida_output/kinetic_model_data.json')
 @click.option('--kineticspk', type=str, default='277')
-def main(kfiles, kineticspk):
+@click.option('--samples', type=str, default=None, help='uncertainty_potential_*.npz from Figure 2')
+def main(kfiles, kineticspk, samples):
+    import xlrd
+    import matplotlib.pyplot as plt
 
     with open(kfiles, 'r') as handle:
         data_tot = json.load(handle)
@@ -312,6 +376,27 @@ def main(kfiles, kineticspk):
 
     ## computational plot
     data_points = get_electronic_energy_points(data['energy_file'], data['surfaces'], data['facet'][0])
+    group = scaling_group(data['energy_file'], data['facet'][0])
+    scaling = scaling_relations(data['energy_file'], tuple(data['surfaces']))[group][tuple(data['descriptors'])]
+
+    ## the CatMAP runs do not store the degree of rate control; solve the
+    ## same model on the descriptor points of the production rate map
+    rate_limiting_map = data.get('rate_limiting_map')
+    if rate_limiting_map is None:
+        descriptor_values = np.array([row[0] for row in data['production_rate']])
+        rate_limiting_map = catmap_run_maps(data['energy_file'], data['potential'], data['pH'], data['facet'][0],
+                                            descriptor_values, tuple(data['surfaces']))['rate_limiting_map']
+
+    ## distribution of the TOF of every catalyst from the free energy samples
+    point_samples = None
+    if samples is not None:
+        names, descriptor_values = descriptor_samples(load_samples(samples), data['descriptors'], data['facet'][0])
+        point_samples = dict(zip(names, descriptor_values))
+        log_tof = log_tof_samples(data['production_rate'], descriptor_values)
+        low, median, high = np.quantile(log_tof, [0.025, 0.5, 0.975], axis=1)
+        print('log10 TOF (median and 95% interval):')
+        for i, name in enumerate(names):
+            print('%10s %6.2f [%6.2f, %6.2f]'%(name, median[i], low[i], high[i]))
 
     for a in axc:
         a.set_xlim([-1.5,2])
@@ -329,6 +414,9 @@ def main(kfiles, kineticspk):
         cmapname='coolwarm',
         plot_metal=True,
         annotate_rate_limiting=True,
+        point_samples=point_samples,
+        rate_limiting_map=rate_limiting_map,
+        scaling=scaling,
     )
     plot_map(
         fig=fig,
@@ -345,6 +433,8 @@ def main(kfiles, kineticspk):
         coverage_plot=True,
         coverage_index=-1,
         plot_legend=True,
+        scaling=scaling,
+        point_samples=point_samples,
     )
     axc[1].annotate(r'CO$^*$ poisoned', xy=(0.03, 0.9), color='white', xycoords='axes fraction')
 
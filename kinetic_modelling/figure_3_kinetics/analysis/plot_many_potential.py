@@ -15,6 +15,7 @@ from plot_params import get_plot_params
 import xlrd
 import string
 from plot_kinetics_figure import get_electronic_energy_points, plot_map
+from scaling import scaling_relations, scaling_group
 
 
 def main():
@@ -40,6 +41,7 @@ def main():
     for i, (potential, pk) in enumerate(pk_potential.items()):    
         data = data_tot[str(pk)]
         data_points = get_electronic_energy_points(data['energy_file'], data['surfaces'], data['facet'][0])
+        scaling = scaling_relations(data['energy_file'], tuple(data['surfaces']))[scaling_group(data['energy_file'], data['facet'][0])]
         # if i == 0: plot_legend = True ; else: plot_legend = False
         plot_legend = True if i== 0 else False
         plot_map(
@@ -54,7 +56,8 @@ def main():
             cmapname='coolwarm',
             plot_metal=True,
             annotate_rate_limiting=False,
-            plot_legend=plot_legend
+            plot_legend=plot_legend,
+            scaling=scaling[tuple(data['descriptors'])],
         )
     
     fig.savefig('output/potential_dependent_production.pdf')
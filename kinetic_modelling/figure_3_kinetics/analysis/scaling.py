@@ -0,0 +1,160 @@
+"""Linear scaling relations between the CO2*, COOH* and CO* energies.
+
+All pairwise fits y = slope * x + intercept of the formation energies in
+a CatMAP energy file are computed in one pass: the energies are put in
+a (group, catalyst, adsorbate) array padded with nan, where a group is a
+facet of the transition metals (100, 211) or 'SAC' for all Fe and Ni
+sites, and the least squares fits of every (group, x, y) combination are
+done at once with the missing energies masked out.
+
+The fits are cached on the content of the energy file, so the plots of
+Figure 3 and the set up of the CatMAP runs (scaling_constraint_dict)
+use the same numbers without refitting::
+
+    relations = scaling_relations(energy_file)
+    relations['211']['COOH_s', 'CO_s']['slope']
+"""
+
+import functools
+import numpy as np
+
+ADSORBATES = ('CO2', 'COOH', 'CO')
+METALS = ('Pt', 'Pd', 'Cu', 'Ag', 'Au')
+DOPED_METALS = ('Fe', 'Ni')
+
+
+def read_energy_table(energy_file):
+    """Rows of a CatMAP energy file as a structured array
+
+    :param energy_file: content of the energy file
+    :type energy_file: str
+    :return: fields 'surface', 'site', 'species' and 'energy'
+    :rtype: np.ndarray
+    """
+    rows = [line.split('\t') for line in energy_file.splitlines()[1:] if line.strip()]
+    return np.array([(row[0], row[1], row[2], float(row[3])) for row in rows],
+                    dtype=[('surface', 'U16'), ('site', 'U16'), ('species', 'U16'), ('energy', 'f8')])
+
+
+def scaling_group(energy_file, facet):
+    """Group of the scaling relations of a site: the facet itself, or 'SAC' for the sites of Fe and Ni."""
+    table = read_energy_table(energy_file)
+    doped = np.isin(table['surface'], DOPED_METALS) & (table['site'] == facet)
+    return 'SAC' if doped.any() else facet
+
+
+def energy_array(table, surfaces=METALS, adsorbates=ADSORBATES):
+    """(group, catalyst, adsorbate) array of formation energies, nan where missing
+
+    :return: groups, catalyst names of every group and the array
+    :rtype: tuple
+    """
+    table = table[np.isin(table['species'], adsorbates)]
+    doped = np.isin(table['surface'], DOPED_METALS)
+    keep = doped | np.isin(table['surface'], surfaces)
+    table, doped = table[keep], doped[keep]
+    group = np.where(doped, 'SAC', table['site'])
+    catalyst = np.where(doped, np.char.add(np.char.add(table['surface'], '_'), table['site']), table['surface'])
+
+    groups, group_index = np.unique(group, return_inverse=True)
+    names = [[str(name) for name in np.unique(catalyst[group_index == i])] for i in range(len(groups))]
+    catalyst_index = np.array([names[g].index(c) for g, c in zip(group_index, catalyst)], dtype=int)
+    adsorbate_index = np.array([adsorbates.index(s) for s in table['species']], dtype=int)
+
+    energies = np.full((len(groups), max(len(n) for n in names), len(adsorbates)), np.nan)
+    energies[group_index, catalyst_index, adsorbate_index] = table['energy']
+    return [str(group) for group in groups], names, energies
+
+
+def pairwise_fits(energies):
+    """Least squares lines between all pairs of adsorbates of all groups
+
+    :param energies: (group, catalyst, adsorbate) array, nan where missing
+    :type energies: np.ndarray
+    :return: (group, x, y) arrays of 'slope', 'intercept', 'r2' and the number of points 'n'
+    :rtype: dict
+    """
+    x = energies[:, :, :, None]
+    y = energies[:, :, None, :]
+    weights = np.isfinite(x) & np.isfinite(y)
+    x = np.where(weights, x, 0)
+    y = np.where(weights, y, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = weights.sum(axis=1)
+        x_mean = x.sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        dx = np.where(weights, x - x_mean[:, None], 0)
+        dy = np.where(weights, y - y_mean[:, None], 0)
+        sxy = (dx * dy).sum(axis=1)
+        sxx = (dx**2).sum(axis=1)
+        syy = (dy**2).sum(axis=1)
+        slope = sxy / sxx
+        r2 = sxy**2 / (sxx * syy)
+    return {'slope': slope, 'intercept': y_mean - slope * x_mean, 'r2': r2, 'n': n}
+
+
+@functools.lru_cache(maxsize=None)
+def scaling_relations(energy_file, surfaces=METALS):
+    """Scaling relations of all pairs of adsorbates for every facet and the SACs
+
+    The result is cached on the content of the energy file and must not be modified.
+
+    :param energy_file: content of the CatMAP energy file
+    :type energy_file: str
+    :param surfaces: transition metals used for the facet fits (a tuple, it is part of
+        the cache key), defaults to METALS
+    :type surfaces: tuple, optional
+    :return: group -> (x, y) -> dict of 'slope', 'intercept', 'r2', 'n' and 'catalysts',
+        with adsorbates named as the CatMAP species, e.g. ('COOH_s', 'CO2_s')
+    :rtype: dict
+    """
+    groups, names, energies = energy_array(read_energy_table(energy_file), surfaces=surfaces)
+    fits = pairwise_fits(energies)
+    species = [adsorbate + '_s' for adsorbate in ADSORBATES]
+    relations = {}
+    for g, group in enumerate(groups):
+        for i, x in enumerate(species):
+            for j, y in enumerate(species):
+                if i == j or fits['n'][g, i, j] < 2:
+                    continue
+                relations.setdefault(group, {})[x, y] = {
+                    'slope': float(fits['slope'][g, i, j]),
+                    'intercept': float(fits['intercept'][g, i, j]),
+                    'r2': float(fits['r2'][g, i, j]),
+                    'n': int(fits['n'][g, i, j]),
+                    'catalysts': names[g],
+                }
+    return relations
+
+
+def load_scaling_relations(filename, surfaces=METALS):
+    """scaling_relations of an energy file on disk."""
+    with open(filename, 'r') as handle:
+        return scaling_relations(handle.read(), tuple(surfaces))
+
+
+def get_scaling_constraint_dict(relations, descriptors, fixed=False):
+    """scaling_constraint_dict of a CatMAP run
+
+    :param relations: relations of one group, e.g. scaling_relations(energy_file)['211'];
+        only used with fixed
+    :type relations: dict
+    :param descriptors: descriptor names of the run
+    :type descriptors: list
+    :param fixed: use the fitted relations for the adsorbates that are not descriptors;
+        every adsorbate is scaled to the descriptor it correlates best with. Otherwise
+        CatMAP fits the relations itself ('+'), defaults to False
+    :type fixed: bool, optional
+    :return: species -> [coefficient of every descriptor, intercept]
+    :rtype: dict
+    """
+    constraints = {}
+    for adsorbate in ADSORBATES:
+        species = adsorbate + '_s'
+        if not fixed or species in descriptors:
+            constraints[species] = ['+'] * len(descriptors) + [None]
+            continue
+        best = max(descriptors, key=lambda d: relations[d, species]['r2'])
+        coefficients = [relations[best, species]['slope'] if d == best else 0. for d in descriptors]
+        constraints[species] = coefficients + [relations[best, species]['intercept']]
+    return constraints
@@ -0,0 +1,150 @@
+"""Screening of candidate catalysts on the stored kinetic maps.
+
+The candidates are read from a CatMAP energy file (the format of
+energy_files, the site being vacancy_dopant for the SACs) or from a csv
+file with the columns metal, vacancy, dopant and the formation energy of
+every descriptor species (COOH, CO2). Their descriptor values are looked
+up on the map of a run with the surrogates of surrogate.py, all
+candidates in one call, and the free energies of the axes of plot_map
+(CHE and free energy corrections) are added as columns. The output is a
+csv table ranked by TOF::
+
+    python screening.py --candidates candidates.csv --kineticspk 277 --output output/screening.csv
+
+No CatMAP job has to be submitted for a candidate that lies within the
+descriptor range of the run; candidates outside are evaluated at the
+boundary of the map and flagged in the column 'inside'.
+"""
+
+import csv
+import json
+import time
+import click
+import numpy as np
+from energy_table import EnergyTable
+from surrogate import MapSurrogate
+
+COVERAGE_NAMES = ('CO2', 'COOH', 'CO')
+
+
+def read_candidates(filename, species=('COOH', 'CO2')):
+    """Formation energies of the candidates
+
+    :param filename: CatMAP energy file (.txt) or csv file with the columns metal,
+        vacancy, dopant and the species
+    :type filename: str
+    :param species: species of the descriptors, defaults to ('COOH', 'CO2')
+    :type species: tuple, optional
+    :return: 'name' (candidate,), 'metal', 'site' and (candidate, species) 'energy'
+    :rtype: dict
+    """
+    if filename.endswith('.txt'):
+        with open(filename, 'r') as handle:
+            table = EnergyTable.from_string(handle.read())
+        adsorbed = table.site != 'gas'
+        pairs = sorted(set(zip(table.surface[adsorbed].tolist(), table.site[adsorbed].tolist())))
+        energy = table.energies([(metal, site, s) for metal, site in pairs for s in species])[0]
+        energy = energy.reshape(len(pairs), len(species))
+        metal = np.array([metal for metal, _ in pairs], dtype=str)
+        site = np.array([site for _, site in pairs], dtype=str)
+    else:
+        with open(filename, 'r') as handle:
+            rows = list(csv.DictReader(handle))
+        metal = np.array([row['metal'] for row in rows], dtype=str)
+        site = np.array([row['vacancy'] + '_' + row['dopant'] for row in rows], dtype=str)
+        energy = np.array([[float(row[s]) for s in species] for row in rows])
+    ## candidates without all descriptor energies cannot be placed on the map
+    complete = ~np.isnan(energy).any(axis=1)
+    return {
+        'name': np.char.add(np.char.add(metal[complete], '_'), site[complete]),
+        'metal': metal[complete],
+        'site': site[complete],
+        'energy': energy[complete],
+    }
+
+
+def plot_coordinates(energy, descriptors, potential, pH, corrections):
+    """Free energies of the axes of plot_map for (candidate, descriptor) formation energies
+
+    :param corrections: free energy corrections per species, FreeEnergiesForFigure4.get_cycle_corrections
+    :type corrections: dict
+    :rtype: np.ndarray
+    """
+    ## CHE correction of the proton-electron pair in COOH*
+    CHE = np.array([potential + 0.059 * pH if d.startswith('COOH') else 0. for d in descriptors])
+    correction = np.array([corrections[d.replace('_s', '')] for d in descriptors])
+    return energy + CHE + correction
+
+
+def screen(candidates, run, corrections=None, surrogate=None):
+    """TOF, coverages and selectivity of all candidates on the map of one run
+
+    :param candidates: output of read_candidates with the descriptors of the run
+    :type candidates: dict
+    :param run: entry of kinetic_model_data.json
+    :type run: dict
+    :param corrections: free energy corrections to add the plot_map axes, defaults to none
+    :type corrections: dict, optional
+    :param surrogate: surrogate of the run, defaults to one built from the run
+    :type surrogate: MapSurrogate, optional
+    :return: columns of the table ranked by log10(TOF)
+    :rtype: dict
+    """
+    surrogate = MapSurrogate.from_run(run) if surrogate is None else surrogate
+    results = surrogate(candidates['energy'])
+    order = np.argsort(-results['log_tof'], kind='stable')
+
+    table = {'rank': np.arange(1, len(order) + 1), 'name': candidates['name'][order]}
+    for i, descriptor in enumerate(run['descriptors']):
+        table['E_' + descriptor] = candidates['energy'][order, i]
+    if corrections is not None:
+        free_energy = plot_coordinates(candidates['energy'], run['descriptors'], run['potential'], run['pH'], corrections)
+        for i, descriptor in enumerate(run['descriptors']):
+            table['G_' + descriptor] = free_energy[order, i]
+    table['log_tof'] = results['log_tof'][order]
+    ## the coverage map of CatMAP leaves out the empty site
+    for i in range(results['coverage'].shape[1]):
+        name = COVERAGE_NAMES[i] if results['coverage'].shape[1] == len(COVERAGE_NAMES) else str(i)
+        table['theta_' + name] = results['coverage'][order, i]
+    for i in range(results['selectivity'].shape[1]):
+        table['selectivity_%d'%i] = results['selectivity'][order, i]
+    table['inside'] = results['inside'][order]
+    return table
+
+
+def write_table(filename, table, decimals=4):
+    """Write the ranked table as csv."""
+    columns = list(table)
+    with open(filename, 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(columns)
+        for row in zip(*[table[c].tolist() for c in columns]):
+            writer.writerow([round(v, decimals) if isinstance(v, float) else v for v in row])
+
+
+@click.command()
+@click.option('--candidates', required=True, help='CatMAP energy file or csv with metal, vacancy, dopant, COOH, CO2')
+@click.option('--kfiles', type=str, default='aiida_output/kinetic_model_data.json')
+@click.option('--kineticspk', type=str, default='277')
+@click.option('--output', default='output/screening.csv')
+@click.option('--top', default=10, help='number of candidates printed')
+def main(candidates, kfiles, kineticspk, output, top):
+    """Rank candidate catalysts by the TOF on the map of a stored run."""
+    from plot_kinetics_figure import FreeEnergiesForFigure4
+
+    with open(kfiles, 'r') as handle:
+        data = json.load(handle)
+    run = data if 'production_rate' in data else data[kineticspk]
+
+    start = time.perf_counter()
+    energies = read_candidates(candidates, tuple(d.replace('_s', '') for d in run['descriptors']))
+    table = screen(energies, run, corrections=FreeEnergiesForFigure4().get_cycle_corrections())
+    write_table(output, table)
+    print('Screened %d candidates in %1.2f s, %d outside of the map'%(
+        len(table['name']), time.perf_counter() - start, np.sum(~table['inside'])))
+    for i in range(min(top, len(table['name']))):
+        print('%4d %15s log10 TOF %6.2f'%(table['rank'][i], table['name'][i], table['log_tof'][i]))
+
+
+if __name__ == '__main__':
+    main()
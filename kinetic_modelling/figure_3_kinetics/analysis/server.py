@@ -0,0 +1,168 @@
+"""Local server answering queries on the kinetic maps.
+
+The server loads the runs of kinetic_model_data.json (and any single run
+written by microkinetics.py or adaptive_mesh.py) once and keeps the
+surrogates of surrogate.py in memory, so a notebook gets the TOF,
+coverages and selectivity of a batch of descriptor values without
+reloading the maps::
+
+    python server.py --kfiles aiida_output/kinetic_model_data.json
+
+    from server import query
+    query(-0.8, 2., '211', [[-0.9, 3.5], [-0.4, 1.2]])['log_tof']
+
+It only listens on localhost. The requests are JSON:
+
+    POST /query  {"potential": -0.8, "pH": 2, "facet": "211", "points": [[dG_COOH, dG_CO2], ...]}
+    GET  /runs   the (potential, pH, facet) of the stored runs
+    GET  /stats  request count and latency per path, surrogate cache hits and misses
+"""
+
+import json
+import time
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import click
+import numpy as np
+from surrogate import SurrogateLibrary
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+
+def _to_json(value):
+    """Array as nested lists, with nan (outside of a scattered map) as null."""
+    if value.dtype.kind == 'f':
+        value = np.where(np.isnan(value), None, value.astype(object))
+    return value.tolist()
+
+
+class LatencyStats:
+    """Count and latency of the requests per path, kept for the lifetime of the server."""
+
+    def __init__(self):
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self.start = time.time()
+
+    def add(self, path, seconds):
+        with self._lock:
+            self._latencies.setdefault(path, []).append(seconds)
+
+    def summary(self):
+        """path -> count, mean, median, 95th percentile and largest latency in ms"""
+        with self._lock:
+            latencies = {path: np.array(values) * 1e3 for path, values in self._latencies.items()}
+        return {path: {'count': len(values), 'mean_ms': values.mean(), 'p50_ms': np.percentile(values, 50),
+                       'p95_ms': np.percentile(values, 95), 'max_ms': values.max()}
+                for path, values in latencies.items()}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Requests of the server; library and stats are set on the server."""
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _timed(self, answer):
+        start = time.perf_counter()
+        try:
+            status, data = answer()
+        except (KeyError, ValueError, TypeError) as error:
+            status, data = 400, {'error': repr(error)}
+        self._send(status, data)
+        self.server.stats.add(self.path, time.perf_counter() - start)
+
+    def do_GET(self):
+        library = self.server.library
+        if self.path == '/runs':
+            self._timed(lambda: (200, {'runs': [list(key) for key in library.runs]}))
+        elif self.path == '/stats':
+            self._timed(lambda: (200, {'uptime_s': time.time() - self.server.stats.start,
+                                       'requests': self.server.stats.summary(),
+                                       'cache': library.stats()}))
+        else:
+            self._send(404, {'error': 'unknown path %s'%self.path})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._send(404, {'error': 'unknown path %s'%self.path})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+
+        def answer():
+            ## a malformed body is a ValueError, answered with 400 like a missing key
+            request = json.loads(body or b'{}')
+            key = SurrogateLibrary.key(request['potential'], request['pH'], request['facet'])
+            if key not in self.server.library.runs:
+                return 404, {'error': 'no run for potential %s, pH %s, facet %s'%key}
+            results = self.server.library.query(*key, request['points'])
+            return 200, {name: _to_json(value) for name, value in results.items()}
+        self._timed(answer)
+
+    def log_message(self, format, *args):
+        ## the latencies are in /stats, do not print every request
+        pass
+
+
+def make_server(library, host='127.0.0.1', port=8765):
+    """HTTP server of the surrogate library, run with serve_forever()
+
+    :param library: surrogates of the runs
+    :type library: SurrogateLibrary
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.library = library
+    server.stats = LatencyStats()
+    return server
+
+
+def query(potential, pH, facet, points, url=DEFAULT_URL):
+    """TOF, coverages and selectivity from a running server
+
+    :return: 'log_tof', 'coverage', 'selectivity' and 'inside' as arrays, see MapSurrogate.__call__;
+        null values of the answer are nan again
+    :rtype: dict
+    """
+    request = json.dumps({'potential': potential, 'pH': pH, 'facet': facet,
+                          'points': np.asarray(points, dtype=float).tolist()}).encode()
+    with urllib.request.urlopen(urllib.request.Request(url + '/query', data=request,
+                                headers={'Content-Type': 'application/json'})) as response:
+        return {name: np.array(value, dtype=bool if name == 'inside' else float)
+                for name, value in json.load(response).items()}
+
+
+def stats(url=DEFAULT_URL):
+    """Latency and cache statistics of a running server."""
+    with urllib.request.urlopen(url + '/stats') as response:
+        return json.load(response)
+
+
+@click.command()
+@click.option('--kfiles', multiple=True, default=['aiida_output/kinetic_model_data.json'],
+              help='kinetic_model_data.json or single runs, can be repeated')
+@click.option('--port', default=8765)
+@click.option('--preload', is_flag=True, help='build all surrogates before serving')
+def main(kfiles, port, preload):
+    """Serve TOF, coverage and selectivity queries of the kinetic maps on localhost."""
+    library = SurrogateLibrary.from_file(*kfiles)
+    if preload:
+        for key in library.runs:
+            library.surrogate(*key)
+    server = make_server(library, port=port)
+    print('Serving %d runs on http://127.0.0.1:%d'%(len(library.runs), port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""Surrogate models of the kinetic maps for fast queries in descriptor space.
+
+A kinetic map (production rate and coverages on a descriptor grid, as
+stored in kinetic_model_data.json) is replaced by piecewise cubic
+interpolants of log10(TOF) and of the coverages: bicubic splines when
+the map is a full rectangular grid (the CatMAP runs) and Clough-Tocher
+interpolants on scattered points otherwise (adaptive_mesh.py). A batch
+of thousands of (dG_COOH, dG_CO2) points then costs a few microseconds
+per point, instead of re-rendering plot_map or re-running CatMAP.
+
+The error of the surrogate is estimated by fitting it again to every
+other grid line (or 80% of the scattered points) and comparing it with
+the held-out points. This overestimates the error of the full model,
+whose spacing is half as large.
+
+    surrogates = SurrogateLibrary.from_file('aiida_output/kinetic_model_data.json')
+    surrogates.query(-0.8, 2., '211', points)['log_tof']
+"""
+
+import json
+import time
+import threading
+import click
+import numpy as np
+
+
+def _map_arrays(maps):
+    points = np.array([row[0] for row in maps], dtype=float)
+    values = [np.atleast_1d(row[1]) for row in maps]
+    return points, values
+
+
+def _regular_grid(points):
+    """Axes and (x, y) ordering of the points if they fill a rectangular grid, else None."""
+    x, ix = np.unique(points[:, 0], return_inverse=True)
+    y, iy = np.unique(points[:, 1], return_inverse=True)
+    if len(x) * len(y) != len(points) or len(x) < 4 or len(y) < 4:
+        return None
+    order = np.full((len(x), len(y)), -1)
+    order[ix, iy] = np.arange(len(points))
+    if (order < 0).any():
+        return None
+    return x, y, order
+
+
+def _read_runs(filename):
+    """Runs of a kinetic_model_data.json file, a single run (microkinetics.py,
+    adaptive_mesh.py) or a bare production rate map, as a list of dicts."""
+    with open(filename, 'r') as handle:
+        data = json.load(handle)
+    if isinstance(data, list):
+        return [{'production_rate': data}]
+    return [data] if 'production_rate' in data else list(data.values())
+
+
+class MapSurrogate:
+    """Piecewise cubic model of log10(TOF) and the coverages of one kinetic map
+
+    :param production_rate: [[descriptors, production rates], ...]
+    :type production_rate: list
+    :param coverage_map: [[descriptors, coverages], ...] on the same points, defaults to None
+    :type coverage_map: list, optional
+    :param min_val: rates below are set to this value, defaults to 1e-20
+    :type min_val: float, optional
+    """
+
+    def __init__(self, production_rate, coverage_map=None, min_val=1e-20):
+        points, rates = _map_arrays(production_rate)
+        rates = np.clip(np.array(rates, dtype=float), 0, None)
+        values = np.log10(np.clip(rates.max(axis=1), min_val, None))[:, None]
+        ## fraction of every species in the production rate
+        total = rates.sum(axis=1, keepdims=True)
+        selectivity = np.divide(rates, total, out=np.zeros_like(rates), where=total > 0)
+        self.nspecies = rates.shape[1]
+        self.ncoverages = 0
+        if coverage_map is not None:
+            coverage_points, coverages = _map_arrays(coverage_map)
+            if not np.allclose(coverage_points, points):
+                raise ValueError('The coverage map is not on the points of the production rate map')
+            coverages = np.array(coverages, dtype=float)
+            self.ncoverages = coverages.shape[1]
+            values = np.concatenate([values, coverages], axis=1)
+        values = np.concatenate([values, selectivity], axis=1)
+        self.points = points
+        self.values = values
+        self.lower = points.min(axis=0)
+        self.upper = points.max(axis=0)
+        self._fit(points, values)
+
+    def _fit(self, points, values):
+        from scipy.interpolate import RectBivariateSpline, CloughTocher2DInterpolator
+        grid = _regular_grid(points)
+        if grid is not None:
+            x, y, order = grid
+            self._splines = [RectBivariateSpline(x, y, values[order, k], kx=3, ky=3, s=0)
+                             for k in range(values.shape[1])]
+            self._scattered = None
+        else:
+            self._splines = None
+            self._scattered = CloughTocher2DInterpolator(points, values)
+
+    @classmethod
+    def from_run(cls, data, min_val=1e-20):
+        """Surrogate of one entry of kinetic_model_data.json."""
+        return cls(data['production_rate'], data.get('coverage_map'), min_val=min_val)
+
+    def evaluate(self, points):
+        """(point, 1 + coverage) array of log10(TOF) and coverages; points are clipped to the map."""
+        points = np.clip(np.atleast_2d(np.asarray(points, dtype=float)), self.lower, self.upper)
+        if self._splines is not None:
+            return np.stack([spline.ev(points[:, 0], points[:, 1]) for spline in self._splines], axis=1)
+        return self._scattered(points)
+
+    def __call__(self, points):
+        """log10(TOF) and coverages at the (point, 2) descriptor values
+
+        :return: 'log_tof' (point,), 'coverage' (point, coverage), 'selectivity'
+            (point, species) as fractions of the production rate and 'inside',
+            False for points outside of the map (evaluated at its boundary;
+            scattered maps are nan outside the convex hull of their points)
+        :rtype: dict
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        values = self.evaluate(points)
+        return {
+            'log_tof': values[:, 0],
+            'coverage': np.clip(values[:, 1:1 + self.ncoverages], 0, 1),
+            'selectivity': np.clip(values[:, 1 + self.ncoverages:], 0, 1),
+            'inside': np.all((points >= self.lower) & (points <= self.upper), axis=1),
+        }
+
+    def holdout_error(self, seed=0):
+        """Error of the surrogate on held-out points of the map
+
+        On a grid the model is fitted to the even grid lines and compared on
+        the others; on scattered points 20% of the points are held out.
+
+        :return: 'log_tof' and 'coverage' dicts of the 'max' and 'rms' error
+        :rtype: dict
+        """
+        grid = _regular_grid(self.points)
+        if grid is not None:
+            x, y, order = grid
+            train = np.zeros(order.shape, dtype=bool)
+            train[::2, ::2] = True
+            ## the last grid line is kept so the held-out points are interpolated
+            train[-1, ::2] = True ; train[::2, -1] = True ; train[-1, -1] = True
+            train, test = order[train], order[~train]
+        else:
+            permutation = np.random.default_rng(seed).permutation(len(self.points))
+            train, test = np.sort(permutation[len(self.points) // 5:]), permutation[:len(self.points) // 5]
+        model = object.__new__(MapSurrogate)
+        model.lower, model.upper = self.lower, self.upper
+        model._fit(self.points[train], self.values[train])
+        error = np.abs(model.evaluate(self.points[test]) - self.values[test])
+        error = error[np.isfinite(error).all(axis=1)]
+        result = {'log_tof': {'max': error[:, 0].max(), 'rms': np.sqrt(np.mean(error[:, 0]**2))}}
+        if self.ncoverages:
+            coverage = error[:, 1:1 + self.ncoverages]
+            result['coverage'] = {'max': coverage.max(), 'rms': np.sqrt(np.mean(coverage**2))}
+        return result
+
+
+class SurrogateLibrary:
+    """Surrogates of many kinetic maps, keyed by (potential, pH, facet)
+
+    The surrogates are built the first time they are queried; building and
+    the hit and miss counters are locked, so the library can be shared
+    between the threads of server.py.
+
+    :param runs: entries of kinetic_model_data.json, one per (potential, pH, facet)
+    :type runs: list
+    """
+
+    def __init__(self, runs):
+        self.runs = {}
+        for run in runs:
+            key = self.key(run['potential'], run['pH'], run['facet'][0])
+            if key in self.runs:
+                raise ValueError('More than one run for potential %s, pH %s, facet %s'%key)
+            self.runs[key] = run
+        self._surrogates = {}
+        self._lock = threading.Lock()
+        ## the counters have their own lock, so hits do not wait for a surrogate being built
+        self._count_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(potential, pH, facet):
+        return (round(float(potential), 6), round(float(pH), 6), str(facet))
+
+    @classmethod
+    def from_file(cls, *filenames):
+        """Surrogates of all runs of kinetic_model_data.json files or single runs (microkinetics.py)."""
+        runs = []
+        for filename in filenames:
+            runs += _read_runs(filename)
+        return cls(runs)
+
+    def surrogate(self, potential, pH, facet):
+        """MapSurrogate of a run, KeyError if there is no such run."""
+        key = self.key(potential, pH, facet)
+        surrogate = self._surrogates.get(key)
+        if surrogate is None:
+            with self._lock:
+                built = key not in self._surrogates
+                if built:
+                    self._surrogates[key] = MapSurrogate.from_run(self.runs[key])
+                surrogate = self._surrogates[key]
+        else:
+            built = False
+        with self._count_lock:
+            if built:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return surrogate
+
+    def query(self, potential, pH, facet, points):
+        """log10(TOF) and coverages of the (point, 2) descriptor values, see MapSurrogate.__call__"""
+        return self.surrogate(potential, pH, facet)(points)
+
+    def stats(self):
+        """Number of runs, built surrogates and cache hits and misses."""
+        with self._count_lock:
+            return {'runs': len(self.runs), 'built': len(self._surrogates), 'hits': self.hits, 'misses': self.misses}
+
+
+@click.command()
+@click.argument('maps', nargs=-1)
+@click.option('--kfiles', default=None, help='kinetic_model_data.json with the runs')
+@click.option('--npoints', default=10000, help='number of random points of the timed query')
+def main(maps, kfiles, npoints):
+    """Held-out error and query time of the surrogates of production rate maps."""
+    surrogates = {}
+    for name in maps:
+        runs = _read_runs(name)
+        for i, run in enumerate(runs):
+            surrogates[name if len(runs) == 1 else '%s[%d]'%(name, i)] = MapSurrogate.from_run(run)
+    if kfiles is not None:
+        library = SurrogateLibrary.from_file(kfiles)
+        surrogates.update({key: library.surrogate(*key) for key in library.runs})
+
+    for name, surrogate in surrogates.items():
+        points = surrogate.lower + (surrogate.upper - surrogate.lower) * np.random.rand(npoints, 2)
+        start = time.perf_counter()
+        surrogate(points)
+        elapsed = time.perf_counter() - start
+        error = surrogate.holdout_error()['log_tof']
+        print('%s: log10(TOF) held-out error max %1.3f rms %1.3f, %1.2f us per point'%(
+            name, error['max'], error['rms'], 1e6 * elapsed / npoints))
+
+
+if __name__ == '__main__':
+    main()
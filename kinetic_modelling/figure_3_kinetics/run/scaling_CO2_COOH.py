@@ -1,10 +1,16 @@
+import sys
 from os import path
 from aiida import cmdline, engine
 from aiida.plugins import DataFactory, CalculationFactory
 import click
 from aiida.orm import SinglefileData, List, Dict, Int, Float, Str
+## scaling.py is shared with the analysis and kept in its folder
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'analysis'))
+from scaling import scaling_relations, scaling_group, get_scaling_constraint_dict
 
-def run_calculation(facet, pH, energy_pk, label):
+DESCRIPTORS = ['COOH_s','CO2_s']
+
+def run_calculation(facet, pH, energy_pk, label, fixed_scaling=False):
     """Run AiiDA CatMAP calculation
 
     :param catmap_code: Code object for CatMAP
@@ -17,6 +23,9 @@ def run_calculation(facet, pH, energy_pk, label):
     :type energy_pk: int
     :param label: Label to denote the computation
     :type label: str
+    :param fixed_scaling: fix the adsorbates that are not descriptors to the fitted
+        scaling relations (scaling.py) instead of letting CatMAP fit them
+    :type fixed_scaling: bool
     """
     catmap_code = load_code('catmap-sigma@localhost')
 
@@ -30,11 +39,12 @@ def run_calculation(facet, pH, energy_pk, label):
     species_definitions['H2O_g'] = {'pressure':0.1}
     species_definitions['s'] = {'site_names': [facet], 'total':1}
 
-    scaling_constraint_dict = {
-                           'COOH_s':['+','+',None],
-                           'CO2_s':['+','+',None],
-                           'CO_s':['+', '+', None],
-                           }
+    ## fitted scaling relations of the energy file, the same as in the analysis
+    relations = None
+    if fixed_scaling:
+        content = energies.get_content()
+        relations = scaling_relations(content)[scaling_group(content, facet)]
+    scaling_constraint_dict = get_scaling_constraint_dict(relations, DESCRIPTORS, fixed=fixed_scaling)
 
     ideal_gas_params = { 
                          'CO2_g' : [2,'linear', 0],
@@ -56,7 +66,7 @@ def run_calculation(facet, pH, energy_pk, label):
                         'H2_g <-> H2_g',
         ]), 
         'surface_names':List(list=surfaces), 
-        'descriptor_names':List(list=['COOH_s','CO2_s']), 
+        'descriptor_names':List(list=DESCRIPTORS), 
         'descriptor_ranges':List(list=[[-2.5, 1.5 ], [-2.5, 1.5]]), 
         'resolution':Int(50), 
         'voltage':Float(potential),
@@ -89,8 +99,9 @@ def main():
     PH = 2 # The pH value at which the experiments were done
     ENERGY_PK = 11 # pk of the energy file
     LABEL = 'CatMAP calculation at potential: %1.2f' 
+    FIXED_SCALING = False # True to use the scaling relations of scaling.py for CO_s
 
-    run_calculation(FACET, PH, ENERGY_PK, LABEL)
+    run_calculation(FACET, PH, ENERGY_PK, LABEL, fixed_scaling=FIXED_SCALING)
 
 
 if __name__ == '__main__':
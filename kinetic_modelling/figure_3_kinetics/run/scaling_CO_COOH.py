@@ -1,14 +1,20 @@
+import sys
 from os import path
 from aiida_catmap import helpers
 from aiida import cmdline, engine
 from aiida.plugins import DataFactory, CalculationFactory
 import click
 from aiida.orm import SinglefileData, List, Dict, Int, Float, Str
+## scaling.py is shared with the analysis and kept in its folder
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), '..', 'analysis'))
+from scaling import scaling_relations, scaling_group, get_scaling_constraint_dict
+
+DESCRIPTORS = ['CO_s','COOH_s']
 
 INPUT_DIR = path.join(path.dirname(path.realpath(__file__)), 'input_files')
 
 
-def run_calculation(catmap_code, potential, facet, pH, energy_pk, label):
+def run_calculation(catmap_code, potential, facet, pH, energy_pk, label, fixed_scaling=False):
     """Run AiiDA CatMAP calculation
 
     :param catmap_code: Code object for CatMAP
@@ -21,6 +27,9 @@ def run_calculation(catmap_code, potential, facet, pH, energy_pk, label):
     :type energy_pk: int
     :param label: Label to denote the computation
     :type label: str
+    :param fixed_scaling: fix the adsorbates that are not descriptors to the fitted
+        scaling relations (scaling.py) instead of letting CatMAP fit them
+    :type fixed_scaling: bool
     """
     if not catmap_code:
         # get code
@@ -38,11 +47,12 @@ def run_calculation(catmap_code, potential, facet, pH, energy_pk, label):
     species_definitions['H2O_g'] = {'pressure':0.1}
     species_definitions['s'] = {'site_names': [facet], 'total':1}
 
-    scaling_constraint_dict = {
-                           'COOH_s':['+','+',None],
-                           'CO2_s':['+','+',None],
-                           'CO_s':['+', '+', None],
-                           }
+    ## fitted scaling relations of the energy file, the same as in the analysis
+    relations = None
+    if fixed_scaling:
+        content = energies.get_content()
+        relations = scaling_relations(content)[scaling_group(content, facet)]
+    scaling_constraint_dict = get_scaling_constraint_dict(relations, DESCRIPTORS, fixed=fixed_scaling)
 
     ideal_gas_params = { 
                          'CO2_g' : [2,'linear', 0],
@@ -64,7 +74,7 @@ def run_calculation(catmap_code, potential, facet, pH, energy_pk, label):
                         'H2_g <-> H2_g',
         ]), 
         'surface_names':List(list=surfaces), 
-        'descriptor_names':List(list=['CO_s','COOH_s']), 
+        'descriptor_names':List(list=DESCRIPTORS), 
         # 'descriptor_names':List(list=['CO_s','COOH_s']), 
         'descriptor_ranges':List(list=[[-2., 2 ], [-2., 2]]), 
         # 'descriptor_ranges':List(list=[[-1.5, 1.5 ], [-1.5, 1.5]]), 
@@ -106,9 +116,10 @@ def run_calculation(catmap_code, potential, facet, pH, energy_pk, label):
 @click.option('--ph')
 @click.option('--energy_pk')
 @click.option('--label')
+@click.option('--fixed_scaling', is_flag=True, help='Use the fitted scaling relations of scaling.py')
 @cmdline.utils.decorators.with_dbenv()
 @cmdline.params.options.CODE()
-def cli(code, potential, facet, ph, energy_pk, label):
+def cli(code, potential, facet, ph, energy_pk, label, fixed_scaling):
     """Run example.
 
     Example usage: $ ./example_01.py --code diff@localhost
@@ -117,7 +128,7 @@ def cli(code, potential, facet, ph, energy_pk, label):
 
     Help: $ ./example_01.py --help
     """
-    run_calculation(code, potential, facet, ph, energy_pk, label)
+    run_calculation(code, potential, facet, ph, energy_pk, label, fixed_scaling=fixed_scaling)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,251 @@
+"""Filling and band moments of all projected density of states at once.
+
+All PDOS from the json DOS databases and the data blobs of the
+ase databases are stacked into one (record, energy) array, each
+record on its own energy grid padded to a common length. Fillings
+and moments of every record are then obtained with a handful of
+array operations, with the trapezoid rule on the
+energies of the record.
+
+Each record is labelled by (metal, site, state, projection, spin):
+    - json files: site is the facet or vacancy_dopant, state is
+      'slab' for the metal projection and 'CO2' for the adsorbate
+    - ase databases: site is 'rls', state is the state number and
+      the orbitals of a projection are summed
+"""
+
+import os
+import json
+from pathlib import Path
+import numpy as np
+
+CACHE_FILE = 'cache/dos_moments.npz'
+## bumped when the moments change for the same files and options
+CACHE_VERSION = 2
+
+
+def records_from_json(filename):
+    """Read the PDOS stored in TM_dos.json, SAC_dos.json or Gas_dos.json
+
+    :param filename: json DOS database
+    :type filename: str
+    :return: list of labels, list of energies and list of pdos
+    :rtype: tuple
+    """
+    with open(filename, 'r') as handle:
+        data = json.load(handle)
+    labels = [] ; energies = [] ; pdos = []
+    for metal in data:
+        for site in data[metal]:
+            for projection, spins in data[metal][site]['pdos'].items():
+                if projection.endswith('(d)'):
+                    state = 'slab'
+                    energy = data[metal][site]['energies_slab']
+                else:
+                    state = 'CO2'
+                    energy = data[metal][site]['energies_ads']
+                for spin, values in spins.items():
+                    labels.append((metal, site, state, projection, spin))
+                    energies.append(np.asarray(energy, dtype=float))
+                    pdos.append(np.asarray(values, dtype=float).reshape(-1, len(energy)).sum(axis=0))
+    return labels, energies, pdos
+
+
+def records_from_database(database, metal='Fe', site='rls'):
+    """Read the PDOS stored in the data of an ase database (e.g. single_atom_rls.db)
+
+    :param database: ase database
+    :type database: db
+    :return: list of labels, list of energies and list of pdos
+    :rtype: tuple
+    """
+    labels = [] ; energies = [] ; pdos = []
+    for row in database.select():
+        state = row.states.replace('state_','')
+        energy = np.asarray(row.data.pdos.energies, dtype=float)
+        for projection, spins in row.data.pdos.pdos.items():
+            for spin, values in spins.items():
+                labels.append((metal, site, state, projection, spin))
+                energies.append(energy)
+                ## sum over the orbitals of the projection
+                pdos.append(np.asarray(values, dtype=float).reshape(-1, len(energy)).sum(axis=0))
+    return labels, energies, pdos
+
+
+def pad_records(energies, pdos):
+    """Sort every record by energy and pad all of them to one length
+
+    Records are padded with their last energy and zero dos, so the
+    padding adds intervals of zero width to the integrals.
+
+    :param energies: energies of each record
+    :type energies: list
+    :param pdos: pdos of each record
+    :type pdos: list
+    :return: (record, energy) arrays of the energies and the pdos
+    :rtype: tuple
+    """
+    nrecords = len(energies)
+    length = max(len(e) for e in energies)
+    E = np.empty((nrecords, length))
+    D = np.zeros((nrecords, length))
+    for i, (e, d) in enumerate(zip(energies, pdos)):
+        order = np.argsort(e)
+        E[i, :len(e)] = e[order]
+        E[i, len(e):] = e[order][-1]
+        D[i, :len(e)] = d[order]
+    return E, D
+
+
+def stack_on_grid(energies, pdos, grid=None, npoints=None):
+    """Interpolate all PDOS onto a common energy grid
+
+    The interpolation of all records is done in one searchsorted call
+    by shifting each record into its own energy interval. Outside the
+    energy range of a record the PDOS is zero.
+
+    :param energies: energies of each record
+    :type energies: list
+    :param pdos: pdos of each record
+    :type pdos: list
+    :param grid: common energy grid, defaults to one spanning all records
+    :type grid: np.ndarray, optional
+    :param npoints: number of points of the default grid, defaults to twice the longest record
+    :type npoints: int, optional
+    :return: energy grid and (record, energy) array of the pdos
+    :rtype: tuple
+    """
+    E, D = pad_records(energies, pdos)
+    nrecords, length = E.shape
+
+    if grid is None:
+        npoints = npoints or 2 * length
+        grid = np.linspace(E.min(), E.max(), npoints)
+
+    span = max(E.max(), grid.max()) - min(E.min(), grid.min()) + 1
+    offset = span * np.arange(nrecords)[:, None]
+    flat_E = (E + offset).ravel()
+    query = (grid[None, :] + offset)
+
+    index = np.clip(np.searchsorted(flat_E, query, side='right') - 1, 0, flat_E.size - 2)
+    index = np.clip(index, (np.arange(nrecords) * length)[:, None], (np.arange(nrecords) * length + length - 2)[:, None])
+    e0 = flat_E[index] ; e1 = flat_E[index + 1]
+    d0 = D.ravel()[index] ; d1 = D.ravel()[index + 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(e1 > e0, (query - e0) / (e1 - e0), 0.0)
+    stacked = d0 + weight * (d1 - d0)
+
+    inside = (grid[None, :] >= E[:, :1]) & (grid[None, :] <= E[:, -1:])
+    return grid, np.where(inside, stacked, 0.0)
+
+
+def band_moments(energies, pdos, fermi_level=0.0, window=None):
+    """Filling, centre, width, skewness and kurtosis of every PDOS
+
+    The integrals use the trapezoid rule on the intervals of each
+    record; the filled states are the intervals below the Fermi level.
+
+    :param energies: energy grid, or (record, energy) array from pad_records
+    :type energies: np.ndarray
+    :param pdos: (record, energy) array
+    :type pdos: np.ndarray
+    :param fermi_level: energy below which states are filled, defaults to 0.0
+    :type fermi_level: float, optional
+    :param window: (min, max) energies used for the moments, defaults to the full grid
+    :type window: tuple, optional
+    :return: dict of per record arrays
+    :rtype: dict
+    """
+    E = np.broadcast_to(energies, pdos.shape)
+    ## half widths of the intervals, zero outside the window
+    half = np.diff(E, axis=1) / 2
+    if window is not None:
+        half = half * ((E[:, :-1] >= window[0]) & (E[:, 1:] <= window[1]))
+
+    def integrate(values, weights=half):
+        return (weights * (values[:, :-1] + values[:, 1:])).sum(axis=1)
+
+    norm = integrate(pdos)
+    filled = integrate(pdos, half * (E[:, 1:] <= fermi_level))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centre = integrate(pdos * E) / norm
+        deviation = E - centre[:, None]
+        variance = integrate(pdos * deviation**2) / norm
+        width = np.sqrt(variance)
+        skewness = integrate(pdos * deviation**3) / norm / width**3
+        kurtosis = integrate(pdos * deviation**4) / norm / variance**2
+
+    return {
+        'norm': norm,
+        'filling': filled / norm,
+        'centre': centre,
+        'width': width,
+        'skewness': skewness,
+        'kurtosis': kurtosis,
+    }
+
+
+def get_dos_moments(json_files=(), databases=(), cache_file=CACHE_FILE, **kwargs):
+    """Moments of all PDOS in the given files, cached on disk
+
+    The cache is reused as long as the list of files, their
+    modification times and the options passed to band_moments
+    are unchanged.
+
+    :param json_files: json DOS databases
+    :type json_files: list
+    :param databases: ase database files with pdos in the data
+    :type databases: list
+    :param cache_file: npz file with the results, None to disable caching
+    :type cache_file: str, optional
+    :return: labels (record, 5) array and the dict from band_moments
+    :rtype: tuple
+    """
+    sources = [os.path.abspath(f) for f in list(json_files) + list(databases)]
+    stamp = np.array([os.path.getmtime(f) for f in sources])
+    options = json.dumps(dict(kwargs, version=CACHE_VERSION), sort_keys=True)
+
+    if cache_file is not None and Path(cache_file).exists():
+        with np.load(cache_file) as cached:
+            if cached['sources'].tolist() == sources and np.array_equal(cached['stamp'], stamp) \
+                    and str(cached['options']) == options:
+                moments = {k.replace('moment_',''): cached[k] for k in cached.files if k.startswith('moment_')}
+                return cached['labels'], moments
+
+    labels = [] ; energies = [] ; pdos = []
+    for f in json_files:
+        l, e, d = records_from_json(f)
+        labels += l ; energies += e ; pdos += d
+    if databases:
+        from ase.db import connect
+        for f in databases:
+            l, e, d = records_from_database(connect(f))
+            labels += l ; energies += e ; pdos += d
+
+    moments = band_moments(*pad_records(energies, pdos), **kwargs)
+    labels = np.array(labels, dtype=str)
+
+    if cache_file is not None:
+        Path(cache_file).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(cache_file, sources=np.array(sources, dtype=str), stamp=stamp, labels=labels,
+                    options=np.array(options),
+                    **{'moment_' + k: v for k, v in moments.items()})
+    return labels, moments
+
+
+def select(labels, values, **conditions):
+    """Pick values by label, e.g. select(labels, moments['filling'], projection='CO2(sp)')"""
+    columns = {'metal': 0, 'site': 1, 'state': 2, 'projection': 3, 'spin': 4}
+    mask = np.ones(len(labels), dtype=bool)
+    for key, value in conditions.items():
+        mask &= labels[:, columns[key]] == value
+    return labels[mask], values[mask]
+
+
+def spin_summed_filling(labels, moments):
+    """Filling of the spin summed PDOS, labels without the spin column."""
+    systems, inverse = np.unique(labels[:, :4], axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    norm = np.bincount(inverse, weights=moments['norm'])
+    filled = np.bincount(inverse, weights=moments['norm'] * moments['filling'])
+    return systems, filled / norm
@@ -0,0 +1,183 @@
+"""Binary storage of the DOS json databases.
+
+A container file holds a small json index followed by float32
+arrays. The index is keyed by (metal, site, projection, spin) and
+points at the PDOS block and at the energy block it is defined on;
+energy blocks are shared by all projections of a system. Readers
+memory map the data so that only the projections that are accessed
+are read from disk.
+
+Layout of a container::
+
+    MAGIC | uint64 header length | json header | padding | float32 data
+"""
+
+import os
+import json
+import struct
+from pathlib import Path
+import numpy as np
+import click
+
+MAGIC = b'KMDOS1\n'
+EXTENSION = '.dos.bin'
+ALIGNMENT = 16
+
+
+def _energy_kind(projection):
+    """Metal d projections are stored on the slab energies, the rest on the adsorbate ones."""
+    return 'energies_slab' if projection.endswith('(d)') else 'energies_ads'
+
+
+def convert_dos_json(json_file, container_file=None):
+    """Convert a json DOS database (TM_dos.json, SAC_dos.json, Gas_dos.json) to a container
+
+    :param json_file: json DOS database
+    :type json_file: str
+    :param container_file: output file, defaults to json_file with EXTENSION
+    :type container_file: str, optional
+    :return: name of the container file
+    :rtype: str
+    """
+    if container_file is None:
+        container_file = str(Path(json_file).with_suffix(EXTENSION))
+    with open(json_file, 'r') as handle:
+        data = json.load(handle)
+
+    blocks = []
+    offset = 0
+    energies = {}
+    entries = []
+
+    def add_block(values):
+        nonlocal offset
+        values = np.ascontiguousarray(values, dtype=np.float32)
+        blocks.append(values)
+        start = offset
+        offset += values.size
+        return [start, list(values.shape)]
+
+    for metal in data:
+        for site in data[metal]:
+            for projection, spins in data[metal][site]['pdos'].items():
+                kind = _energy_kind(projection)
+                if (metal, site, kind) not in energies:
+                    energies[(metal, site, kind)] = add_block(data[metal][site][kind])
+                for spin, values in spins.items():
+                    entries.append({
+                        'metal': metal, 'site': site, 'projection': projection, 'spin': spin,
+                        'energies': energies[(metal, site, kind)],
+                        'pdos': add_block(values),
+                    })
+
+    header = json.dumps({'version': 1, 'dtype': 'float32', 'entries': entries}).encode()
+    start = len(MAGIC) + 8 + len(header)
+    padding = (-start) % ALIGNMENT
+
+    with open(container_file, 'wb') as handle:
+        handle.write(MAGIC)
+        handle.write(struct.pack('<Q', len(header) + padding))
+        handle.write(header + b' ' * padding)
+        for values in blocks:
+            handle.write(values.astype('<f4').tobytes())
+    return container_file
+
+
+class DOSContainer:
+    """Lazy, memory mapped access to a DOS container
+
+    Example::
+
+        dos = DOSContainer('TM_dos.dos.bin')
+        energies, pdos = dos.get('Au', '211', 'CO2(sp)', '+')
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as handle:
+            if handle.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a DOS container' % filename)
+            header_length, = struct.unpack('<Q', handle.read(8))
+            header = json.loads(handle.read(header_length).decode())
+        self.data_offset = len(MAGIC) + 8 + header_length
+        self.index = {}
+        for entry in header['entries']:
+            key = (entry['metal'], entry['site'], entry['projection'], entry['spin'])
+            self.index[key] = entry
+        self._data = None
+
+    @property
+    def data(self):
+        """Flat float32 memory map of all blocks, opened on first use."""
+        if self._data is None:
+            size = (os.path.getsize(self.filename) - self.data_offset) // 4
+            self._data = np.memmap(self.filename, dtype='<f4', mode='r',
+                                   offset=self.data_offset, shape=(size,))
+        return self._data
+
+    def _block(self, block):
+        start, shape = block
+        return self.data[start:start + int(np.prod(shape))].reshape(shape)
+
+    def keys(self):
+        return self.index.keys()
+
+    def __contains__(self, key):
+        return tuple(key) in self.index
+
+    def metals(self):
+        return list(dict.fromkeys(key[0] for key in self.index))
+
+    def sites(self, metal):
+        return list(dict.fromkeys(key[1] for key in self.index if key[0] == metal))
+
+    def projections(self, metal, site):
+        return list(dict.fromkeys(key[2] for key in self.index if key[:2] == (metal, site)))
+
+    def spins(self, metal, site, projection):
+        return [key[3] for key in self.index if key[:3] == (metal, site, projection)]
+
+    def get_energies(self, metal, site, projection):
+        """Energies on which a projection is defined."""
+        key = (metal, site, projection, self.spins(metal, site, projection)[0])
+        return self._block(self.index[key]['energies'])
+
+    def get_pdos(self, metal, site, projection, spin):
+        """PDOS of a single projection and spin, shape (orbitals, energies)."""
+        return self._block(self.index[(metal, site, projection, spin)]['pdos'])
+
+    def get(self, metal, site, projection, spin):
+        """Energies and PDOS of a single projection and spin."""
+        return self.get_energies(metal, site, projection), self.get_pdos(metal, site, projection, spin)
+
+
+def open_dos_database(json_file):
+    """Open the binary version of a json DOS database
+
+    The container is (re)written next to the json file when it is
+    missing or older than the json file.
+
+    :param json_file: json DOS database
+    :type json_file: str
+    :return: container
+    :rtype: DOSContainer
+    """
+    container_file = Path(json_file).with_suffix(EXTENSION)
+    if not container_file.exists() or \
+            container_file.stat().st_mtime < Path(json_file).stat().st_mtime:
+        convert_dos_json(json_file, str(container_file))
+    return DOSContainer(str(container_file))
+
+
+@click.command()
+@click.argument('json_files', nargs=-1)
+def main(json_files):
+    """Convert json DOS databases to binary containers."""
+    for json_file in json_files:
+        container_file = convert_dos_json(json_file)
+        print('%s -> %s (%d kB -> %d kB)' % (json_file, container_file,
+            os.path.getsize(json_file) / 1024, os.path.getsize(container_file) / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,12 @@
 
 """ Making Figure 4 of the paper. """
 
+import sys
 import numpy as np
 import click
 import json
 import string
 from pathlib import Path
-from ase.db import connect
 from ase.data import atomic_numbers
 from ase.data.colors import jmol_colors
 from ase.io import read
@@ -19,18 +19,29 @@ from matplotlib.patches import Circle
 import matplotlib.pyplot as plt 
 import matplotlib.image as mpimg
 from plot_params import get_plot_params
+from dos_storage import open_dos_database
+## db_query.py is shared with Figure 2 and kept in its folder
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'figure_2_free_energy_diagram'))
+from db_query import query_columns
 
-def parsedb(results, database, sac=False, dbconfig={}):
+def parsedb(results, dbname, sac=False, dbconfig={}):
 
-    for row in database.select(*dbconfig):
+    if sac:
+        label_keys = ['vacancy_number', 'dopant_number', 'metal_dopant']
+    else:
+        label_keys = ['facets', 'sampling']
+    ## only the labels and the dipole are read from the database
+    columns = query_columns(dbname, label_keys + ['states', 'dipole_field'], **dbconfig)
+
+    for i, state in enumerate(columns['states']):
         if sac: 
-            facet = row.vacancy_number.replace('vacancy_','') + '_' + row.dopant_number.replace('dopant_','')
-            metal = row.metal_dopant.replace('metal_dopant_','').replace('_nonorth','')
+            facet = columns['vacancy_number'][i].replace('vacancy_','') + '_' + columns['dopant_number'][i].replace('dopant_','')
+            metal = columns['metal_dopant'][i].replace('metal_dopant_','').replace('_nonorth','')
         else:
-            facet = row.facets.replace('facet_','')
-            metal = row.sampling.replace('sampling_','')
-        state = row.states.replace('state_','')
-        results.setdefault(facet,{}).setdefault(metal,{}).setdefault(state,{})['dipole'] = row.dipole_field
+            facet = columns['facets'][i].replace('facet_','')
+            metal = columns['sampling'][i].replace('sampling_','')
+        state = state.replace('state_','')
+        results.setdefault(facet,{}).setdefault(metal,{}).setdefault(state,{})['dipole'] = columns['dipole_field'][i]
 
 
 def main():
@@ -39,8 +50,8 @@ def main():
     sacdbname = '../databases/single_atom_vacuum.db' 
     
     results = {}
-    parsedb(results, connect(tmdbname),)
-    parsedb(results, connect(sacdbname), sac=True)
+    parsedb(results, tmdbname)
+    parsedb(results, sacdbname, sac=True)
 
     # fig, ax = plt.subplots(1, 1, figsize=(9,4.5))
     fig = plt.figure(constrained_layout=True, figsize=(15,8))
@@ -84,9 +95,9 @@ def main():
     sac_files = '../databases/SAC_dos.json'
     gas_files = '../databases/Gas_dos.json'
 
-    tm_data = json.load(open(tm_files, 'r'))
-    sac_data = json.load(open(sac_files, 'r'))
-    gas_data = json.load(open(gas_files, 'r'))    
+    ## memory mapped binary copies of the json files, projections are read on access
+    tm_data = open_dos_database(tm_files)
+    sac_data = open_dos_database(sac_files)
 
     arrow = {
         'Ag':[0.8, -2.2, 0, 0.6],
@@ -98,20 +109,19 @@ def main():
 
     order_plots = {'Ag':2, 'Au':3, 'Cu':4, 'Pd':5, 'Pt':6}
 
-    for metal in tm_data:
+    for metal in tm_data.metals():
         if metal == 'Al':
             continue
-        for j, facet in enumerate(tm_data[metal]):
+        for j, facet in enumerate(tm_data.sites(metal)):
             if facet == '100':
                 continue
 
-            pdos_slab = np.array(tm_data[metal][facet]['pdos']['%s(d)'%metal]['+'][0])
-            pdos_ads = np.array(tm_data[metal][facet]['pdos']['CO2(sp)']['+'][0])
-            energies_ads = np.array(tm_data[metal][facet]['energies_ads'])
-            energies_slab = np.array(tm_data[metal][facet]['energies_slab'])
+            pdos_slab = np.array(tm_data.get_pdos(metal, facet, '%s(d)'%metal, '+')[0])
+            pdos_ads = np.array(tm_data.get_pdos(metal, facet, 'CO2(sp)', '+')[0])
+            energies_ads = np.array(tm_data.get_energies(metal, facet, 'CO2(sp)'))
+            energies_slab = np.array(tm_data.get_energies(metal, facet, '%s(d)'%metal))
 
-            filled_indices = [i for i in range(len(energies_ads)) if  energies_ads[i] <= 0.0]
-            filling = np.trapz(pdos_ads[filled_indices], energies_ads[filled_indices]) / np.trapz(pdos_ads, energies_ads)
+            filled_indices = energies_ads <= 0.0
             i = order_plots[metal]
             axp[i].plot(pdos_slab,\
                     energies_slab,\
@@ -135,8 +145,8 @@ def main():
                      color='tab:green', xycoords='axes fraction', fontsize=14)
                 axp[i].legend(loc='best', frameon=False, fontsize=14)
     i = 0
-    for metal in sac_data:
-        for value in sac_data[metal]:
+    for metal in sac_data.metals():
+        for value in sac_data.sites(metal):
             vacancy, dopant = value.split('_')
             if vacancy  == '2' and dopant == '4':
                 pass
@@ -146,19 +156,18 @@ def main():
             pdos_ads = []
 
 
-            for spin in sac_data[metal][value]['pdos']['%s(d)'%metal]:
-                pdos_slab.append(sac_data[metal][value]['pdos']['%s(d)'%metal][spin][0])
-                pdos_ads.append(sac_data[metal][value]['pdos']['CO2(sp)'][spin][0])
+            for spin in sac_data.spins(metal, value, '%s(d)'%metal):
+                pdos_slab.append(sac_data.get_pdos(metal, value, '%s(d)'%metal, spin)[0])
+                pdos_ads.append(sac_data.get_pdos(metal, value, 'CO2(sp)', spin)[0])
 
-            energies_ads = np.array(sac_data[metal][value]['energies_ads'])
-            energies_slab = np.array(sac_data[metal][value]['energies_slab'])
+            energies_ads = np.array(sac_data.get_energies(metal, value, 'CO2(sp)'))
+            energies_slab = np.array(sac_data.get_energies(metal, value, '%s(d)'%metal))
 
 
             summed_dos_slab = np.array(pdos_slab).sum(axis=0)
             summed_dos_ads = np.array(pdos_ads).sum(axis=0)
             axp[i].plot( summed_dos_ads, energies_ads, color='tab:green')
-            filled_indices = [i for i in range(len(energies_ads)) if  energies_ads[i] <= 0.0]
-            filling = np.trapz(summed_dos_ads[filled_indices], energies_ads[filled_indices]) / np.trapz(summed_dos_ads, energies_ads)
+            filled_indices = energies_ads <= 0.0
             axp[i].fill_between( summed_dos_ads[filled_indices], energies_ads[filled_indices], alpha=0.25, color='tab:green')
             axp[i].plot(summed_dos_slab, energies_slab, color='tab:purple', alpha=0.3)
             axp[i].annotate(r'%sN$_{4} - \left ( \mathregular{d} \right )$'%(metal),xy=(0.3,0.01),xycoords='axes fraction', fontsize=14, color='tab:purple')
@@ -1,25 +1,18 @@
 
+import sys
 import json 
+from pathlib import Path
 from pprint import pprint
 import matplotlib.pyplot as plt
 import numpy as np
 from plot_params import get_plot_params
+## tafel.py is shared with Figure 2 and kept in its folder
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'figure_2_free_energy_diagram'))
+from tafel import get_tafel_slopes
 from matplotlib.ticker import (MultipleLocator, AutoMinorLocator)
 get_plot_params()
 
 
-def get_tafel_slope(potential, tof, range_val=[]):
-    potential = np.array(potential)
-    tof = np.array(tof)
-    if range_val:
-        index_potential = [a for a in range(len(potential)) if np.min(range_val) < potential[a] < np.max(range_val)]
-        potential = potential[index_potential]
-        tof = tof[index_potential]
-    
-    fit = np.polyfit(np.log10(tof), potential,  1)
-    return -1 * fit[0] * 1e3
-
-
 if __name__ == '__main__':
 
     data = json.load(open('output/node_%s_surface_%s_facet_%s.json'%(15157, 'Au', '211')))
@@ -33,14 +26,16 @@ if __name__ == '__main__':
     she_potential, pH = np.array(potential_ph).T
 
     ax.plot(she_potential, tof_comp, '-')
-    tafel_slope = get_tafel_slope(she_potential, tof_comp, range_val=[-0.6, -1.])
+    ## the linear Tafel region is chosen automatically
+    tafel = get_tafel_slopes([(she_potential, tof_comp)])
+    tafel_slope = tafel['tafel_slope'][0]
     ax.set_ylabel(r'TOF / s$^{-1}$')
     ax.set_xlabel(r'Potential / V vs. SHE')
 
     ax.set_yscale('log')
     ax.yaxis.grid(True, which='minor')
     ax.set_title('Au(211)')
-    ax.annotate('%d mV/dec'%tafel_slope, xy=(0.4,0.7), xycoords='axes fraction' )
+    ax.annotate(r'%d $\pm$ %d mV/dec'%(tafel_slope, tafel['confidence_interval'][0]), xy=(0.4,0.7), xycoords='axes fraction' )
 
 
 
@@ -0,0 +1,140 @@
+"""Fast reader for VASP DOSCAR files.
+
+The header is parsed once and the total and projected blocks are
+converted to arrays with a single np.fromstring call each, instead
+of line by line. Parsed files are cached as .npz in ``cache_dir``
+(rebuilt when the DOSCAR changes) and many folders can be read
+in parallel with read_doscars.
+"""
+
+import os
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+CACHE_DIR = 'cache'
+
+
+@dataclass
+class Doscar:
+    efermi: float
+    energy: np.ndarray # (nedos,)
+    total_dos: np.ndarray # (nspin, nedos)
+    integrated_dos: np.ndarray # (nspin, nedos)
+    pdos: np.ndarray = None # (nions, nedos, ncolumns), None without LORBIT
+
+    @property
+    def dos(self):
+        """Total DOS, same shape as ase.calculators.vasp.VaspDos.dos"""
+        return self.total_dos[0] if len(self.total_dos) == 1 else self.total_dos
+
+    @property
+    def energy_fermi(self):
+        """Energies relative to the Fermi level."""
+        return self.energy - self.efermi
+
+
+def parse_doscar(filename):
+    """Parse a DOSCAR file
+
+    :param filename: DOSCAR file
+    :type filename: str
+    :return: parsed DOSCAR
+    :rtype: Doscar
+    """
+    with open(filename, 'r') as handle:
+        lines = handle.read().splitlines()
+
+    if len(lines) < 6:
+        raise ValueError('%s is truncated: no energy header' % filename)
+    nions = int(lines[0].split()[0])
+    emax, emin, nedos, efermi = [float(a) for a in lines[5].split()[:4]]
+    nedos = int(nedos)
+
+    if len(lines) < 6 + nedos:
+        raise ValueError('%s is truncated: expected %d energies' % (filename, nedos))
+
+    total = np.fromstring(' '.join(lines[6:6 + nedos]), sep=' ')
+    total = total.reshape(nedos, -1).T
+    nspin = (total.shape[0] - 1) // 2
+    energy = total[0]
+    total_dos = total[1:1 + nspin]
+    integrated_dos = total[1 + nspin:]
+
+    ## projected blocks follow, each with a copy of the line 6 header
+    pdos = None
+    start = 6 + nedos
+    if len(lines) >= start + nions * (nedos + 1):
+        body = []
+        for ion in range(nions):
+            first = start + ion * (nedos + 1) + 1
+            body.extend(lines[first:first + nedos])
+        pdos = np.fromstring(' '.join(body), sep=' ').reshape(nions, nedos, -1)[:, :, 1:]
+
+    return Doscar(efermi=efermi, energy=energy, total_dos=total_dos,
+                  integrated_dos=integrated_dos, pdos=pdos)
+
+
+def _cache_filename(filename, cache_dir):
+    tag = hashlib.md5(os.path.abspath(filename).encode()).hexdigest()[:10]
+    return Path(cache_dir) / ('DOSCAR_%s.npz' % tag)
+
+
+def read_doscar(filename, cache_dir=CACHE_DIR):
+    """Read a DOSCAR through the .npz cache
+
+    :param filename: DOSCAR file
+    :type filename: str
+    :param cache_dir: folder of the cache, None to switch caching off
+    :type cache_dir: str, optional
+    :return: parsed DOSCAR
+    :rtype: Doscar
+    """
+    if cache_dir is None:
+        return parse_doscar(filename)
+
+    stat = os.stat(filename)
+    stamp = np.array([stat.st_mtime, stat.st_size])
+    cachefile = _cache_filename(filename, cache_dir)
+    if cachefile.exists():
+        with np.load(cachefile) as cached:
+            if np.array_equal(cached['stamp'], stamp):
+                return Doscar(efermi=float(cached['efermi']), energy=cached['energy'],
+                              total_dos=cached['total_dos'], integrated_dos=cached['integrated_dos'],
+                              pdos=cached['pdos'] if 'pdos' in cached.files else None)
+
+    doscar = parse_doscar(filename)
+    arrays = {'stamp': stamp, 'efermi': np.array(doscar.efermi), 'energy': doscar.energy,
+              'total_dos': doscar.total_dos, 'integrated_dos': doscar.integrated_dos}
+    if doscar.pdos is not None:
+        arrays['pdos'] = doscar.pdos
+    cachefile.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(cachefile, **arrays)
+    return doscar
+
+
+def read_doscars(folders, cache_dir=CACHE_DIR, processes=None):
+    """Read the DOSCAR of many folders in parallel
+
+    :param folders: folders that contain a DOSCAR, or dict of label -> folder
+    :type folders: list or dict
+    :param cache_dir: folder of the cache, None to switch caching off
+    :type cache_dir: str, optional
+    :param processes: number of worker processes, defaults to the number of cpus
+    :type processes: int, optional
+    :return: label (or folder) -> Doscar
+    :rtype: dict
+    """
+    if not isinstance(folders, dict):
+        folders = {folder: folder for folder in folders}
+    filenames = [os.path.join(folder, 'DOSCAR') for folder in folders.values()]
+
+    if len(filenames) == 1 or processes == 1:
+        parsed = [read_doscar(f, cache_dir) for f in filenames]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            parsed = list(executor.map(read_doscar, filenames, [cache_dir] * len(filenames)))
+
+    return dict(zip(folders, parsed))
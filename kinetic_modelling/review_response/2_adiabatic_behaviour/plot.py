@@ -1,7 +1,6 @@
 
-import os.path as op
 import matplotlib.pyplot as plt
-from ase.calculators.vasp import VaspDos
+from doscar import read_doscars
 from plot_params import get_plot_params
 get_plot_params()
 
@@ -16,19 +15,12 @@ if __name__ == '__main__':
                     }
     fig, ax = plt.subplots(1, 1, figsize=(4,6), constrained_layout=True)
 
-    for system, folder in folders.items():
-        dos = VaspDos(op.join(folder,'DOSCAR'))
-        # get Fermi level from DOSCAR
-        dosfile = open(op.join(folder,'DOSCAR'))
-        for i, line in enumerate(dosfile):
-            if i == 5:
-                values = line.split()
-                break
+    ## all folders parsed (in parallel) with the header read only once
+    doscars = read_doscars(folders)
 
+    for system, dos in doscars.items():
         # get energies and subtract Fermi level
-        efermi = float(values[-2])
-
-        energy = dos.energy - efermi
+        energy = dos.energy_fermi
         # get all DOS
         total_dos = dos.dos
 
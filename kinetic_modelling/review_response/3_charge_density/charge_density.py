@@ -0,0 +1,200 @@
+"""Plane averaged charge density differences from volumetric files.
+
+The CHGCAR or cube files are memory mapped and the volumetric data is
+parsed in chunks of a few MB. Every chunk is immediately reduced onto
+the z profile and the y averaged (x, z) map, so the full 3D grid is
+never held in memory. Because plane averaging is linear, the averages
+of rho(AB) - rho(A) - rho(B) are the differences of the averages of
+the three files.
+
+The output has the format of the files in inputs/ used by plot.py::
+
+    python charge_density.py AB/CHGCAR A/CHGCAR B/CHGCAR --output inputs/cdd_Au_211.json
+"""
+
+import re
+import json
+import mmap
+import numpy as np
+import click
+from ase import units
+
+CHUNK_BYTES = 2**24
+## any letter except the exponent marks text after the grid (e.g. augmentation occupancies)
+END_OF_GRID = re.compile(rb'[A-DF-Za-df-z]')
+
+
+def _read_chgcar_header(handle):
+    """Cell, grid shape and byte offset of the data of a CHGCAR/LOCPOT."""
+    handle.readline() # comment
+    scale = float(handle.readline().split()[0])
+    cell = np.array([[float(a) for a in handle.readline().split()[:3]] for _ in range(3)])
+    ## a negative scale is the volume of the cell
+    if scale < 0:
+        scale = (-scale / abs(np.linalg.det(cell)))**(1 / 3)
+    cell = cell * scale
+    tokens = handle.readline().split()
+    if not tokens[0].isdigit():
+        tokens = handle.readline().split() # vasp 5 species line
+    natoms = sum(int(a) for a in tokens)
+    line = handle.readline()
+    if line.strip()[:1] in (b's', b'S'):
+        line = handle.readline() # selective dynamics
+    for _ in range(natoms):
+        handle.readline()
+    line = handle.readline()
+    while not line.strip():
+        line = handle.readline()
+    shape = tuple(int(a) for a in line.split()[:3])
+    return {'cell': cell, 'shape': shape, 'offset': handle.tell(), 'order': 'F',
+            'scale': 1 / abs(np.linalg.det(cell))}
+
+
+def _read_cube_header(handle):
+    """Cell, grid shape and byte offset of the data of a Gaussian cube file."""
+    handle.readline() ; handle.readline()
+    tokens = handle.readline().split()
+    natoms = int(tokens[0])
+    shape = [] ; cell = []
+    for _ in range(3):
+        tokens = handle.readline().split()
+        shape.append(int(tokens[0]))
+        cell.append(int(tokens[0]) * np.array([float(a) for a in tokens[1:4]]) * units.Bohr)
+    for _ in range(abs(natoms)):
+        handle.readline()
+    if natoms < 0:
+        handle.readline() # orbital line
+    return {'cell': np.array(cell), 'shape': tuple(shape), 'offset': handle.tell(), 'order': 'C',
+            'scale': 1 / units.Bohr**3}
+
+
+def read_header(filename):
+    """Read the header of a CHGCAR (or LOCPOT/AECCAR) or a .cube file
+
+    :param filename: volumetric file
+    :type filename: str
+    :return: cell (in Angstrom), grid shape, byte offset of the data, storage
+        order and the factor converting the stored values to e/Angstrom^3
+    :rtype: dict
+    """
+    with open(filename, 'rb') as handle:
+        if filename.endswith('.cube'):
+            return _read_cube_header(handle)
+        return _read_chgcar_header(handle)
+
+
+def iterate_values(filename, header, chunk_bytes=CHUNK_BYTES):
+    """Yield (start index, values) of the volumetric data chunk by chunk
+
+    Only the first block of the grid is read; augmentation charges and
+    the magnetisation block of spin polarised CHGCARs are skipped.
+    """
+    ntotal = int(np.prod(header['shape']))
+    with open(filename, 'rb') as handle:
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = header['offset']
+            count = 0
+            while count < ntotal and position < len(data):
+                stop = min(position + chunk_bytes, len(data))
+                if stop < len(data):
+                    ## do not split a number between two chunks
+                    stop = max(data.rfind(b' ', position, stop), data.rfind(b'\n', position, stop)) + 1
+                text = data[position:stop]
+                end = END_OF_GRID.search(text)
+                if end is not None:
+                    text = text[:end.start()]
+                values = np.fromstring(text, sep=' ')
+                values = values[:ntotal - count]
+                yield count, values
+                count += len(values)
+                position = stop
+    if count < ntotal:
+        raise ValueError('%s has %d grid values, expected %d' % (filename, count, ntotal))
+
+
+def plane_averages(filename, chunk_bytes=CHUNK_BYTES):
+    """z profile and y averaged (x, z) map of the density in a volumetric file
+
+    :param filename: CHGCAR or cube file
+    :type filename: str
+    :param chunk_bytes: size of the chunks that are parsed at once, defaults to 16 MB
+    :type chunk_bytes: int, optional
+    :return: header, average over xy (nz,) and average over y (nx, nz) in e/Angstrom^3
+    :rtype: tuple
+    """
+    header = read_header(filename)
+    nx, ny, nz = header['shape']
+    z_profile = np.zeros(nz)
+    xz_map = np.zeros(nx * nz)
+    for start, values in iterate_values(filename, header, chunk_bytes=chunk_bytes):
+        k = start + np.arange(len(values))
+        if header['order'] == 'F': # x runs fastest (VASP)
+            ix = k % nx
+            iz = k // (nx * ny)
+        else: # z runs fastest (cube)
+            iz = k % nz
+            ix = k // (ny * nz)
+        z_profile += np.bincount(iz, weights=values, minlength=nz)
+        xz_map += np.bincount(ix * nz + iz, weights=values, minlength=nx * nz)
+
+    z_profile *= header['scale'] / (nx * ny)
+    xz_map *= header['scale'] / ny
+    return header, z_profile, xz_map.reshape(nx, nz)
+
+
+def charge_density_difference(filename_AB, filename_A, filename_B, chunk_bytes=CHUNK_BYTES):
+    """Plane averaged rho(AB) - rho(A) - rho(B) and its dipole
+
+    :param filename_AB: density of the combined system
+    :type filename_AB: str
+    :param filename_A: density of the first fragment, e.g. the slab
+    :type filename_A: str
+    :param filename_B: density of the second fragment, e.g. the adsorbate
+    :type filename_B: str
+    :return: 'z', 'cdd' (xy average), 'xy' (y average, (nx, nz)), the transferred
+        charge and the dipole in e Angstrom (electrons counted negative)
+    :rtype: dict
+    """
+    header, cdd, xy = plane_averages(filename_AB, chunk_bytes=chunk_bytes)
+    for sign_file in (filename_A, filename_B):
+        other, z_profile, xz_map = plane_averages(sign_file, chunk_bytes=chunk_bytes)
+        if other['shape'] != header['shape']:
+            raise ValueError('Grid of %s %s does not match %s' % (sign_file, other['shape'], header['shape']))
+        cdd -= z_profile
+        xy -= xz_map
+
+    cell = header['cell']
+    nz = header['shape'][2]
+    area = np.linalg.norm(np.cross(cell[0], cell[1]))
+    length_z = cell[2, 2]
+    z = np.arange(nz) * length_z / nz
+    dz = length_z / nz
+
+    ## line density along z in e/Angstrom
+    line_density = cdd * area
+    return {
+        'z': z,
+        'cdd': cdd,
+        'xy': xy,
+        'charge': np.sum(line_density) * dz,
+        'dipole': -1 * np.sum(z * line_density) * dz,
+    }
+
+
+@click.command()
+@click.argument('filename_ab')
+@click.argument('filename_a')
+@click.argument('filename_b')
+@click.option('--output', default='inputs/cdd.json', help='json file read by plot.py')
+@click.option('--chunk_mb', default=16, help='size of the parsed chunks in MB')
+def main(filename_ab, filename_a, filename_b, output, chunk_mb):
+    """Write the plane averaged charge density difference of AB - A - B."""
+    results = charge_density_difference(filename_ab, filename_a, filename_b, chunk_bytes=chunk_mb * 2**20)
+    print('Charge: %1.3f e, dipole: %1.3f eA'%(results['charge'], results['dipole']))
+    with open(output, 'w') as handle:
+        json.dump({'xy': results['xy'].tolist(), 'cdd': results['cdd'].tolist(),
+                   'z': results['z'].tolist()}, handle)
+
+
+if __name__ == '__main__':
+    main()